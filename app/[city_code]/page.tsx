@@ -1,9 +1,8 @@
 import Link from 'next/link';
-import { getMunicipalities } from '@/lib/data';
+import { getMunicipality } from '@/lib/data';
 
 export default async function CityDetailPage({ params }: { params: { city_code: string } }) {
-  const municipalities = await getMunicipalities();
-  const city = municipalities.find((item) => item.code === params.city_code);
+  const city = await getMunicipality(params.city_code);
 
   if (!city) {
     return <main className="p-6">該当する市区町村が見つかりませんでした。</main>;
@@ -1,9 +1,13 @@
 import Link from 'next/link';
-import { getMunicipalities } from '@/lib/data';
+import { getMunicipalityFeatures, getRentClasses, getRentSummary } from '@/lib/data';
 import HomeShell from '@/components/map/HomeShell';
 
 export default async function HomePage() {
-  const municipalities = await getMunicipalities();
+  const [municipalities, summary, rentClasses] = await Promise.all([
+    getMunicipalityFeatures(),
+    getRentSummary(),
+    getRentClasses()
+  ]);
 
   return (
     <main className="p-6">
@@ -13,7 +17,7 @@ export default async function HomePage() {
           ログイン / 登録
         </Link>
       </header>
-      <HomeShell municipalities={municipalities} />
+      <HomeShell municipalities={municipalities} summary={summary} rentClasses={rentClasses} />
     </main>
   );
 }
@@ -3,22 +3,46 @@
 import dynamic from 'next/dynamic';
 import { useMemo, useState } from 'react';
 import Link from 'next/link';
-import type { Municipality } from '@/lib/types';
+import { classifyRents } from '@/lib/rent';
+import type { MunicipalityFeature, RentSummary } from '@/lib/types';
 
 const JapanMap = dynamic(() => import('./JapanMap'), { ssr: false });
 
-export default function HomeShell({ municipalities }: { municipalities: Municipality[] }) {
+type Props = {
+  municipalities: MunicipalityFeature[];
+  summary: RentSummary | null;
+  rentClasses: Record<string, number>;
+};
+
+export default function HomeShell({ municipalities, summary, rentClasses }: Props) {
   const [query, setQuery] = useState('');
-  const [selected, setSelected] = useState<Municipality | null>(municipalities[0] ?? null);
+  const [selected, setSelected] = useState<MunicipalityFeature | null>(municipalities[0] ?? null);
+
+  // Classes come from the import; without them the loaded rents are classified here.
+  const scheme = useMemo(
+    () =>
+      summary?.classification && Object.keys(rentClasses).length > 0
+        ? { classification: summary.classification, rentClasses }
+        : classifyRents(municipalities),
+    [municipalities, summary, rentClasses]
+  );
 
+  // Precomputed at import time; only recomputed when the summary table is empty.
   const stats = useMemo(() => {
+    if (summary) {
+      return {
+        count: municipalities.length,
+        avg: Math.round(summary.mean ?? 0),
+        median: summary.median === null ? null : Math.round(summary.median)
+      };
+    }
     const rentValues = municipalities.map((x) => x.rent_avg).filter((x): x is number => !!x);
     const avg = rentValues.length
       ? Math.round(rentValues.reduce((sum, value) => sum + value, 0) / rentValues.length)
       : 0;
 
-    return { count: municipalities.length, avg };
-  }, [municipalities]);
+    return { count: municipalities.length, avg, median: null };
+  }, [municipalities, summary]);
 
   return (
     <section className="grid grid-cols-1 gap-4 lg:grid-cols-[1fr_320px]">
@@ -32,8 +56,27 @@ export default function HomeShell({ municipalities }: { municipalities: Municipa
           />
           <div className="rounded border bg-white px-3 py-2 text-sm">{stats.count} 自治体</div>
           <div className="rounded border bg-white px-3 py-2 text-sm">平均 {stats.avg.toLocaleString()} 円</div>
+          {stats.median !== null && (
+            <div className="rounded border bg-white px-3 py-2 text-sm">中央値 {stats.median.toLocaleString()} 円</div>
+          )}
         </div>
-        <JapanMap municipalities={municipalities} onSelect={setSelected} query={query} />
+        <JapanMap
+          municipalities={municipalities}
+          onSelect={setSelected}
+          query={query}
+          classification={scheme.classification}
+          rentClasses={scheme.rentClasses}
+        />
+        {scheme.classification && (
+          <ul className="mt-2 flex flex-wrap gap-3 text-xs">
+            {scheme.classification.legend.map((item) => (
+              <li key={item.color} className="flex items-center gap-1">
+                <span className="inline-block h-3 w-3 rounded-sm" style={{ background: item.color }} />
+                {Math.round(item.min).toLocaleString()} - {Math.round(item.max).toLocaleString()} 円
+              </li>
+            ))}
+          </ul>
+        )}
       </div>
       <aside className="rounded border bg-white p-4">
         <h2 className="mb-3 text-lg font-semibold">市区町村詳細</h2>
@@ -2,16 +2,18 @@
 
 import { MapContainer, GeoJSON, TileLayer } from 'react-leaflet';
 import 'leaflet/dist/leaflet.css';
-import type { Municipality } from '@/lib/types';
-import { rentToColor } from '@/lib/rent';
+import type { MunicipalityFeature, RentClassification } from '@/lib/types';
+import { rentClassColor } from '@/lib/rent';
 
 type Props = {
-  municipalities: Municipality[];
-  onSelect: (item: Municipality) => void;
+  municipalities: MunicipalityFeature[];
+  onSelect: (item: MunicipalityFeature) => void;
   query: string;
+  classification: RentClassification | null;
+  rentClasses: Record<string, number>;
 };
 
-export default function JapanMap({ municipalities, onSelect, query }: Props) {
+export default function JapanMap({ municipalities, onSelect, query, classification, rentClasses }: Props) {
   const normalized = query.trim().toLowerCase();
   const filtered = municipalities.filter((m) =>
     normalized ? m.name.toLowerCase().includes(normalized) : true
@@ -27,7 +29,12 @@ export default function JapanMap({ municipalities, onSelect, query }: Props) {
         <GeoJSON
           key={item.code}
           data={item.geojson as GeoJSON.GeoJsonObject}
-          style={{ color: '#374151', weight: 0.8, fillColor: rentToColor(item.rent_avg), fillOpacity: 0.7 }}
+          style={{
+            color: '#374151',
+            weight: 0.8,
+            fillColor: rentClassColor(classification, rentClasses[item.code]),
+            fillOpacity: 0.7
+          }}
           eventHandlers={{
             click: () => onSelect(item)
           }}
@@ -1,21 +1,24 @@
 import fallbackGeo from '@/data/fallback/municipalities';
-import type { Municipality } from './types';
+import type { Municipality, MunicipalityFeature, RentSummary } from './types';
 import { createClient } from './supabase/server';
 
-export async function getMunicipalities(): Promise<Municipality[]> {
-  try {
-    const supabase = await createClient();
-    const { data } = await supabase
-      .from('municipalities')
-      .select('code,name,prefecture_code,rent_avg,population,area_km2,geojson');
+const ATTRIBUTE_COLUMNS = 'code,name,prefecture_code,rent_avg,population,area_km2';
 
-    if (data && data.length > 0) {
-      return data as Municipality[];
-    }
-  } catch {
-    // fallback to static sample for first deployment
-  }
+// Level of detail drawn on the nationwide map (see scripts/simplify.py DEFAULT_LEVELS).
+export const MAP_LOD = 'prefecture';
+
+// Coarsest first, as in scripts/simplify.py DEFAULT_LEVELS.
+const LODS = ['nation', 'prefecture', 'city'];
+
+// `lod`, then the finer levels (closest first), then the coarser ones. Right after
+// supabase/migrations/split_geometry.sql only 'city' exists until the importer is re-run.
+function lodFallbacks(lod: string): string[] {
+  const index = LODS.indexOf(lod);
+  if (index < 0) return [lod, ...[...LODS].reverse()];
+  return [lod, ...LODS.slice(index + 1), ...LODS.slice(0, index).reverse()];
+}
 
+function fallbackFeatures(): MunicipalityFeature[] {
   return ((fallbackGeo.features || []) as any[]).map((feature) => ({
     code: feature.properties.code,
     name: feature.properties.name,
@@ -26,3 +29,108 @@ export async function getMunicipalities(): Promise<Municipality[]> {
     geojson: feature.geometry as GeoJSON.GeoJsonObject
   }));
 }
+
+function withoutGeometry({ geojson: _geojson, ...attributes }: MunicipalityFeature): Municipality {
+  return attributes;
+}
+
+// Attributes only: geometry is never read for lists, lookups or stats.
+export async function getMunicipalities(): Promise<Municipality[]> {
+  try {
+    const supabase = await createClient();
+    const { data } = await supabase.from('municipalities').select(ATTRIBUTE_COLUMNS);
+
+    if (data && data.length > 0) {
+      return data as Municipality[];
+    }
+  } catch {
+    // fallback to static sample for first deployment
+  }
+
+  return fallbackFeatures().map(withoutGeometry);
+}
+
+export async function getMunicipality(code: string): Promise<Municipality | null> {
+  try {
+    const supabase = await createClient();
+    const { data } = await supabase.from('municipalities').select(ATTRIBUTE_COLUMNS).eq('code', code).maybeSingle();
+
+    if (data) {
+      return data as Municipality;
+    }
+  } catch {
+    // fallback to static sample for first deployment
+  }
+
+  return fallbackFeatures().map(withoutGeometry).find((item) => item.code === code) ?? null;
+}
+
+// Attributes joined with one level of detail of the geometry, for the map. When `lod` has
+// not been imported, the nearest level that has is used instead of the static sample.
+export async function getMunicipalityFeatures(lod = MAP_LOD): Promise<MunicipalityFeature[]> {
+  try {
+    const supabase = await createClient();
+    const geometriesAt = (level: string) =>
+      supabase.from('municipality_geometries').select('code,geojson').eq('lod', level);
+    const candidates = lodFallbacks(lod);
+    const [attributes, requested] = await Promise.all([
+      supabase.from('municipalities').select(ATTRIBUTE_COLUMNS),
+      geometriesAt(candidates[0])
+    ]);
+    let geometries = requested;
+    for (const level of candidates.slice(1)) {
+      if (!attributes.data?.length || geometries.data?.length) break;
+      geometries = await geometriesAt(level);
+    }
+
+    if (attributes.data && attributes.data.length > 0 && geometries.data && geometries.data.length > 0) {
+      const shapes = new Map(geometries.data.map((row) => [row.code, row.geojson as GeoJSON.GeoJsonObject]));
+      return (attributes.data as Municipality[])
+        .filter((item) => shapes.has(item.code))
+        .map((item) => ({ ...item, geojson: shapes.get(item.code)! }));
+    }
+  } catch {
+    // fallback to static sample for first deployment
+  }
+
+  return fallbackFeatures();
+}
+
+// Precomputed by scripts/import_to_supabase.py (rent_stats table).
+export async function getRentSummary(scope = 'national'): Promise<RentSummary | null> {
+  try {
+    const supabase = await createClient();
+    const { data } = await supabase
+      .from('rent_stats')
+      .select('scope,count,mean,median,min,max,percentiles,histogram,classification')
+      .eq('scope', scope)
+      .maybeSingle();
+
+    if (data) {
+      return data as RentSummary;
+    }
+  } catch {
+    // table not populated yet
+  }
+
+  return null;
+}
+
+// Color class of every ranked municipality (municipality_rent_ranks.rent_class),
+// an index into the national classification palette.
+export async function getRentClasses(): Promise<Record<string, number>> {
+  try {
+    const supabase = await createClient();
+    const { data } = await supabase.from('municipality_rent_ranks').select('code,rent_class');
+
+    if (data) {
+      return Object.fromEntries(
+        data.filter((row) => row.rent_class !== null).map((row) => [row.code, row.rent_class as number])
+      );
+    }
+  } catch {
+    // table not populated yet
+  }
+
+  return {};
+}
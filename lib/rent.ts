@@ -1,8 +1,63 @@
-export function rentToColor(rent: number | null): string {
-  if (!rent) return '#d1d5db';
-  if (rent < 40000) return '#dbeafe';
-  if (rent < 60000) return '#93c5fd';
-  if (rent < 80000) return '#60a5fa';
-  if (rent < 100000) return '#3b82f6';
-  return '#1d4ed8';
+import type { Municipality, RentClassification } from './types';
+
+// Municipalities without a rent value, or before import_to_supabase.py has classified them.
+export const NO_DATA_COLOR = '#d1d5db';
+
+// scripts/classify.py PALETTE, lowest rent first.
+export const RENT_PALETTE = ['#5352ed', '#1e90ff', '#2ed573', '#7bed9f', '#ffd43b', '#ffa502', '#ff6b81', '#ff4757'];
+
+export type RentScheme = {
+  classification: RentClassification | null;
+  rentClasses: Record<string, number>;
+};
+
+// Breaks, palette and each municipality's class are precomputed by
+// scripts/classify.py (shared with tokyo-rental-map/build.py); only the color is looked up here.
+export function rentClassColor(classification: RentClassification | null, rentClass: number | undefined): string {
+  if (!classification || rentClass === undefined) return NO_DATA_COLOR;
+  return classification.palette[rentClass] ?? NO_DATA_COLOR;
+}
+
+// Linear interpolation between the closest ranks, as numpy.quantile does.
+function quantile(sorted: number[], q: number): number {
+  const position = (sorted.length - 1) * q;
+  const lower = Math.floor(position);
+  const upper = Math.min(lower + 1, sorted.length - 1);
+  return sorted[lower] + (sorted[upper] - sorted[lower]) * (position - lower);
+}
+
+// Quantile classes over the loaded rents (classify.py's default method), for when
+// import_to_supabase.py has not written a classification: the static fallback sample,
+// or a database whose rent_stats has not been populated yet.
+export function classifyRents(municipalities: Municipality[]): RentScheme {
+  const rented = municipalities.filter((m): m is Municipality & { rent_avg: number } => !!m.rent_avg);
+  if (rented.length === 0) return { classification: null, rentClasses: {} };
+
+  const sorted = rented.map((m) => m.rent_avg).sort((a, b) => a - b);
+  const classes = RENT_PALETTE.length;
+  // Ties can repeat a break; the empty classes they would create are dropped.
+  const breaks = [...new Set(Array.from({ length: classes }, (_, i) => quantile(sorted, (i + 1) / classes)))];
+  breaks[breaks.length - 1] = sorted[sorted.length - 1];
+  const palette =
+    breaks.length <= 1
+      ? breaks.map(() => RENT_PALETTE[classes - 1])
+      : breaks.map((_, i) => RENT_PALETTE[Math.round((i * (classes - 1)) / (breaks.length - 1))]);
+
+  const counts = breaks.map(() => 0);
+  const rentClasses: Record<string, number> = {};
+  for (const item of rented) {
+    const index = breaks.findIndex((limit) => item.rent_avg <= limit);
+    rentClasses[item.code] = index;
+    counts[index] += 1;
+  }
+  const lowers = [sorted[0], ...breaks.slice(0, -1)];
+  return {
+    classification: {
+      method: 'quantile',
+      breaks,
+      palette,
+      legend: breaks.map((max, i) => ({ min: lowers[i], max, color: palette[i], count: counts[i] }))
+    },
+    rentClasses
+  };
 }
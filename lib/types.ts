@@ -5,6 +5,10 @@ export type Municipality = {
   rent_avg: number | null;
   population: number | null;
   area_km2: number | null;
+};
+
+// Geometry lives in municipality_geometries, one row per level of detail.
+export type MunicipalityFeature = Municipality & {
   geojson: GeoJSON.GeoJsonObject;
 };
 
@@ -15,3 +19,23 @@ export type BoardPost = {
   content: string;
   created_at: string;
 };
+
+// Computed by scripts/classify.py; legend entries are lowest class first.
+export type RentClassification = {
+  method: string;
+  breaks: number[];
+  palette: string[];
+  legend: { min: number; max: number; color: string; count: number }[];
+};
+
+export type RentSummary = {
+  scope: string;
+  count: number;
+  mean: number | null;
+  median: number | null;
+  min: number | null;
+  max: number | null;
+  percentiles: Record<string, number>;
+  histogram: { edges: number[]; counts: number[] };
+  classification: RentClassification | null;
+};
@@ -0,0 +1,183 @@
+"""Pooled asyncio HTTP client shared by the fetch scripts (``--transport async``).
+
+One ``httpx.AsyncClient`` keeps connections alive across requests (optionally
+over HTTP/2, which needs the ``h2`` package and a TLS server) and every
+request first takes a slot of its host's semaphore, so many e-Stat pages and
+several GeoJSON sources can be in flight from one event loop without
+opening more than ``per_host`` connections to any single server.
+
+The on-disk cache (http_cache.py) wraps ``requests`` and is not used on this
+path. httpx is only imported once an ``AsyncFetcher`` is created, so the
+scripts run with the default ``--transport sync`` without it.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+from dataclasses import dataclass, field, fields
+from typing import TYPE_CHECKING, AsyncIterator, Awaitable, Callable, TypeVar
+from urllib.parse import urlsplit
+
+from rate_limit import Throttle, retry_after_seconds, throttled_async
+
+DEFAULT_CONNECTIONS = 32
+DEFAULT_PER_HOST = 8
+DEFAULT_TIMEOUT = 60.0
+KEEPALIVE_EXPIRY = 30.0
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+T = TypeVar("T")
+
+if TYPE_CHECKING:
+  import httpx
+
+
+@dataclass
+class FetchStats:
+  requests: int = 0
+  retries: int = 0
+  bytes_downloaded: int = 0
+  # HTTP version -> responses, e.g. {"HTTP/1.1": 12}.
+  versions: dict[str, int] = field(default_factory=dict)
+
+  def summary(self) -> str:
+    counts = [f"{f.name}={getattr(self, f.name):,}" for f in fields(self) if f.name != "versions"]
+    counts += [f"{version}={count:,}" for version, count in sorted(self.versions.items())]
+    return ", ".join(counts)
+
+
+class AsyncFetcher:
+  """``httpx.AsyncClient`` with a bounded keep-alive pool and a concurrency limit per host."""
+
+  def __init__(
+    self,
+    *,
+    connections: int = DEFAULT_CONNECTIONS,
+    per_host: int = DEFAULT_PER_HOST,
+    http2: bool = False,
+    timeout: float = DEFAULT_TIMEOUT,
+  ) -> None:
+    import httpx
+
+    limits = httpx.Limits(
+      max_connections=connections,
+      max_keepalive_connections=connections,
+      keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+    self.client = httpx.AsyncClient(http2=http2, limits=limits, timeout=timeout, follow_redirects=True)
+    self.per_host = max(1, per_host)
+    self.stats = FetchStats()
+    self._hosts: dict[str, asyncio.Semaphore] = {}
+
+  async def __aenter__(self) -> "AsyncFetcher":
+    return self
+
+  async def __aexit__(self, exc_type, exc, tb) -> None:
+    await self.client.aclose()
+
+  def _slot(self, url: str) -> asyncio.Semaphore:
+    host = urlsplit(url).netloc
+    if host not in self._hosts:
+      self._hosts[host] = asyncio.Semaphore(self.per_host)
+    return self._hosts[host]
+
+  def _count(self, response: httpx.Response) -> None:
+    self.stats.requests += 1
+    self.stats.bytes_downloaded += response.num_bytes_downloaded
+    self.stats.versions[response.http_version] = self.stats.versions.get(response.http_version, 0) + 1
+
+  async def get(self, url: str, params: dict | None = None) -> httpx.Response:
+    async with self._slot(url):
+      response = await self.client.get(url, params=params)
+    self._count(response)
+    return response
+
+  async def get_json(
+    self,
+    url: str,
+    params: dict | None = None,
+    retries: int = 4,
+    backoff: float = 1.0,
+    throttle: Throttle | None = None,
+    check: Callable[[dict], object] | None = None,
+  ) -> dict:
+    """GET and decode JSON, retrying transient failures with exponential backoff (like ``estat.get_json``).
+
+    ``check`` runs on the payload inside the throttled attempt, so an error it
+    raises (e.g. ``estat.check_status`` on an error reported with HTTP 200)
+    counts as an error for the throttle. It is not retried.
+    """
+    import httpx
+
+    for attempt in range(retries + 1):
+      try:
+        async with throttled_async(throttle) as outcome:
+          response = await self.get(url, params)
+          outcome.retry_after = retry_after_seconds(response.headers.get("Retry-After"))
+          response.raise_for_status()
+          payload = response.json()
+          if check is not None:
+            check(payload)
+          return payload
+      except httpx.HTTPStatusError as exc:
+        if exc.response.status_code not in RETRY_STATUS:
+          raise
+        error: Exception = exc
+      except httpx.TransportError as exc:
+        error = exc
+      if attempt == retries:
+        raise error
+      self.stats.retries += 1
+      await asyncio.sleep(backoff * 2**attempt)
+    raise AssertionError("unreachable")
+
+  async def iter_bytes(self, url: str, chunk_size: int = 1 << 20) -> AsyncIterator[bytes]:
+    """Stream the body; the host slot is held until the body has been read."""
+    async with self._slot(url), self.client.stream("GET", url) as response:
+      response.raise_for_status()
+      async for chunk in response.aiter_bytes(chunk_size):
+        yield chunk
+      self._count(response)
+
+
+def run_with(fetcher: AsyncFetcher, work: Callable[[AsyncFetcher], Awaitable[T]]) -> T:
+  """Run ``work(fetcher)`` on a fresh event loop and close the fetcher afterwards."""
+
+  async def run() -> T:
+    async with fetcher:
+      return await work(fetcher)
+
+  return asyncio.run(run())
+
+
+def add_async_arguments(parser: argparse.ArgumentParser) -> None:
+  group = parser.add_argument_group("非同期 HTTP")
+  group.add_argument(
+    "--transport",
+    choices=["sync", "async"],
+    default="sync",
+    help="async: 1 つのイベントループから接続を使い回して並行取得（HTTP キャッシュは使いません）",
+  )
+  group.add_argument("--http2", action="store_true", help="--transport async で HTTP/2 を使う（h2 パッケージと HTTPS が必要）")
+  group.add_argument("--connections", type=int, default=DEFAULT_CONNECTIONS, help="--transport async の最大接続数")
+  group.add_argument("--per-host", type=int, default=DEFAULT_PER_HOST, help="--transport async のホストごとの同時リクエスト数")
+
+
+def fetcher_from_args(args: argparse.Namespace) -> AsyncFetcher | None:
+  """An ``AsyncFetcher`` for ``--transport async``, otherwise None."""
+  if args.transport != "async":
+    return None
+  try:
+    import httpx  # noqa: F401
+  except ImportError:
+    raise SystemExit("--transport async には httpx パッケージが必要です（pip install httpx）。")
+  try:
+    return AsyncFetcher(connections=args.connections, per_host=args.per_host, http2=args.http2)
+  except ImportError:
+    raise SystemExit("--http2 には h2 パッケージが必要です（pip install 'httpx[http2]'）。")
+
+
+def print_fetch_stats(fetcher: AsyncFetcher | None) -> None:
+  if fetcher is not None:
+    print(f"http: {fetcher.stats.summary()}")
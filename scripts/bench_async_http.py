@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""Compare sequential ``requests.get`` calls with the pooled async transport.
+
+Starts a local stub that serves paged getStatsData responses and GeoJSON
+sources with a fixed latency per request, then fetches the same workload
+(several stats tables plus several GeoJSON files) twice: one blocking
+``requests.get`` after another on a fresh connection each (what the fetch
+scripts did before ``--transport async``), and everything from one event loop
+with ``AsyncFetcher``. Prints wall time, requests per second and the number
+of TCP connections the stub accepted.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
+from async_http import DEFAULT_PER_HOST, AsyncFetcher
+from estat import fetch_many_async, page_params, payload_values, total_number
+from fetch_geojson import fetch_all_async, fetch_geojson
+
+
+class Stub(ThreadingHTTPServer):
+  daemon_threads = True
+
+  def __init__(self, latency: float, cells: int, features: int) -> None:
+    super().__init__(("127.0.0.1", 0), StubHandler)
+    self.latency = latency
+    self.cells = cells
+    self.features = features
+    self.connections = 0
+    self.lock = threading.Lock()
+
+  @property
+  def url(self) -> str:
+    return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+  protocol_version = "HTTP/1.1"
+  server: Stub
+
+  def setup(self) -> None:
+    super().setup()
+    with self.server.lock:
+      self.server.connections += 1
+
+  def log_message(self, *args) -> None:
+    pass
+
+  def do_GET(self) -> None:
+    time.sleep(self.server.latency)
+    url = urlsplit(self.path)
+    query = {key: values[0] for key, values in parse_qs(url.query).items()}
+    if url.path.startswith("/geojson/"):
+      body = self.geojson(url.path.rsplit("/", 1)[-1])
+    elif query.get("cntGetFlg") == "Y":
+      body = self.stats({"RESULT_INF": {"TOTAL_NUMBER": self.server.cells}})
+    else:
+      start, limit = int(query["startPosition"]), int(query["limit"])
+      values = [
+        {"@area": f"{13100 + i % 900:05d}", "@time": "2018000000", "$": str(50000 + i)}
+        for i in range(start - 1, min(start - 1 + limit, self.server.cells))
+      ]
+      body = self.stats({"DATA_INF": {"VALUE": values}})
+    data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+    self.send_response(200)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(data)))
+    self.end_headers()
+    self.wfile.write(data)
+
+  def stats(self, data: dict) -> dict:
+    return {"GET_STATS_DATA": {"RESULT": {"STATUS": 0}, "STATISTICAL_DATA": data}}
+
+  def geojson(self, name: str) -> dict:
+    features = [
+      {
+        "type": "Feature",
+        "properties": {"N03_004": f"{name}-{i}", "N03_007": f"{13100 + i:05d}"},
+        "geometry": {"type": "Point", "coordinates": [139.0 + i / 1000, 35.0]},
+      }
+      for i in range(self.server.features)
+    ]
+    return {"type": "FeatureCollection", "features": features}
+
+
+def sequential(endpoint: str, queries: list[dict], sources: list[str], page_size: int) -> tuple[list, list]:
+  tables = []
+  for params in queries:
+    response = requests.get(endpoint, params={**params, "cntGetFlg": "Y"}, timeout=60)
+    response.raise_for_status()
+    total = total_number(response.json())
+    values = []
+    for start in range(1, total + 1, page_size):
+      response = requests.get(endpoint, params=page_params(params, start, page_size), timeout=60)
+      response.raise_for_status()
+      values.extend(payload_values(response.json()))
+    tables.append(values)
+  return tables, [fetch_geojson(source) for source in sources]
+
+
+async def concurrent(
+  endpoint: str,
+  queries: list[dict],
+  sources: list[str],
+  page_size: int,
+  per_host: int,
+) -> tuple[list, list]:
+  # Tables and GeoJSON sources share one client; both go through fetch_many_async /
+  # fetch_all_async, the code paths of --transport async.
+  async with AsyncFetcher(per_host=per_host) as fetcher:
+    return await asyncio.gather(
+      fetch_many_async(fetcher, queries, endpoint=endpoint, page_size=page_size),
+      fetch_all_async(sources, fetcher),
+    )
+
+
+def report(label: str, stub: Stub, requests_made: int, seconds: float) -> None:
+  print(
+    f"{label:<40} {seconds:8.2f} s {requests_made / seconds:8.1f} req/s "
+    f"connections={stub.connections}"
+  )
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--tables", type=int, default=8, help="統計表（クエリ）の数")
+  parser.add_argument("--cells", type=int, default=20000, help="統計表あたりのセル数")
+  parser.add_argument("--page-size", type=int, default=2000)
+  parser.add_argument("--sources", type=int, default=4, help="GeoJSON の取得元の数")
+  parser.add_argument("--features", type=int, default=2000, help="GeoJSON あたりの Feature 数")
+  parser.add_argument("--latency", type=float, default=0.05, help="スタブの 1 リクエストあたりの待ち時間（秒）")
+  parser.add_argument("--per-host", type=int, default=DEFAULT_PER_HOST)
+  args = parser.parse_args()
+
+  stub = Stub(args.latency, args.cells, args.features)
+  threading.Thread(target=stub.serve_forever, daemon=True).start()
+  endpoint = f"{stub.url}/rest/3.0/app/json/getStatsData"
+  queries = [{"appId": "bench", "statsDataId": f"{i:010d}", "lang": "J"} for i in range(args.tables)]
+  sources = [f"{stub.url}/geojson/{i}" for i in range(args.sources)]
+  pages = -(-args.cells // args.page_size)
+  requests_made = args.tables * (1 + pages) + args.sources
+  print(
+    f"workload: {args.tables} tables x {pages} pages + {args.sources} GeoJSON = {requests_made} requests, "
+    f"latency {args.latency * 1000:.0f} ms"
+  )
+
+  started = time.perf_counter()
+  expected = sequential(endpoint, queries, sources, args.page_size)
+  report("requests.get, sequential", stub, requests_made, time.perf_counter() - started)
+
+  stub.connections = 0
+  started = time.perf_counter()
+  result = asyncio.run(concurrent(endpoint, queries, sources, args.page_size, args.per_host))
+  report(f"AsyncFetcher, per-host={args.per_host}", stub, requests_made, time.perf_counter() - started)
+  print(f"same result: {list(result[0]) == expected[0] and list(result[1]) == expected[1]}")
+  stub.shutdown()
+
+
+if __name__ == "__main__":
+  main()
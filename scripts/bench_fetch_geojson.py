@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""Compare peak RSS and wall time of fetch_geojson.py with and without --stream."""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+SCRIPT = Path(__file__).with_name("fetch_geojson.py")
+
+
+def write_synthetic(path: Path, features: int, vertices: int) -> None:
+  rng = random.Random(0)
+  with path.open("w", encoding="utf-8") as fp:
+    fp.write('{"type": "FeatureCollection", "features": [')
+    for i in range(features):
+      lon, lat = 129 + rng.random() * 16, 31 + rng.random() * 14
+      ring = [[round(lon + rng.random() * 0.1, 6), round(lat + rng.random() * 0.1, 6)] for _ in range(vertices)]
+      ring.append(ring[0])
+      feature = {
+        "type": "Feature",
+        "properties": {"N03_001": "東京都", "N03_004": f"市{i}", "N03_007": f"{13000 + i % 1000:05d}"},
+        "geometry": {"type": "Polygon", "coordinates": [ring]},
+      }
+      fp.write(("," if i else "") + json.dumps(feature, ensure_ascii=False))
+    fp.write("]}")
+
+
+def run(source: Path, output: Path, stream: bool) -> tuple[float, int]:
+  cmd = [sys.executable, str(SCRIPT), "--source", str(source), "--output", str(output)]
+  # Shape simplification is in-memory only; disable it so both modes do the same work.
+  cmd.append("--stream" if stream else "--levels=")
+  started = time.perf_counter()
+  proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+  _, status, usage = os.wait4(proc.pid, 0)
+  elapsed = time.perf_counter() - started
+  if status:
+    raise SystemExit(f"fetch_geojson.py failed: {' '.join(cmd)}")
+  return elapsed, usage.ru_maxrss * 1024
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--source", help="ローカルの GeoJSON（省略時は合成データを生成）")
+  parser.add_argument("--features", type=int, default=20000)
+  parser.add_argument("--vertices", type=int, default=500)
+  args = parser.parse_args()
+
+  with tempfile.TemporaryDirectory() as tmp:
+    tmpdir = Path(tmp)
+    source = Path(args.source) if args.source else tmpdir / "source.geojson"
+    if not args.source:
+      write_synthetic(source, args.features, args.vertices)
+    print(f"source: {source} ({source.stat().st_size / 1e6:.1f} MB)")
+
+    outputs = {}
+    for stream in (False, True):
+      label = "stream" if stream else "in-memory"
+      outputs[label] = tmpdir / f"{label}.geojson"
+      elapsed, peak = run(source, outputs[label], stream)
+      print(f"{label:>10}: wall {elapsed:7.2f} s  peak RSS {peak / 1e6:8.1f} MB")
+
+    same = outputs["stream"].read_bytes() == outputs["in-memory"].read_bytes()
+    print(f"identical output: {same}")
+
+
+if __name__ == "__main__":
+  main()
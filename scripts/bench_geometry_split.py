@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""Benchmark response bytes and latency of municipality queries over PostgREST.
+
+Compares reading every row with its geometry (what the pages did while
+``geojson`` lived in ``municipalities``) against the attribute-only read and
+the per-level geometry reads of ``municipality_geometries``. Run it once
+before and once after ``supabase/migrations/split_geometry.sql``; queries the
+current schema does not support are reported as skipped.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import time
+
+import httpx
+
+ATTRIBUTE_COLUMNS = "code,name,prefecture_code,rent_avg,population,area_km2"
+
+
+def queries(levels: list[str]) -> list[tuple[str, str, dict[str, str]]]:
+  """``(label, table, params)`` for every query shape being compared."""
+  combined = [
+    ("municipalities + geojson (before)", "municipalities", {"select": f"{ATTRIBUTE_COLUMNS},geojson"}),
+  ]
+  combined += [
+    (
+      f"municipalities + {lod} geometry (embedded)",
+      "municipalities",
+      {"select": f"{ATTRIBUTE_COLUMNS},municipality_geometries(geojson)", "municipality_geometries.lod": f"eq.{lod}"},
+    )
+    for lod in levels
+  ]
+  split = [("municipalities attributes only", "municipalities", {"select": ATTRIBUTE_COLUMNS})]
+  split += [
+    (f"municipality_geometries {lod}", "municipality_geometries", {"select": "code,geojson", "lod": f"eq.{lod}"})
+    for lod in levels
+  ]
+  return combined + split
+
+
+def measure(client: httpx.Client, table: str, params: dict[str, str], repeat: int) -> tuple[int, int, int, list[float]] | None:
+  """(rows, body bytes, wire bytes, latencies) or None when the schema lacks the query."""
+  latencies = []
+  for _ in range(repeat):
+    started = time.perf_counter()
+    response = client.get(f"/rest/v1/{table}", params=params)
+    latencies.append(time.perf_counter() - started)
+    if response.status_code >= 400:
+      return None
+  return len(response.json()), len(response.content), response.num_bytes_downloaded, latencies
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--supabase-url", default=os.getenv("NEXT_PUBLIC_SUPABASE_URL", ""))
+  parser.add_argument("--key", default=os.getenv("NEXT_PUBLIC_SUPABASE_ANON_KEY", ""), help="anon key（ページと同じ権限で計測）")
+  parser.add_argument("--levels", default="nation,prefecture,city", help="計測する詳細度（カンマ区切り）")
+  parser.add_argument("--repeat", type=int, default=10, help="クエリごとの計測回数")
+  args = parser.parse_args()
+
+  if not args.supabase_url or not args.key:
+    raise SystemExit("Supabase URL/API key が必要です。")
+
+  headers = {"apikey": args.key, "Authorization": f"Bearer {args.key}", "Accept-Encoding": "gzip"}
+  levels = [lod.strip() for lod in args.levels.split(",") if lod.strip()]
+  with httpx.Client(base_url=args.supabase_url.rstrip("/"), headers=headers, timeout=120) as client:
+    for label, table, params in queries(levels):
+      result = measure(client, table, params, max(1, args.repeat))
+      if result is None:
+        print(f"{label:<50} skipped (not supported by the current schema)")
+        continue
+      rows, body, wire, latencies = result
+      latencies.sort()
+      p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+      print(
+        f"{label:<50} rows={rows:>6,} body={body:>13,} B wire={wire:>12,} B "
+        f"median={statistics.median(latencies) * 1000:>8.1f} ms p95={p95 * 1000:>8.1f} ms"
+      )
+
+
+if __name__ == "__main__":
+  main()
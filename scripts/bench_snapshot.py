@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""Benchmark loading GeoJSON + rent CSV against the columnar snapshot.
+
+Writes snapshots of the given inputs to a temporary directory, then times
+what the consumers do: open the data and read codes / rents / attributes,
+and decode one or every geometry.
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+import tempfile
+import time
+from pathlib import Path
+
+from snapshot import Snapshot, load_rent, write_municipalities, write_rent
+
+
+def timed(label: str, func, runs: int):
+  best = float("inf")
+  for _ in range(runs):
+    started = time.perf_counter()
+    result = func()
+    best = min(best, time.perf_counter() - started)
+  print(f"{label:<40} {best * 1000:10.2f} ms")
+  return result
+
+
+def load_text(geojson: Path, rent: Path) -> tuple[dict, dict[str, float]]:
+  with rent.open(encoding="utf-8") as fp:
+    rent_map = {row["municipality_code"]: float(row["rent_avg"]) for row in csv.DictReader(fp)}
+  return json.loads(geojson.read_text(encoding="utf-8")), rent_map
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--geojson", default="data/municipalities.geojson")
+  parser.add_argument("--rent", default="data/rent_avg.csv")
+  parser.add_argument("--runs", type=int, default=5)
+  args = parser.parse_args()
+
+  geojson, rent = Path(args.geojson), Path(args.rent)
+  collection, rent_map = load_text(geojson, rent)
+  features = collection["features"]
+  print(f"features: {len(features):,}, rents: {len(rent_map):,}")
+
+  with tempfile.TemporaryDirectory() as tmp:
+    municipalities, rents = Path(tmp) / "municipalities.snap", Path(tmp) / "rent_avg.snap"
+    size = write_municipalities(municipalities, {"full": features})
+    write_rent(rents, list(rent_map), list(rent_map.values()))
+    print(f"GeoJSON {geojson.stat().st_size:,} B + CSV {rent.stat().st_size:,} B -> snapshot {size:,} B + {rents.stat().st_size:,} B")
+
+    timed("text: json.load + csv.DictReader", lambda: load_text(geojson, rent), args.runs)
+
+    def open_columns():
+      snapshot = Snapshot(municipalities)
+      codes = snapshot.column("code")
+      return snapshot, codes, load_rent(rents)
+
+    snapshot, codes, _ = timed("snapshot: open + codes + rent map", open_columns, args.runs)
+    timed("snapshot: attribute records", snapshot.records, args.runs)
+    middle = len(codes) // 2
+    timed("snapshot: decode one geometry", lambda: snapshot.geometry(middle), args.runs)
+    decoded = timed("snapshot: decode every geometry", snapshot.feature_collection, args.runs)
+    mismatches = sum(a.get("geometry") != b["geometry"] for a, b in zip(features, decoded["features"]))
+    print(f"round trip mismatches: {mismatches}")
+    # Release the last view first so that close() unmaps before the directory is removed.
+    del codes
+    snapshot.close()
+
+
+if __name__ == "__main__":
+  main()
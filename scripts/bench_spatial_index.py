@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""Benchmark spatial_index.py: build, save/load and batch lookup of 1M points.
+
+The R-tree lookup is checked against a brute-force scan that ray-casts each
+point against every municipality, run on a sample and extrapolated.
+"""
+
+from __future__ import annotations
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from simplify import iter_polygons
+from spatial_index import SpatialIndex, load_features, ray_cast
+
+
+def synthetic_features(columns: int, rows: int, vertices: int) -> list[dict]:
+  """A ``columns`` x ``rows`` mosaic of irregular municipalities sharing wavy borders."""
+  rng = np.random.default_rng(0)
+  xs = np.linspace(129.0, 145.0, columns + 1)
+  ys = np.linspace(31.0, 45.0, rows + 1)
+  gx, gy = np.meshgrid(xs, ys)
+  gx[1:-1, 1:-1] += rng.uniform(-0.3, 0.3, (rows - 1, columns - 1)) * (xs[1] - xs[0])
+  gy[1:-1, 1:-1] += rng.uniform(-0.3, 0.3, (rows - 1, columns - 1)) * (ys[1] - ys[0])
+  edges: dict[tuple, list[list[float]]] = {}
+
+  def edge(a: tuple[int, int], b: tuple[int, int]) -> list[list[float]]:
+    """Points from corner ``a`` up to (excluding) ``b``, identical for both neighbours."""
+    key = (min(a, b), max(a, b))
+    if key not in edges:
+      (p, q) = key
+      t = np.linspace(0, 1, vertices + 1)
+      wiggle = rng.uniform(-0.05, 0.05, len(t)) * (xs[1] - xs[0])
+      wiggle[[0, -1]] = 0
+      edges[key] = np.column_stack((
+        gx[p] + (gx[q] - gx[p]) * t + wiggle,
+        gy[p] + (gy[q] - gy[p]) * t - wiggle,
+      )).tolist()
+    points = edges[key] if key[0] == a else edges[key][::-1]
+    return points[:-1]
+
+  features = []
+  for j in range(rows):
+    for i in range(columns):
+      corners = [(j, i), (j, i + 1), (j + 1, i + 1), (j + 1, i)]
+      ring = [point for a, b in zip(corners, corners[1:] + corners[:1]) for point in edge(a, b)]
+      ring.append(ring[0])
+      features.append({
+        "type": "Feature",
+        "properties": {"code": f"{j * columns + i:05d}"},
+        "geometry": {"type": "Polygon", "coordinates": [ring]},
+      })
+  return features
+
+
+def brute_force(features: list[dict], lon: np.ndarray, lat: np.ndarray) -> np.ndarray:
+  """Ray-cast every point against every polygon part (the approach being replaced)."""
+  result = np.full(len(lon), -1, dtype=np.int32)
+  for index, feature in enumerate(features):
+    for polygon in iter_polygons(feature.get("geometry")):
+      rings = [np.asarray(ring, dtype=np.float64) for ring in polygon]
+      edges = np.concatenate([np.column_stack((ring[:-1], ring[1:])) for ring in rings])
+      result[ray_cast(edges, lon, lat)] = index
+  return result
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--source", help="市区町村 GeoJSON（省略時は合成データを生成）")
+  parser.add_argument("--points", type=int, default=1_000_000)
+  parser.add_argument("--sample", type=int, default=2_000, help="総当たり比較に使う点の数")
+  parser.add_argument("--grid", type=int, default=45, help="合成データの 1 辺の市区町村数")
+  parser.add_argument("--vertices", type=int, default=50, help="合成データの境界 1 辺あたりの頂点数")
+  args = parser.parse_args()
+
+  started = time.perf_counter()
+  if args.source:
+    features = load_features(Path(args.source))
+  else:
+    features = synthetic_features(args.grid, args.grid, args.vertices)
+  print(f"features: {len(features):,} (loaded in {time.perf_counter() - started:.2f} s)")
+
+  started = time.perf_counter()
+  index = SpatialIndex.build(features)
+  print(f"build: {time.perf_counter() - started:.2f} s ({len(index.part_bbox):,} parts, {len(index.edges):,} edges, {len(index.levels)} levels)")
+
+  with tempfile.TemporaryDirectory() as tmp:
+    path = Path(tmp) / "index.npz"
+    index.save(path)
+    started = time.perf_counter()
+    index = SpatialIndex.load(path)
+    print(f"load: {(time.perf_counter() - started) * 1000:.1f} ms ({path.stat().st_size / 1e6:.1f} MB)")
+
+  west, south = index.part_bbox[:, :2].min(axis=0)
+  east, north = index.part_bbox[:, 2:].max(axis=0)
+  rng = np.random.default_rng(1)
+  lon = rng.uniform(west, east, args.points)
+  lat = rng.uniform(south, north, args.points)
+
+  started = time.perf_counter()
+  found = index.lookup_indices(lon, lat)
+  elapsed = time.perf_counter() - started
+  print(f"R-tree lookup: {args.points:,} points in {elapsed:.2f} s ({args.points / elapsed:,.0f} points/s, {np.count_nonzero(found >= 0):,} located)")
+
+  sample = slice(0, min(args.sample, args.points))
+  located = [feature for feature in features if next(iter_polygons(feature.get("geometry")), None)]
+  started = time.perf_counter()
+  expected = brute_force(located, lon[sample], lat[sample])
+  elapsed = time.perf_counter() - started
+  rate = len(expected) / elapsed
+  print(f"brute force: {len(expected):,} points in {elapsed:.2f} s ({rate:,.0f} points/s, ~{args.points / rate:,.0f} s for {args.points:,})")
+  mismatches = np.count_nonzero(index.codes[found[sample]] != np.asarray([f["properties"]["code"] for f in located])[expected])
+  mismatches += np.count_nonzero((found[sample] < 0) != (expected < 0))
+  print(f"mismatches on sample: {mismatches}")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""Build a z/x/y vector tile pyramid (MBTiles) from the municipality GeoJSON.
+
+Every zoom level is simplified with a tolerance of about one screen pixel
+(sharing junctions across municipalities, see ``simplify.py``), then clipped
+into tiles. Work is split into column stripes of each zoom level and spread
+over a process pool; the parent writes finished tiles into the MBTiles file.
+"""
+
+from __future__ import annotations
+
+import argparse
+import gzip
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+from json_stream import iter_array_items, iter_file_chunks
+from simplify import find_junctions, iter_polygons, iter_rings, simplify_geometry
+from topojson_codec import compute_bbox
+from vector_tiles import (
+  DEFAULT_BUFFER,
+  DEFAULT_EXTENT,
+  LAYER_NAME,
+  LayerBuilder,
+  MBTilesWriter,
+  project,
+  tile_lon,
+  tile_range,
+  tile_rings,
+  zoom_tolerance,
+)
+
+DEFAULT_MIN_ZOOM = 4
+DEFAULT_MAX_ZOOM = 12
+# Tile columns per task: small enough to balance the pool and bound the
+# memory of one result, large enough that few features straddle stripes.
+STRIPE_COLUMNS = 16
+TILE_PROPERTIES = ("code", "name", "prefecture_code", "rent_avg")
+
+# Per-process state, set once by _init_worker.
+_features: list[dict] = []
+_bboxes = np.empty((0, 4))
+_junctions: set = set()
+
+
+@dataclass
+class ZoomReport:
+  tiles: int = 0
+  bytes: int = 0
+  max_bytes: int = 0
+
+
+def _init_worker(features: list[dict], junctions: set) -> None:
+  global _features, _bboxes, _junctions
+  _features = features
+  _junctions = junctions
+  _bboxes = np.array([compute_bbox([feature]) for feature in features], dtype=np.float64).reshape(-1, 4)
+
+
+def build_stripe(task: tuple[int, int, int, int, int]) -> tuple[int, list[tuple[int, int, bytes]]]:
+  """Render tile columns ``x0..x1`` of ``zoom``; returns gzipped tiles."""
+  zoom, x0, x1, extent, buffer = task
+  pad = buffer / extent
+  west, east = tile_lon(x0 - pad, zoom), tile_lon(x1 + 1 + pad, zoom)
+  tolerance = zoom_tolerance(zoom)
+  layers: dict[tuple[int, int], LayerBuilder] = {}
+
+  candidates = np.nonzero((_bboxes[:, 2] >= west) & (_bboxes[:, 0] <= east))[0]
+  for index in candidates.tolist():
+    feature = _features[index]
+    geometry = simplify_geometry(feature.get("geometry"), _junctions, {"tile": tolerance})["tile"]
+    polygons = [[project(np.asarray(ring, dtype=np.float64), zoom) for ring in polygon] for polygon in iter_polygons(geometry)]
+    if not polygons:
+      continue
+    props = feature.get("properties", {})
+    code = str(props.get("code", ""))
+    feature_id = int(code) if code.isdigit() else None
+    properties = {key: props.get(key) for key in TILE_PROPERTIES}
+
+    points = np.concatenate([polygon[0] for polygon in polygons])
+    (px0, py0), (px1, py1) = points.min(axis=0) - pad, points.max(axis=0) + pad
+    last = 2**zoom - 1
+    for tx in range(max(x0, int(px0)), min(x1, int(px1), last) + 1):
+      for ty in range(max(0, int(py0)), min(int(py1), last) + 1):
+        clipped = [rings for polygon in polygons if (rings := tile_rings(polygon, tx, ty, extent, buffer))]
+        if clipped:
+          layers.setdefault((tx, ty), LayerBuilder(LAYER_NAME, extent)).add(feature_id, properties, clipped)
+
+  return zoom, [(x, y, gzip.compress(layer.encode(), 6)) for (x, y), layer in layers.items()]
+
+
+def plan_tasks(
+  bbox: tuple[float, float, float, float],
+  zooms: range,
+  extent: int,
+  buffer: int,
+) -> list[tuple[int, int, int, int, int]]:
+  tasks = []
+  for zoom in zooms:
+    x0, _, x1, _ = tile_range(bbox, zoom)
+    for start in range(x0, x1 + 1, STRIPE_COLUMNS):
+      tasks.append((zoom, start, min(start + STRIPE_COLUMNS - 1, x1), extent, buffer))
+  # Deepest (most expensive) zoom levels first.
+  return sorted(tasks, key=lambda task: -task[0])
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--input", default="data/municipalities.geojson", help="fetch_geojson.py が出力した GeoJSON")
+  parser.add_argument("--output", default="data/municipalities.mbtiles")
+  parser.add_argument("--min-zoom", type=int, default=DEFAULT_MIN_ZOOM)
+  parser.add_argument("--max-zoom", type=int, default=DEFAULT_MAX_ZOOM)
+  parser.add_argument("--extent", type=int, default=DEFAULT_EXTENT, help="タイル内座標の解像度")
+  parser.add_argument("--buffer", type=int, default=DEFAULT_BUFFER, help="タイル外側に残す幅（タイル内座標）")
+  parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="並列プロセス数")
+  args = parser.parse_args()
+  if not 0 <= args.min_zoom <= args.max_zoom:
+    raise SystemExit("--min-zoom は 0 以上かつ --max-zoom 以下にしてください。")
+
+  started = time.perf_counter()
+  features = list(iter_array_items(iter_file_chunks(Path(args.input)), "features"))
+  junctions = find_junctions(ring for feature in features for ring in iter_rings(feature.get("geometry")))
+  bbox = compute_bbox(features)
+  zooms = range(args.min_zoom, args.max_zoom + 1)
+  tasks = plan_tasks(bbox, zooms, args.extent, args.buffer)
+  print(f"features: {len(features):,}, junctions: {len(junctions):,}, tasks: {len(tasks):,}")
+
+  reports = {zoom: ZoomReport() for zoom in zooms}
+  writer = MBTilesWriter(Path(args.output))
+  with ProcessPoolExecutor(max_workers=max(1, args.workers), initializer=_init_worker, initargs=(features, junctions)) as pool:
+    for future in as_completed([pool.submit(build_stripe, task) for task in tasks]):
+      zoom, tiles = future.result()
+      writer.write_many([(zoom, x, y, data) for x, y, data in tiles])
+      report = reports[zoom]
+      for _, _, data in tiles:
+        report.tiles += 1
+        report.bytes += len(data)
+        report.max_bytes = max(report.max_bytes, len(data))
+
+  west, south, east, north = bbox
+  writer.set_metadata({
+    "name": LAYER_NAME,
+    "format": "pbf",
+    "type": "overlay",
+    "minzoom": args.min_zoom,
+    "maxzoom": args.max_zoom,
+    "bounds": f"{west},{south},{east},{north}",
+    "center": f"{(west + east) / 2},{(south + north) / 2},{args.min_zoom}",
+    "json": {
+      "vector_layers": [{
+        "id": LAYER_NAME,
+        "minzoom": args.min_zoom,
+        "maxzoom": args.max_zoom,
+        "fields": {"code": "String", "name": "String", "prefecture_code": "String", "rent_avg": "Number"},
+      }],
+    },
+  })
+  writer.close()
+
+  for zoom, report in reports.items():
+    average = report.bytes // report.tiles if report.tiles else 0
+    print(f"z{zoom:>2}: tiles={report.tiles:>7,} bytes={report.bytes:>13,} avg={average:>7,} max={report.max_bytes:>9,}")
+  total_tiles = sum(report.tiles for report in reports.values())
+  total_bytes = sum(report.bytes for report in reports.values())
+  print(
+    f"saved: {args.output} (tiles={total_tiles:,}, tile bytes={total_bytes:,}, "
+    f"file={Path(args.output).stat().st_size:,}) in {time.perf_counter() - started:.1f}s"
+  )
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,127 @@
+"""Detect which municipality rows changed since the previous import.
+
+Each row gets two stable content hashes: one over its descriptive attributes
+and one over its geometry at every level of detail. Rent is compared by value. The previous state
+comes either from a local manifest file or from the ``attr_hash`` /
+``geom_hash`` / ``rent_avg`` columns of ``municipalities``, and only the rows
+(and columns) that differ are written.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+
+from geometry_store import StoredGeometries
+
+ATTRIBUTE_FIELDS = ("prefecture_code", "name", "population", "area_km2")
+STATE_COLUMNS = "code,attr_hash,geom_hash,rent_avg"
+
+
+def content_hash(value: object) -> str:
+  canonical = json.dumps(value, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+  return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def geometry_hash(geometries: object) -> str:
+  # Stored geometries hash their packed coordinates instead of decoding them.
+  if isinstance(geometries, StoredGeometries):
+    return geometries.content_hash()
+  return content_hash(geometries)
+
+
+def attribute_hash(row: dict) -> str:
+  return content_hash({key: row.get(key) for key in ATTRIBUTE_FIELDS})
+
+
+def row_state(row: dict) -> dict:
+  return {
+    "attr_hash": attribute_hash(row),
+    "geom_hash": geometry_hash(row.get("geometries")),
+    "rent_avg": row.get("rent_avg"),
+  }
+
+
+def same_rent(a: object, b: object) -> bool:
+  if a is None or b is None:
+    return a is None and b is None
+  return float(a) == float(b)
+
+
+@dataclass
+class ChangeSet:
+  # New municipalities or changed geometry: attributes and every level of
+  # detail are written.
+  full: list[dict] = field(default_factory=list)
+  # Changed attributes (and possibly rent), geometry untouched.
+  attributes: list[tuple[str, dict]] = field(default_factory=list)
+  # Only rent_avg changed.
+  rent: list[tuple[str, dict]] = field(default_factory=list)
+  unchanged: int = 0
+  state: dict[str, dict] = field(default_factory=dict)
+
+  def summary(self) -> str:
+    return (
+      f"full={len(self.full)}, attributes={len(self.attributes)}, "
+      f"rent_only={len(self.rent)}, unchanged={self.unchanged}"
+    )
+
+
+def detect_changes(rows: list[dict], previous: dict[str, dict], hash_columns: bool = False) -> ChangeSet:
+  """Classify ``rows`` against ``previous`` (code -> attr_hash/geom_hash/rent_avg).
+
+  With ``hash_columns`` the hashes are written alongside the data so the next
+  run can diff against the database itself.
+  """
+  changes = ChangeSet()
+  now = datetime.now(timezone.utc).isoformat()
+  for row in rows:
+    code = row["code"]
+    state = row_state(row)
+    changes.state[code] = state
+    old = previous.get(code)
+    hashes = {"attr_hash": state["attr_hash"], "geom_hash": state["geom_hash"]} if hash_columns else {}
+
+    if old is None or old.get("geom_hash") != state["geom_hash"]:
+      changes.full.append({**row, **hashes, "updated_at": now})
+    elif old.get("attr_hash") != state["attr_hash"]:
+      values = {key: row.get(key) for key in ATTRIBUTE_FIELDS}
+      values["rent_avg"] = row.get("rent_avg")
+      if hash_columns:
+        values["attr_hash"] = state["attr_hash"]
+      changes.attributes.append((code, {**values, "updated_at": now}))
+    elif not same_rent(old.get("rent_avg"), state["rent_avg"]):
+      changes.rent.append((code, {"rent_avg": row.get("rent_avg"), "updated_at": now}))
+    else:
+      changes.unchanged += 1
+  return changes
+
+
+def load_manifest(path: Path) -> dict[str, dict]:
+  if not path.exists():
+    return {}
+  return json.loads(path.read_text(encoding="utf-8"))
+
+
+def save_manifest(path: Path, state: dict[str, dict]) -> None:
+  path.parent.mkdir(parents=True, exist_ok=True)
+  tmp = path.with_suffix(".tmp")
+  tmp.write_text(json.dumps(state, ensure_ascii=False, sort_keys=True), encoding="utf-8")
+  os.replace(tmp, path)
+
+
+def fetch_remote_state(supabase, table: str = "municipalities", page_size: int = 1000) -> dict[str, dict]:
+  """Read the hash columns of every row, paging past PostgREST's row limit."""
+  state: dict[str, dict] = {}
+  start = 0
+  while True:
+    page = supabase.table(table).select(STATE_COLUMNS).order("code").range(start, start + page_size - 1).execute().data
+    for row in page:
+      state[row["code"]] = row
+    if len(page) < page_size:
+      return state
+    start += page_size
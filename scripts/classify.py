@@ -0,0 +1,132 @@
+"""Rent classification: class breaks, one shared palette and a legend.
+
+Breaks are computed once with NumPy (quantile, Jenks natural breaks or
+equal interval) at build and import time, and every municipality is stored
+with its class index. Clients only look the color up in the palette, so
+nothing is interpolated per feature in the browser and the Leaflet page,
+the Next.js map and their legends all draw from ``PALETTE``.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Sequence
+
+import numpy as np
+
+# Lowest rent first.
+PALETTE = ("#5352ed", "#1e90ff", "#2ed573", "#7bed9f", "#ffd43b", "#ffa502", "#ff6b81", "#ff4757")
+METHODS = ("quantile", "jenks", "equal")
+DEFAULT_METHOD = "quantile"
+# Jenks is quadratic in the number of values; larger inputs are reduced to
+# this many evenly spaced quantiles first.
+JENKS_SAMPLE = 2000
+
+
+def equal_breaks(values: np.ndarray, classes: int) -> np.ndarray:
+  return np.linspace(values.min(), values.max(), classes + 1)[1:]
+
+
+def quantile_breaks(values: np.ndarray, classes: int) -> np.ndarray:
+  return np.quantile(values, np.arange(1, classes + 1) / classes)
+
+
+def jenks_breaks(values: np.ndarray, classes: int) -> np.ndarray:
+  """Fisher-Jenks natural breaks: minimize the within-class sum of squared deviations."""
+  values = np.sort(values)
+  if len(values) > JENKS_SAMPLE:
+    values = np.quantile(values, np.linspace(0, 1, JENKS_SAMPLE))
+  n = len(values)
+  classes = min(classes, n)
+  sums = np.r_[0.0, np.cumsum(values)]
+  squares = np.r_[0.0, np.cumsum(values ** 2)]
+  # ssd[m, i]: squared deviations of values[m..i] as one class.
+  start, end = np.arange(n)[:, None], np.arange(n)[None, :]
+  count = end - start + 1
+  with np.errstate(divide="ignore", invalid="ignore"):
+    ssd = squares[end + 1] - squares[start] - (sums[end + 1] - sums[start]) ** 2 / count
+  ssd = np.where(count > 0, ssd, np.inf)
+
+  # cost[i]: best total for values[0..i] split into the classes so far;
+  # starts[j][i]: where the last of j + 1 classes begins in that split.
+  cost = ssd[0]
+  starts = [np.zeros(n, dtype=np.int64)]
+  columns = np.arange(n)
+  for _ in range(1, classes):
+    total = np.full((n, n), np.inf)
+    total[1:] = cost[:-1, None] + ssd[1:]
+    best = np.argmin(total, axis=0)
+    cost = total[best, columns]
+    starts.append(best)
+
+  breaks, last = [], n - 1
+  for class_starts in reversed(starts):
+    breaks.append(values[last])
+    last = class_starts[last] - 1
+  return np.array(breaks[::-1])
+
+
+BREAKS = {"quantile": quantile_breaks, "jenks": jenks_breaks, "equal": equal_breaks}
+
+
+def spread_palette(classes: int) -> list[str]:
+  """``classes`` colors spread evenly over ``PALETTE`` (all of it when they match)."""
+  if classes <= 1:
+    return [PALETTE[-1]] * classes
+  return [PALETTE[i] for i in np.rint(np.linspace(0, len(PALETTE) - 1, classes)).astype(int)]
+
+
+@dataclass
+class Classification:
+  method: str
+  # Upper bound of each class (inclusive); the lowest class starts at ``minimum``.
+  breaks: list[float]
+  minimum: float | None
+  palette: list[str]
+  counts: list[int]
+  # code -> class index, for every municipality that has a rent value.
+  classes: dict[str, int]
+
+  def legend(self) -> list[dict]:
+    lowers = [self.minimum, *self.breaks[:-1]]
+    return [
+      {"min": low, "max": high, "color": color, "count": count}
+      for low, high, color, count in zip(lowers, self.breaks, self.palette, self.counts)
+    ]
+
+  def colors(self) -> dict[str, str]:
+    return {code: self.palette[index] for code, index in self.classes.items()}
+
+  def scheme(self) -> dict:
+    """Everything a client needs besides the per-code classes."""
+    return {"method": self.method, "breaks": self.breaks, "palette": self.palette, "legend": self.legend()}
+
+
+def classify(
+  codes: Sequence[str],
+  rents: Sequence[float | None],
+  method: str = DEFAULT_METHOD,
+  classes: int = len(PALETTE),
+) -> Classification:
+  """Class breaks over every municipality that has a rent value, and each one's class."""
+  if method not in BREAKS:
+    raise ValueError(f"unknown classification method: {method} (choose from {', '.join(METHODS)})")
+  rent = np.array([np.nan if value is None else float(value) for value in rents], dtype=np.float64)
+  valid = ~np.isnan(rent)
+  rent = rent[valid]
+  codes = np.asarray(codes, dtype=str)[valid]
+  if not len(rent):
+    return Classification(method, [], None, [], [], {})
+
+  # Ties can repeat a break; the empty classes they would create are dropped.
+  breaks = np.unique(BREAKS[method](rent, classes))
+  breaks[-1] = rent.max()
+  index = np.minimum(np.searchsorted(breaks, rent, side="left"), len(breaks) - 1)
+  return Classification(
+    method,
+    breaks.tolist(),
+    float(rent.min()),
+    spread_palette(len(breaks)),
+    np.bincount(index, minlength=len(breaks)).tolist(),
+    {str(code): int(i) for code, i in zip(codes, index)},
+  )
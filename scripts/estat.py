@@ -0,0 +1,465 @@
+"""Paged, concurrent and resumable client for the e-Stat getStatsData API.
+
+e-Stat returns at most ``limit`` (100,000) cells per response. The total is
+discovered first with ``cntGetFlg=Y``, then every ``startPosition`` page is
+fetched on a bounded thread pool sharing one pooled ``requests.Session``.
+Completed pages are checkpointed to disk so that an interrupted run resumes
+where it stopped. ``fetch_many_async`` does the same from one event loop on a
+pooled ``AsyncFetcher`` (async_http.py). ``iter_values`` instead streams the
+pages one after another and decodes ``VALUE`` one cell at a time, so memory
+stays bounded by a single cell however large the table is.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AbstractContextManager, nullcontext
+from dataclasses import dataclass, field
+from itertools import chain
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, TypeVar
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from async_http import RETRY_STATUS, AsyncFetcher
+from http_cache import CachedSession
+from json_stream import CHUNK_SIZE, iter_array_items
+from rate_limit import Throttle, retry_after_seconds, throttled
+
+ESTAT_ENDPOINT = "https://api.e-stat.go.jp/rest/3.0/app/json/getStatsData"
+PAGE_SIZE = 100_000
+# RESULT.STATUS: 0 = OK, 1 = OK but no matching data, 2 = OK with ignored
+# parameters; 100 and above are errors.
+STATUS_NO_DATA = 1
+STATUS_ERROR = 100
+# A streamed response without a VALUE array (an error or no data) is decoded
+# from its first bytes, which hold the whole document.
+STREAM_HEAD_BYTES = 1 << 16
+# RESULT comes first in every envelope, so the status of a streamed page is
+# found in its first chunk.
+STATUS_PATTERN = re.compile(rb'"STATUS"\s*:\s*"?(\d+)')
+
+T = TypeVar("T")
+
+
+class EstatError(RuntimeError):
+  pass
+
+
+def make_session(pool_size: int = 8, session: requests.Session | None = None) -> requests.Session:
+  """Size the connection pool of ``session`` (a new one by default) for ``pool_size`` workers."""
+  session = session or requests.Session()
+  adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+  session.mount("https://", adapter)
+  session.mount("http://", adapter)
+  return session
+
+
+def pooled_session(pool_size: int, session: requests.Session | None = None) -> AbstractContextManager[requests.Session]:
+  """``session`` as-is (the caller keeps owning it), or a new pooled one closed on exit."""
+  return nullcontext(session) if session is not None else make_session(pool_size)
+
+
+def get_response(
+  session: requests.Session,
+  endpoint: str,
+  params: dict,
+  retries: int = 4,
+  backoff: float = 1.0,
+  throttle: Throttle | None = None,
+  stream: bool = False,
+) -> requests.Response:
+  """GET ``endpoint``, retrying transient failures with exponential backoff.
+
+  With a ``throttle`` every attempt waits for its rate and concurrency
+  limits and reports back whether the server pushed back. With ``stream``
+  only the status and headers have been read when this returns.
+  """
+  return read_response(session, endpoint, params, lambda response: response, retries, backoff, throttle, stream)
+
+
+def read_response(
+  session: requests.Session,
+  endpoint: str,
+  params: dict,
+  read: Callable[[requests.Response], T],
+  retries: int = 4,
+  backoff: float = 1.0,
+  throttle: Throttle | None = None,
+  stream: bool = False,
+) -> T:
+  """``get_response`` returning ``read(response)``.
+
+  ``read`` runs inside the throttled attempt, so an e-Stat error reported
+  with HTTP 200 (which ``read`` raises as ``EstatError``) counts as an error
+  for the throttle like a ``429`` does. It is not retried.
+  """
+  for attempt in range(retries + 1):
+    try:
+      with throttled(throttle) as outcome:
+        response = session.get(endpoint, params=params, timeout=60, stream=stream)
+        outcome.retry_after = retry_after_seconds(response.headers.get("Retry-After"))
+        try:
+          response.raise_for_status()
+          return read(response)
+        except BaseException:
+          response.close()
+          raise
+    except requests.HTTPError as exc:
+      if exc.response is None or exc.response.status_code not in RETRY_STATUS:
+        raise
+      error: Exception = exc
+    except (requests.ConnectionError, requests.Timeout) as exc:
+      error = exc
+    if attempt == retries:
+      raise error
+    time.sleep(backoff * 2**attempt)
+  raise AssertionError("unreachable")
+
+
+def check_status(payload: dict) -> dict:
+  """Raise ``EstatError`` if the envelope (``GET_STATS_DATA``, ``GET_META_INFO``, ...) reports an error."""
+  for body in payload.values():
+    result = body.get("RESULT") if isinstance(body, dict) else None
+    if result and int(result["STATUS"]) >= STATUS_ERROR:
+      raise EstatError(f"e-Stat error {result['STATUS']}: {result.get('ERROR_MSG', '')}")
+  return payload
+
+
+def forget(session: requests.Session, endpoint: str, params: dict) -> None:
+  """Drop a response the API rejected from the HTTP cache, so that a rerun asks again.
+
+  e-Stat reports errors (throttling, maintenance, bad parameters) with HTTP
+  200, which the cache would otherwise serve for a whole TTL.
+  """
+  if isinstance(session, CachedSession):
+    session.forget(endpoint, params)
+
+
+def get_json(session: requests.Session, endpoint: str, params: dict, **kwargs) -> dict:
+  """``get_response`` decoded as JSON; an e-Stat error status raises ``EstatError``."""
+  try:
+    return read_response(session, endpoint, params, lambda response: check_status(response.json()), **kwargs)
+  except EstatError:
+    forget(session, endpoint, params)
+    raise
+
+
+def open_stream(response: requests.Response) -> tuple[requests.Response, Iterator[bytes]]:
+  """Read the first chunk of a streamed page and check its status; returns the response and every chunk."""
+  chunks = response.iter_content(CHUNK_SIZE)
+  head = next(chunks, b"")
+  match = STATUS_PATTERN.search(head, 0, STREAM_HEAD_BYTES)
+  if match and int(match.group(1)) >= STATUS_ERROR:
+    try:
+      payload = json.loads(head)
+    except ValueError:
+      raise EstatError(f"e-Stat error {int(match.group(1))}") from None
+    check_status(payload)
+  return response, chain([head], chunks)
+
+
+def stats_data(payload: dict) -> dict:
+  """Return ``STATISTICAL_DATA`` after checking the API-level status."""
+  return check_status(payload)["GET_STATS_DATA"].get("STATISTICAL_DATA", {})
+
+
+def page_values(data: dict) -> list[dict]:
+  values = data.get("DATA_INF", {}).get("VALUE", [])
+  return values if isinstance(values, list) else [values]
+
+
+def total_number(payload: dict) -> int:
+  if int(payload["GET_STATS_DATA"]["RESULT"]["STATUS"]) == STATUS_NO_DATA:
+    return 0
+  return int(stats_data(payload)["RESULT_INF"]["TOTAL_NUMBER"])
+
+
+def page_params(params: dict, start: int, page_size: int) -> dict:
+  return {**params, "startPosition": start, "limit": page_size, "cntGetFlg": "N", "metaGetFlg": "N"}
+
+
+def payload_values(payload: dict) -> list[dict]:
+  if int(payload["GET_STATS_DATA"]["RESULT"]["STATUS"]) == STATUS_NO_DATA:
+    return []
+  return page_values(stats_data(payload))
+
+
+def count_values(
+  session: requests.Session,
+  params: dict,
+  endpoint: str = ESTAT_ENDPOINT,
+  retries: int = 4,
+  throttle: Throttle | None = None,
+) -> int:
+  return total_number(get_json(session, endpoint, {**params, "cntGetFlg": "Y"}, retries=retries, throttle=throttle))
+
+
+class PageCheckpoint:
+  """Completed pages of one query, stored as JSON files keyed by startPosition."""
+
+  def __init__(self, root: Path, endpoint: str, params: dict) -> None:
+    # The API key is not part of the query identity (and must not land on disk).
+    identity = json.dumps([endpoint, sorted((k, v) for k, v in params.items() if k != "appId")])
+    self.dir = root / f"{params.get('statsDataId', 'query')}-{hashlib.sha1(identity.encode()).hexdigest()[:12]}"
+
+  def path(self, start: int) -> Path:
+    return self.dir / f"page-{start:010d}.json"
+
+  def load(self, start: int) -> list[dict] | None:
+    path = self.path(start)
+    if not path.exists():
+      return None
+    return json.loads(path.read_text(encoding="utf-8"))
+
+  def save(self, start: int, values: list[dict]) -> None:
+    self.dir.mkdir(parents=True, exist_ok=True)
+    tmp = self.path(start).with_suffix(".tmp")
+    tmp.write_text(json.dumps(values, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, self.path(start))
+
+  def clear(self) -> None:
+    shutil.rmtree(self.dir, ignore_errors=True)
+
+
+def fetch_page(
+  session: requests.Session,
+  params: dict,
+  start: int,
+  page_size: int,
+  endpoint: str = ESTAT_ENDPOINT,
+  retries: int = 4,
+  throttle: Throttle | None = None,
+) -> list[dict]:
+  payload = get_json(session, endpoint, page_params(params, start, page_size), retries=retries, throttle=throttle)
+  return payload_values(payload)
+
+
+def fetch_many(
+  session: requests.Session,
+  queries: list[dict],
+  *,
+  endpoint: str = ESTAT_ENDPOINT,
+  page_size: int = PAGE_SIZE,
+  workers: int = 4,
+  retries: int = 4,
+  checkpoint_dir: Path | None = None,
+  throttle: Throttle | None = None,
+) -> list[list[dict]]:
+  """Fetch every VALUE cell of several queries over one shared worker pool.
+
+  Counts are discovered concurrently first; then the pages of all queries
+  are interleaved on the same pool, so small tables do not wait for large
+  ones. Results are returned per query, in startPosition order.
+  """
+  checkpoints = [PageCheckpoint(checkpoint_dir, endpoint, params) if checkpoint_dir else None for params in queries]
+  pages: dict[tuple[int, int], list[dict]] = {}
+
+  def run(index: int, start: int) -> None:
+    values = fetch_page(session, queries[index], start, page_size, endpoint, retries, throttle)
+    if checkpoints[index]:
+      checkpoints[index].save(start, values)
+    pages[index, start] = values
+
+  with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+    totals = list(pool.map(lambda params: count_values(session, params, endpoint, retries, throttle), queries))
+    starts = [list(range(1, total + 1, page_size)) for total in totals]
+    futures = []
+    for index, query_starts in enumerate(starts):
+      for start in query_starts:
+        values = checkpoints[index].load(start) if checkpoints[index] else None
+        if values is None:
+          futures.append(pool.submit(run, index, start))
+        else:
+          pages[index, start] = values
+    for future in futures:
+      future.result()
+  return collect_pages(queries, totals, starts, pages, checkpoints)
+
+
+def collect_pages(
+  queries: list[dict],
+  totals: list[int],
+  starts: list[list[int]],
+  pages: dict[tuple[int, int], list[dict]],
+  checkpoints: list[PageCheckpoint | None],
+) -> list[list[dict]]:
+  """Join each query's pages in startPosition order, check the count and drop its checkpoint."""
+  results = []
+  for index, total in enumerate(totals):
+    values = [value for start in starts[index] for value in pages[index, start]]
+    if len(values) != total:
+      raise EstatError(f"{queries[index].get('statsDataId')}: expected {total} values, got {len(values)}")
+    if checkpoints[index]:
+      checkpoints[index].clear()
+    results.append(values)
+  return results
+
+
+def fetch_values(session: requests.Session, params: dict, **kwargs) -> list[dict]:
+  """Fetch every VALUE cell of a single query (see ``fetch_many``)."""
+  return fetch_many(session, [params], **kwargs)[0]
+
+
+@dataclass
+class CellFilter:
+  """Keep cells whose ``@<dimension>`` code is listed; a code ending in ``*`` matches by prefix.
+
+  Built from ``dimension=code,code`` specs, e.g. ``area=13*`` ``cat01=003``
+  ``time=2018000000``. Dimensions without a spec are not filtered.
+  """
+
+  codes: dict[str, frozenset[str]] = field(default_factory=dict)
+  prefixes: dict[str, tuple[str, ...]] = field(default_factory=dict)
+
+  @classmethod
+  def parse(cls, specs: list[str]) -> "CellFilter":
+    cell_filter = cls()
+    for spec in specs:
+      dimension, _, values = spec.partition("=")
+      codes = [code.strip() for code in values.split(",") if code.strip()]
+      if not dimension.strip() or not codes:
+        raise ValueError(f"invalid filter '{spec}' (expected dimension=code,code)")
+      key = f"@{dimension.strip().lstrip('@')}"
+      exact = {code for code in codes if not code.endswith("*")}
+      prefixes = tuple(code[:-1] for code in codes if code.endswith("*"))
+      cell_filter.codes[key] = cell_filter.codes.get(key, frozenset()) | exact
+      cell_filter.prefixes[key] = cell_filter.prefixes.get(key, ()) + prefixes
+    return cell_filter
+
+  def __call__(self, cell: dict) -> bool:
+    for key, codes in self.codes.items():
+      code = cell.get(key, "")
+      prefixes = self.prefixes[key]
+      if code not in codes and not (prefixes and code.startswith(prefixes)):
+        return False
+    return True
+
+
+@dataclass
+class StreamReport:
+  cells: int = 0
+  rows: int = 0
+  bytes: int = 0
+  # Seconds from the start of the fetch until the first accepted row.
+  first_row: float | None = None
+  seconds: float = 0.0
+
+  def summary(self) -> str:
+    first = f"{self.first_row * 1000:.0f} ms" if self.first_row is not None else "-"
+    return (
+      f"{self.rows:,}/{self.cells:,} cells kept, {self.bytes / 1e6:.1f} MB in {self.seconds:.2f} s, "
+      f"time to first row {first}"
+    )
+
+
+def iter_response_values(content: Iterable[bytes], report: StreamReport | None = None) -> Iterator[dict]:
+  """Decode the VALUE cells of a streamed getStatsData response body one at a time."""
+  head = bytearray()
+
+  def chunks() -> Iterator[bytes]:
+    for chunk in content:
+      if len(head) < STREAM_HEAD_BYTES:
+        head.extend(chunk[: STREAM_HEAD_BYTES - len(head)])
+      if report is not None:
+        report.bytes += len(chunk)
+      yield chunk
+
+  body = chunks()
+  try:
+    yield from iter_array_items(body, "VALUE")
+  except json.JSONDecodeError:
+    raise
+  except ValueError:
+    # No VALUE array: an API error, no data, or a single cell stored as an object.
+    if len(head) >= STREAM_HEAD_BYTES:
+      raise
+    yield from payload_values(json.loads(bytes(head)))
+
+
+def iter_values(
+  session: requests.Session,
+  params: dict,
+  *,
+  endpoint: str = ESTAT_ENDPOINT,
+  page_size: int = PAGE_SIZE,
+  retries: int = 4,
+  throttle: Throttle | None = None,
+  report: StreamReport | None = None,
+) -> Iterator[dict]:
+  """Every VALUE cell of one query, streamed page after page (no checkpoints).
+
+  A failure while a page is being read is not retried: its earlier cells
+  have already been handed out.
+  """
+  total = count_values(session, params, endpoint, retries, throttle)
+  seen = 0
+  for start in range(1, total + 1, page_size):
+    query = page_params(params, start, page_size)
+    try:
+      response, body = read_response(session, endpoint, query, open_stream, retries, throttle=throttle, stream=True)
+      with response:
+        for cell in iter_response_values(body, report):
+          seen += 1
+          if report is not None:
+            report.cells += 1
+          yield cell
+    except EstatError:
+      forget(session, endpoint, query)
+      raise
+  if seen != total:
+    raise EstatError(f"{params.get('statsDataId')}: expected {total} values, got {seen}")
+
+
+async def fetch_many_async(
+  fetcher: AsyncFetcher,
+  queries: list[dict],
+  *,
+  endpoint: str = ESTAT_ENDPOINT,
+  page_size: int = PAGE_SIZE,
+  retries: int = 4,
+  checkpoint_dir: Path | None = None,
+  throttle: Throttle | None = None,
+) -> list[list[dict]]:
+  """``fetch_many`` on one event loop: every count, then every missing page, in flight at once.
+
+  Concurrency is bounded by the fetcher's per-host limit instead of a
+  thread pool; checkpoints and the result order are the same.
+  """
+  checkpoints = [PageCheckpoint(checkpoint_dir, endpoint, params) if checkpoint_dir else None for params in queries]
+  pages: dict[tuple[int, int], list[dict]] = {}
+
+  async def count(params: dict) -> int:
+    payload = await fetcher.get_json(
+      endpoint, {**params, "cntGetFlg": "Y"}, retries=retries, throttle=throttle, check=check_status
+    )
+    return total_number(payload)
+
+  async def run(index: int, start: int) -> None:
+    params = page_params(queries[index], start, page_size)
+    payload = await fetcher.get_json(endpoint, params, retries=retries, throttle=throttle, check=check_status)
+    values = payload_values(payload)
+    if checkpoints[index]:
+      checkpoints[index].save(start, values)
+    pages[index, start] = values
+
+  totals = await asyncio.gather(*(count(params) for params in queries))
+  starts = [list(range(1, total + 1, page_size)) for total in totals]
+  missing = []
+  for index, query_starts in enumerate(starts):
+    for start in query_starts:
+      values = checkpoints[index].load(start) if checkpoints[index] else None
+      if values is None:
+        missing.append(run(index, start))
+      else:
+        pages[index, start] = values
+  await asyncio.gather(*missing)
+  return collect_pages(queries, list(totals), starts, pages, checkpoints)
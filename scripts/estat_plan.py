@@ -0,0 +1,210 @@
+"""Plan getStatsData queries from a table's getMetaInfo metadata.
+
+A selection ("municipalities only, dwelling type 民営借家, latest year") is
+translated into the server-side narrowing parameters ``lvArea`` / ``cdArea``,
+``cdCat01`` ... and ``cdTime`` so that e-Stat only returns the cells that are
+kept. Without them the whole table (every area x category x time cell) is
+downloaded and mostly discarded. The metadata request goes through the same
+session as the data, so the HTTP cache (http_cache.py) serves it on later
+runs.
+"""
+
+from __future__ import annotations
+
+import argparse
+import math
+from dataclasses import dataclass, field
+
+import requests
+
+from estat import ESTAT_ENDPOINT, get_json
+from rate_limit import Throttle
+
+AREA_DIMENSION = "area"
+TIME_DIMENSION = "time"
+# Longest code list sent as cdArea; beyond it a level range is used instead.
+MAX_AREA_CODES = 100
+
+
+@dataclass(frozen=True)
+class ClassItem:
+  code: str
+  name: str
+  level: str = ""
+  parent: str = ""
+
+
+@dataclass
+class Selection:
+  # "municipality" keeps 市区町村 only; None keeps every area.
+  area_level: str | None = "municipality"
+  # "latest", a time code, or None for every period.
+  time: str | None = "latest"
+  # Dimension (cat01, cat02, ...) -> class code or name.
+  categories: dict[str, str] = field(default_factory=dict)
+
+
+@dataclass
+class QueryPlan:
+  params: dict[str, str]
+  # Upper bound of the cells the planned query returns, and of the whole table.
+  cells: int
+  total: int
+  # Municipality codes when the area filter sent to the server is wider than them.
+  areas: frozenset[str] | None = None
+  notes: list[str] = field(default_factory=list)
+
+  def summary(self) -> str:
+    # Long cdArea lists are shown by their length.
+    params = " ".join(
+      f"{key}={value}" if len(value) <= 40 else f"{key}=<{len(value.split(','))} codes>"
+      for key, value in self.params.items()
+    )
+    ratio = self.cells / self.total if self.total else 1.0
+    return f"{params or '(no filter)'}; up to {self.cells:,} of {self.total:,} cells ({ratio:.1%})"
+
+
+def meta_endpoint(endpoint: str) -> str:
+  """The getMetaInfo URL next to a getStatsData ``endpoint``."""
+  return endpoint.rsplit("/", 1)[0] + "/getMetaInfo"
+
+
+def as_list(value: object) -> list:
+  """e-Stat returns a lone element as an object instead of a one-element array."""
+  if value is None:
+    return []
+  return value if isinstance(value, list) else [value]
+
+
+def fetch_meta(
+  session: requests.Session,
+  api_key: str,
+  stats_data_id: str,
+  *,
+  endpoint: str = ESTAT_ENDPOINT,
+  retries: int = 4,
+  throttle: Throttle | None = None,
+) -> dict[str, list[ClassItem]]:
+  """Dimension id (``area``, ``cat01``, ``time``, ...) -> its classes."""
+  params = {"appId": api_key, "statsDataId": stats_data_id, "lang": "J"}
+  # get_json raises EstatError for an error status (and keeps it out of the HTTP cache).
+  body = get_json(session, meta_endpoint(endpoint), params, retries=retries, throttle=throttle)["GET_META_INFO"]
+  class_objects = as_list(body.get("METADATA_INF", {}).get("CLASS_INF", {}).get("CLASS_OBJ"))
+  return {
+    obj["@id"]: [
+      ClassItem(
+        str(item["@code"]),
+        item.get("@name", ""),
+        str(item.get("@level", "")),
+        str(item.get("@parentCode", "")),
+      )
+      for item in as_list(obj.get("CLASS"))
+    ]
+    for obj in class_objects
+  }
+
+
+def is_municipality(code: str) -> bool:
+  """5-digit local government codes other than the national (00000) and prefecture (xx000) ones."""
+  return len(code) == 5 and code.isdigit() and not code.endswith("000")
+
+
+def match_class(dimension: str, classes: list[ClassItem], wanted: str) -> ClassItem:
+  for item in classes:
+    if wanted in (item.code, item.name):
+      return item
+  choices = ", ".join(f"{item.code}:{item.name}" for item in classes[:20])
+  raise ValueError(f"{dimension}: no class '{wanted}' (available: {choices}{', ...' if len(classes) > 20 else ''})")
+
+
+def plan_area(areas: list[ClassItem], plan: QueryPlan) -> int:
+  """Add the area filter to ``plan``; return how many area classes it keeps."""
+  municipalities = [item for item in areas if is_municipality(item.code)]
+  if not municipalities:
+    plan.notes.append("no municipality-level areas in the metadata; areas are not filtered")
+    return len(areas)
+  levels = {item.level for item in municipalities}
+  if all(level.isdigit() for level in levels):
+    low, high = min(levels, key=int), max(levels, key=int)
+    in_range = [item for item in areas if item.level.isdigit() and int(low) <= int(item.level) <= int(high)]
+    if len(in_range) == len(municipalities) or len(municipalities) > MAX_AREA_CODES:
+      plan.params["lvArea"] = low if low == high else f"{low}-{high}"
+      if len(in_range) != len(municipalities):
+        plan.areas = frozenset(item.code for item in municipalities)
+        plan.notes.append(f"lvArea {plan.params['lvArea']} also holds non-municipal areas; they are dropped client-side")
+      return len(in_range)
+  if len(municipalities) > MAX_AREA_CODES:
+    plan.areas = frozenset(item.code for item in municipalities)
+    plan.notes.append("municipalities have no usable level; areas are filtered client-side")
+    return len(areas)
+  plan.params["cdArea"] = ",".join(item.code for item in municipalities)
+  return len(municipalities)
+
+
+def plan_query(meta: dict[str, list[ClassItem]], selection: Selection) -> QueryPlan:
+  """Narrowing parameters for ``selection``; raises ValueError for classes the table lacks."""
+  plan = QueryPlan({}, 0, math.prod(len(classes) or 1 for classes in meta.values()))
+  kept = {dimension: len(classes) or 1 for dimension, classes in meta.items()}
+
+  if selection.area_level == "municipality" and AREA_DIMENSION in meta:
+    kept[AREA_DIMENSION] = plan_area(meta[AREA_DIMENSION], plan)
+
+  for dimension, wanted in selection.categories.items():
+    if dimension not in meta:
+      raise ValueError(f"{dimension}: not a dimension of this table ({', '.join(meta)})")
+    item = match_class(dimension, meta[dimension], wanted)
+    plan.params[f"cd{dimension[0].upper()}{dimension[1:]}"] = item.code
+    kept[dimension] = 1
+
+  times = meta.get(TIME_DIMENSION, [])
+  if selection.time and times:
+    if selection.time == "latest":
+      # Time codes (e.g. 2018000000) sort chronologically.
+      plan.params["cdTime"] = max(item.code for item in times)
+    else:
+      plan.params["cdTime"] = match_class(TIME_DIMENSION, times, selection.time).code
+    kept[TIME_DIMENSION] = 1
+
+  plan.cells = math.prod(kept.values())
+  return plan
+
+
+def add_plan_arguments(parser: argparse.ArgumentParser) -> None:
+  group = parser.add_argument_group("サーバー側の絞り込み（getMetaInfo のメタ情報から lvArea / cdArea / cdCat01 / cdTime を決める）")
+  group.add_argument("--no-plan", action="store_true", help="絞り込まずに統計表全体を取得する")
+  group.add_argument("--area-level", choices=["municipality", "all"], default="municipality", help="municipality: 市区町村のみ")
+  group.add_argument("--time", default="latest", help="latest（最新の年次）、時間軸のコードまたは名称、all")
+  group.add_argument("--dwelling", help="住宅の種類（cat01）のコードまたは名称。例: 民営借家")
+  group.add_argument(
+    "--select",
+    action="append",
+    default=[],
+    metavar="DIMENSION=CLASS",
+    help="その他の分類の絞り込み（コードまたは名称）。例: cat02=総数",
+  )
+
+
+def plan_from_args(args: argparse.Namespace, session: requests.Session, throttle: Throttle | None = None) -> QueryPlan:
+  """Fetch the metadata of ``args.stats_data_id`` and plan the selection given on the command line."""
+  categories = {}
+  for spec in args.select:
+    dimension, _, wanted = spec.partition("=")
+    if not dimension.strip() or not wanted.strip():
+      raise SystemExit(f"--select の指定が正しくありません: {spec}（例: cat01=民営借家）")
+    categories[dimension.strip()] = wanted.strip()
+  if args.dwelling:
+    categories["cat01"] = args.dwelling
+  selection = Selection(
+    area_level=None if args.area_level == "all" else args.area_level,
+    time=None if args.time == "all" else args.time,
+    categories=categories,
+  )
+  meta = fetch_meta(session, args.api_key, args.stats_data_id, endpoint=args.endpoint, throttle=throttle)
+  try:
+    plan = plan_query(meta, selection)
+  except ValueError as exc:
+    raise SystemExit(f"取得条件を e-Stat の絞り込みに変換できません: {exc}")
+  print(f"plan: {plan.summary()}")
+  for note in plan.notes:
+    print(f"  note: {note}")
+  return plan
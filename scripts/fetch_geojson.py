@@ -4,57 +4,184 @@
 from __future__ import annotations
 
 import argparse
+import asyncio
 import json
 from pathlib import Path
+from typing import Iterator
 
 import requests
 
+from async_http import AsyncFetcher, add_async_arguments, fetcher_from_args, print_fetch_stats, run_with
+from http_cache import add_cache_arguments, print_cache_stats, session_from_args
+from json_stream import CHUNK_SIZE, FeatureCollectionWriter, iter_array_items, iter_file_chunks
+from simplify import DEFAULT_LEVELS, level_paths, parse_levels, simplify_levels
+from snapshot import write_municipalities
+from topojson_codec import encode_topology
+
 N03_GEOJSON_URL = "https://geoshape.ex.nii.ac.jp/city/20200101/geojson/ja_2020.geojson"
 
 
-def fetch_geojson(url: str) -> dict:
-  response = requests.get(url, timeout=60)
+def fetch_geojson(url: str, session: requests.Session | None = None) -> dict:
+  path = Path(url)
+  if path.is_file():
+    return json.loads(path.read_bytes())
+  response = (session or requests).get(url, timeout=60)
   response.raise_for_status()
   return response.json()
 
 
+async def fetch_geojson_async(url: str, fetcher: AsyncFetcher) -> dict:
+  path = Path(url)
+  if path.is_file():
+    return json.loads(path.read_bytes())
+  return await fetcher.get_json(url)
+
+
+async def fetch_all_async(sources: list[str], fetcher: AsyncFetcher) -> list[dict]:
+  return list(await asyncio.gather(*(fetch_geojson_async(source, fetcher) for source in sources)))
+
+
+def fetch_sources(sources: list[str], session: requests.Session, fetcher: AsyncFetcher | None = None) -> dict:
+  """Fetch every source (concurrently with ``fetcher``) and merge their features in source order."""
+  if fetcher is None:
+    payloads = [fetch_geojson(source, session) for source in sources]
+  else:
+    payloads = run_with(fetcher, lambda fetcher: fetch_all_async(sources, fetcher))
+  features = [feature for payload in payloads for feature in payload.get("features", [])]
+  return {"type": "FeatureCollection", "features": features}
+
+
+def iter_source_chunks(
+  source: str,
+  session: requests.Session | None = None,
+  chunk_size: int = CHUNK_SIZE,
+) -> Iterator[bytes]:
+  path = Path(source)
+  if path.is_file():
+    yield from iter_file_chunks(path, chunk_size)
+    return
+  with (session or requests).get(source, stream=True, timeout=60) as response:
+    response.raise_for_status()
+    yield from response.iter_content(chunk_size)
+
+
+def iter_features(source: str, session: requests.Session | None = None) -> Iterator[dict]:
+  return iter_array_items(iter_source_chunks(source, session), "features")
+
+
+def simplify_feature(feature: dict) -> dict:
+  props = feature.get("properties", {})
+  code = str(props.get("N03_007", ""))
+  name = props.get("N03_004", "")
+  pref_code = code[:2]
+  return {
+    "type": "Feature",
+    "properties": {
+      "code": code,
+      "name": name,
+      "prefecture_code": pref_code,
+      "rent_avg": None,
+      "population": None,
+      "area_km2": None,
+    },
+    "geometry": feature.get("geometry"),
+  }
+
+
 def simplify_payload(payload: dict) -> dict:
-  features = []
-  for feature in payload.get("features", []):
-    props = feature.get("properties", {})
-    code = str(props.get("N03_007", ""))
-    name = props.get("N03_004", "")
-    pref_code = code[:2]
-    features.append(
-      {
-        "type": "Feature",
-        "properties": {
-          "code": code,
-          "name": name,
-          "prefecture_code": pref_code,
-          "rent_avg": None,
-          "population": None,
-          "area_km2": None,
-        },
-        "geometry": feature.get("geometry"),
-      }
-    )
+  features = [simplify_feature(feature) for feature in payload.get("features", [])]
   return {"type": "FeatureCollection", "features": features}
 
 
+def encode(collection: dict, fmt: str) -> dict:
+  if fmt == "topojson":
+    return encode_topology(collection["features"])
+  return collection
+
+
 def main() -> None:
   parser = argparse.ArgumentParser()
   parser.add_argument("--output", default="data/municipalities.geojson")
-  parser.add_argument("--source", default=N03_GEOJSON_URL)
+  parser.add_argument(
+    "--source",
+    action="append",
+    help="URL またはローカルの GeoJSON ファイル。複数指定すると Feature をまとめて出力（都道府県別・年次別のファイルなど）",
+  )
+  parser.add_argument(
+    "--stream",
+    action="store_true",
+    help="Feature を 1 件ずつ読み込み・書き出す（全国データでもメモリ使用量が一定。形状は簡略化しない）",
+  )
+  parser.add_argument(
+    "--levels",
+    help="詳細度ごとの許容誤差（度）。例: nation=0.01,prefecture=0.001,city=0.0001。空文字で簡略化しない",
+  )
+  parser.add_argument(
+    "--format",
+    choices=["geojson", "topojson"],
+    default="geojson",
+    help="topojson: 共有境界を 1 本の arc にまとめ、座標を量子化・差分符号化して出力",
+  )
+  parser.add_argument(
+    "--no-snapshot",
+    action="store_true",
+    help="属性と全詳細度の境界をまとめたスナップショット（--output の拡張子を .snap にしたもの）を書き出さない",
+  )
+  add_cache_arguments(parser)
+  add_async_arguments(parser)
   args = parser.parse_args()
+  args.source = args.source or [N03_GEOJSON_URL]
+
+  fetcher = fetcher_from_args(args)
+  with session_from_args(args) as session:
+    run(args, session, fetcher)
+  print_cache_stats(session)
+  print_fetch_stats(fetcher)
 
-  payload = fetch_geojson(args.source)
-  simplified = simplify_payload(payload)
 
+def run(args: argparse.Namespace, session: requests.Session, fetcher: AsyncFetcher | None = None) -> None:
   out = Path(args.output)
   out.parent.mkdir(parents=True, exist_ok=True)
-  out.write_text(json.dumps(simplified, ensure_ascii=False), encoding="utf-8")
-  print(f"saved: {out}")
+
+  if args.stream:
+    if args.levels or args.format != "geojson":
+      raise SystemExit("--stream では --levels / --format topojson を指定できません（境界の共有判定に全 Feature が必要です）。")
+    if fetcher is not None:
+      raise SystemExit("--stream では --transport async を指定できません。")
+    with out.open("w", encoding="utf-8") as fp, FeatureCollectionWriter(fp) as writer:
+      for source in args.source:
+        for feature in iter_features(source, session):
+          writer.write(simplify_feature(feature))
+    print(f"saved: {out} ({writer.count} features, streamed)")
+    return
+
+  payload = fetch_sources(args.source, session, fetcher)
+  simplified = simplify_payload(payload)
+  levels = parse_levels(args.levels) if args.levels is not None else DEFAULT_LEVELS
+  if not levels:
+    out.write_text(json.dumps(encode(simplified, args.format), ensure_ascii=False), encoding="utf-8")
+    print(f"saved: {out}")
+    save_snapshot(args, out, {"full": simplified["features"]})
+    return
+
+  outputs, report = simplify_levels(simplified["features"], levels)
+  print(f"source vertices: {report.source_vertices:,} (junctions: {report.junctions:,})")
+  for name, path in level_paths(out, levels).items():
+    collection = {"type": "FeatureCollection", "features": outputs[name]}
+    path.write_text(json.dumps(encode(collection, args.format), ensure_ascii=False), encoding="utf-8")
+    print(
+      f"saved: {path} [{name} tol={levels[name]:g}] "
+      f"vertices={report.vertices[name]:,} bytes={path.stat().st_size:,}"
+    )
+  save_snapshot(args, out, outputs)
+
+
+def save_snapshot(args: argparse.Namespace, out: Path, levels: dict[str, list[dict]]) -> None:
+  if args.no_snapshot:
+    return
+  path = out.with_suffix(".snap")
+  size = write_municipalities(path, levels)
+  print(f"saved: {path} (levels={','.join(levels)}, bytes={size:,})")
 
 
 if __name__ == "__main__":
@@ -5,55 +5,379 @@ from __future__ import annotations
 
 import argparse
 import csv
+import json
 import os
+import time
+from dataclasses import dataclass, field
+from functools import partial
 from pathlib import Path
+from typing import Callable
 
 import requests
 
-ESTAT_ENDPOINT = "https://api.e-stat.go.jp/rest/3.0/app/json/getStatsData"
+from async_http import AsyncFetcher, add_async_arguments, fetcher_from_args, print_fetch_stats, run_with
+from estat import (
+  ESTAT_ENDPOINT,
+  PAGE_SIZE,
+  CellFilter,
+  StreamReport,
+  fetch_many,
+  fetch_many_async,
+  fetch_values,
+  iter_values,
+  make_session,
+  pooled_session,
+)
+from estat_plan import add_plan_arguments, plan_from_args
+from http_cache import add_cache_arguments, print_cache_stats, session_from_args
+from rate_limit import Throttle, add_rate_arguments, print_throttle_stats, throttle_from_args
+from snapshot import write_snapshot
+
 DEFAULT_STATS_DATA_ID = "0003422730"
+DEFAULT_CHECKPOINT_DIR = "data/.estat-checkpoints"
+RENT_FIELDS = ["municipality_code", "rent_avg"]
+LONG_FIELDS = ["municipality_code", "dwelling_type", "year", "rent_avg", "stats_data_id"]
+
+
+@dataclass
+class BatchJob:
+  """One manifest entry: a stats table plus e-Stat filters (cdCat01, cdTime, ...)."""
+
+  stats_data_id: str
+  dwelling_type: str = ""
+  filters: dict[str, str] = field(default_factory=dict)
+
 
+def load_manifest(path: Path) -> list[BatchJob]:
+  """Read a batch manifest.
 
-def fetch_rows(api_key: str, stats_data_id: str) -> list[dict]:
+  Format::
+
+    {"tables": [{"stats_data_id": "0003422730", "dwelling_type": "民営借家",
+                 "filters": {"cdCat01": "...", "cdTime": "2018000000"}}]}
+  """
+  manifest = json.loads(path.read_text(encoding="utf-8"))
+  return [
+    BatchJob(
+      stats_data_id=str(entry["stats_data_id"]),
+      dwelling_type=entry.get("dwelling_type", ""),
+      filters={key: str(value) for key, value in entry.get("filters", {}).items()},
+    )
+    for entry in manifest["tables"]
+  ]
+
+
+def fetch_rows(
+  api_key: str,
+  stats_data_id: str,
+  *,
+  session: requests.Session | None = None,
+  endpoint: str = ESTAT_ENDPOINT,
+  workers: int = 4,
+  page_size: int = PAGE_SIZE,
+  checkpoint_dir: Path | None = None,
+  fetcher: AsyncFetcher | None = None,
+  throttle: Throttle | None = None,
+  filters: dict[str, str] | None = None,
+) -> list[dict]:
   params = {
     "appId": api_key,
     "statsDataId": stats_data_id,
     "lang": "J",
-    "metaGetFlg": "N",
-    "cntGetFlg": "N",
+    **(filters or {}),
   }
-  response = requests.get(ESTAT_ENDPOINT, params=params, timeout=60)
-  response.raise_for_status()
-  values = response.json()["GET_STATS_DATA"]["STATISTICAL_DATA"]["DATA_INF"]["VALUE"]
-  return values if isinstance(values, list) else [values]
+  if fetcher is not None:
+    work = partial(
+      fetch_many_async,
+      queries=[params],
+      endpoint=endpoint,
+      page_size=page_size,
+      checkpoint_dir=checkpoint_dir,
+      throttle=throttle,
+    )
+    return run_with(fetcher, work)[0]
+  with pooled_session(workers, session) as session:
+    return fetch_values(
+      session,
+      params,
+      endpoint=endpoint,
+      page_size=page_size,
+      workers=workers,
+      checkpoint_dir=checkpoint_dir,
+      throttle=throttle,
+    )
+
+
+def fetch_batch(
+  api_key: str,
+  jobs: list[BatchJob],
+  *,
+  session: requests.Session | None = None,
+  endpoint: str = ESTAT_ENDPOINT,
+  workers: int = 4,
+  page_size: int = PAGE_SIZE,
+  checkpoint_dir: Path | None = None,
+  fetcher: AsyncFetcher | None = None,
+  throttle: Throttle | None = None,
+) -> list[tuple[BatchJob, list[dict]]]:
+  queries = [
+    {"appId": api_key, "statsDataId": job.stats_data_id, "lang": "J", **job.filters}
+    for job in jobs
+  ]
+  if fetcher is not None:
+    work = partial(
+      fetch_many_async,
+      queries=queries,
+      endpoint=endpoint,
+      page_size=page_size,
+      checkpoint_dir=checkpoint_dir,
+      throttle=throttle,
+    )
+    return list(zip(jobs, run_with(fetcher, work)))
+  with pooled_session(workers, session) as session:
+    results = fetch_many(
+      session,
+      queries,
+      endpoint=endpoint,
+      page_size=page_size,
+      workers=workers,
+      checkpoint_dir=checkpoint_dir,
+      throttle=throttle,
+    )
+  return list(zip(jobs, results))
 
 
-def to_csv(rows: list[dict], output: Path) -> None:
+def planned_cell(areas: frozenset[str], keep: Callable[[dict], bool] | None, cell: dict) -> bool:
+  """Drop the non-municipal areas a level-range filter let through, then apply ``--keep``."""
+  return cell.get("@area") in areas and (keep is None or keep(cell))
+
+
+def rent_record(row: dict) -> dict | None:
+  """The ``municipality_code, rent_avg`` record of a cell, or None for a suppressed value."""
+  area = row.get("@area", "")
+  value = row.get("$", "")
+  if not area or value in {"-", ""}:
+    return None
+  return {"municipality_code": area[-5:], "rent_avg": value}
+
+
+def rent_values(rows: list[dict]) -> list[dict]:
+  """``municipality_code, rent_avg`` records, skipping suppressed values."""
+  return [record for record in map(rent_record, rows) if record is not None]
+
+
+def stream_csv(
+  api_key: str,
+  stats_data_id: str,
+  output: Path,
+  *,
+  session: requests.Session | None = None,
+  endpoint: str = ESTAT_ENDPOINT,
+  page_size: int = PAGE_SIZE,
+  keep: Callable[[dict], bool] | None = None,
+  throttle: Throttle | None = None,
+  filters: dict[str, str] | None = None,
+) -> StreamReport:
+  """Write the rent CSV while the cells are parsed off the response, one cell in memory at a time."""
+  params = {"appId": api_key, "statsDataId": stats_data_id, "lang": "J", **(filters or {})}
+  report = StreamReport()
+  started = time.perf_counter()
+  output.parent.mkdir(parents=True, exist_ok=True)
+  with pooled_session(1, session) as session, output.open("w", encoding="utf-8", newline="") as fp:
+    writer = csv.DictWriter(fp, fieldnames=RENT_FIELDS)
+    writer.writeheader()
+    cells = iter_values(session, params, endpoint=endpoint, page_size=page_size, throttle=throttle, report=report)
+    for cell in cells:
+      record = rent_record(cell) if keep is None or keep(cell) else None
+      if record is None:
+        continue
+      writer.writerow(record)
+      report.rows += 1
+      if report.first_row is None:
+        fp.flush()
+        report.first_row = time.perf_counter() - started
+  report.seconds = time.perf_counter() - started
+  return report
+
+
+def to_csv(records: list[dict], output: Path) -> None:
   output.parent.mkdir(parents=True, exist_ok=True)
   with output.open("w", encoding="utf-8", newline="") as fp:
-    writer = csv.DictWriter(fp, fieldnames=["municipality_code", "rent_avg"])
+    writer = csv.DictWriter(fp, fieldnames=RENT_FIELDS)
     writer.writeheader()
+    writer.writerows(records)
+
+
+def long_records(results: list[tuple[BatchJob, list[dict]]]) -> list[dict]:
+  """One record per (municipality_code, dwelling_type, year), sorted for time-series use."""
+  records: dict[tuple[str, str, str], dict] = {}
+  for job, rows in results:
     for row in rows:
       area = row.get("@area", "")
       value = row.get("$", "")
       if not area or value in {"-", ""}:
         continue
-      writer.writerow({"municipality_code": area[-5:], "rent_avg": value})
+      record = {
+        "municipality_code": area[-5:],
+        "dwelling_type": job.dwelling_type or row.get("@cat01", ""),
+        "year": row.get("@time", "")[:4],
+        "rent_avg": value,
+        "stats_data_id": job.stats_data_id,
+      }
+      records[record["municipality_code"], record["dwelling_type"], record["year"]] = record
+  return [records[key] for key in sorted(records)]
+
+
+def to_long_csv(records: list[dict], output: Path) -> None:
+  output.parent.mkdir(parents=True, exist_ok=True)
+  with output.open("w", encoding="utf-8", newline="") as fp:
+    writer = csv.DictWriter(fp, fieldnames=LONG_FIELDS)
+    writer.writeheader()
+    writer.writerows(records)
+
+
+def to_snapshot(records: list[dict], fieldnames: list[str], output: Path) -> int:
+  """Columnar copy of ``records`` (see snapshot.py) with ``rent_avg`` as float64."""
+  columns = {name: [record[name] for record in records] for name in fieldnames}
+  columns["rent_avg"] = [float(value) for value in columns["rent_avg"]]
+  return write_snapshot(output, columns)
+
+
+def save_snapshot(args: argparse.Namespace, records: list[dict], fieldnames: list[str], output: Path) -> None:
+  if args.no_snapshot:
+    return
+  path = output.with_suffix(".snap")
+  size = to_snapshot(records, fieldnames, path)
+  print(f"saved: {path} ({len(records)} rows, {size:,} bytes)")
 
 
 def main() -> None:
   parser = argparse.ArgumentParser()
   parser.add_argument("--api-key", default=os.getenv("ESTAT_API_KEY", ""))
   parser.add_argument("--stats-data-id", default=DEFAULT_STATS_DATA_ID)
-  parser.add_argument("--output", default="data/rent_avg.csv")
+  parser.add_argument(
+    "--manifest",
+    help="複数の統計表・住宅の種類・年次をまとめて取得するバッチ定義（JSON）。指定時は縦持ち CSV を出力",
+  )
+  parser.add_argument("--output", help="出力 CSV（既定: data/rent_avg.csv、--manifest 指定時は data/rent_long.csv）")
+  parser.add_argument("--no-snapshot", action="store_true", help="CSV と同じ場所にスナップショット（.snap）を書き出さない")
+  parser.add_argument("--endpoint", default=ESTAT_ENDPOINT)
+  parser.add_argument("--workers", type=int, default=4, help="ページ取得の並列数")
+  parser.add_argument("--page-size", type=int, default=PAGE_SIZE, help="1 リクエストあたりの件数（最大 100000）")
+  parser.add_argument(
+    "--checkpoint-dir",
+    default=DEFAULT_CHECKPOINT_DIR,
+    help="取得済みページの保存先。中断後の再実行はここから再開する",
+  )
+  parser.add_argument(
+    "--keep",
+    action="append",
+    default=[],
+    metavar="DIMENSION=CODES",
+    help="残すセルの条件（例: area=13*（前方一致）、cat01=003、time=2018000000）。複数指定はすべて満たすもの",
+  )
+  parser.add_argument(
+    "--stream",
+    action="store_true",
+    help="応答の VALUE を 1 セルずつ読みながら条件に合う行を CSV に書き出す（メモリ使用量が一定。ページは順に取得し、チェックポイント・スナップショットは作らない）",
+  )
+  add_cache_arguments(parser)
+  add_async_arguments(parser)
+  add_rate_arguments(parser)
+  add_plan_arguments(parser)
   args = parser.parse_args()
 
   if not args.api_key:
     raise SystemExit("ESTAT APIキーが必要です。--api-key か ESTAT_API_KEY を指定してください。")
 
-  rows = fetch_rows(args.api_key, args.stats_data_id)
-  to_csv(rows, Path(args.output))
-  print(f"saved: {args.output}")
+  try:
+    keep = CellFilter.parse(args.keep) if args.keep else None
+  except ValueError as exc:
+    raise SystemExit(f"--keep の指定が正しくありません: {exc}")
+  if args.stream and (args.manifest or args.transport == "async"):
+    raise SystemExit("--stream は --manifest / --transport async と同時に指定できません。")
+
+  with make_session(args.workers, session_from_args(args)) as session:
+    run(args, session, keep)
+
+
+def run(args: argparse.Namespace, session: requests.Session, keep: Callable[[dict], bool] | None) -> None:
+  fetcher = fetcher_from_args(args)
+  throttle = throttle_from_args(args, args.per_host if fetcher else args.workers)
+
+  filters = {}
+  if not args.manifest and not args.no_plan:
+    plan = plan_from_args(args, session, throttle)
+    filters = plan.params
+    if plan.areas is not None:
+      keep = partial(planned_cell, plan.areas, keep)
+
+  if args.stream:
+    output = Path(args.output or "data/rent_avg.csv")
+    report = stream_csv(
+      args.api_key,
+      args.stats_data_id,
+      output,
+      session=session,
+      endpoint=args.endpoint,
+      page_size=args.page_size,
+      keep=keep,
+      throttle=throttle,
+      filters=filters,
+    )
+    print(f"saved: {output} ({report.rows} rows, streamed)")
+    print(f"stream: {report.summary()}")
+    print_cache_stats(session)
+    print_throttle_stats(throttle)
+    return
+
+  if args.manifest:
+    jobs = load_manifest(Path(args.manifest))
+    results = fetch_batch(
+      args.api_key,
+      jobs,
+      session=session,
+      endpoint=args.endpoint,
+      workers=args.workers,
+      page_size=args.page_size,
+      checkpoint_dir=Path(args.checkpoint_dir),
+      fetcher=fetcher,
+      throttle=throttle,
+    )
+    if keep is not None:
+      results = [(job, [row for row in rows if keep(row)]) for job, rows in results]
+    output = Path(args.output or "data/rent_long.csv")
+    records = long_records(results)
+    to_long_csv(records, output)
+    print(f"saved: {output} ({len(jobs)} tables, {len(records)} rows)")
+    save_snapshot(args, records, LONG_FIELDS, output)
+    print_cache_stats(session)
+    print_fetch_stats(fetcher)
+    print_throttle_stats(throttle)
+    return
+
+  rows = fetch_rows(
+    args.api_key,
+    args.stats_data_id,
+    session=session,
+    endpoint=args.endpoint,
+    workers=args.workers,
+    page_size=args.page_size,
+    checkpoint_dir=Path(args.checkpoint_dir),
+    fetcher=fetcher,
+    throttle=throttle,
+    filters=filters,
+  )
+  if keep is not None:
+    rows = [row for row in rows if keep(row)]
+  output = Path(args.output or "data/rent_avg.csv")
+  records = rent_values(rows)
+  to_csv(records, output)
+  print(f"saved: {output} ({len(rows)} values)")
+  save_snapshot(args, records, RENT_FIELDS, output)
+  print_cache_stats(session)
+  print_fetch_stats(fetcher)
+  print_throttle_stats(throttle)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+"""Memory-mapped geometry store: fixed-point boundaries indexed by code.
+
+Every level of detail is packed into one snapshot file (``snapshot.py``):
+int32 fixed-point coordinates (``scale`` units per degree; the default
+1e-6 degree is about 0.1 m) with ring / polygon / feature offset arrays,
+each feature's code and its properties as raw JSON bytes. Opening a store
+only maps the file. Codes are found by binary search over a stored sort
+order, and a feature is only turned into Python objects when it is asked
+for: ``geometries_json`` and ``compact_ints`` go straight from the mapped
+int32 slices to GeoJSON text or the page's compact delta format.
+
+Stores are built by streaming the GeoJSON (``json_stream.py``) or reading
+a snapshot, so the source document is never held in memory as a whole.
+
+  python3 scripts/geometry_store.py --input data/municipalities.geojson
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+from array import array
+from collections.abc import Mapping
+from functools import partial
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+
+import numpy as np
+
+from json_stream import iter_array_items, iter_file_chunks
+from simplify import DEFAULT_LEVELS, level_paths, parse_levels
+from snapshot import GEOMETRY_PREFIX, GEOMETRY_TYPES, Snapshot, is_snapshot, write_snapshot
+
+STORE_FORMAT = "geometry-store"
+STORE_SUFFIX = ".geom"
+DEFAULT_SCALE = 1_000_000
+
+
+class LevelWriter:
+  """Packs the features of one level as they stream in."""
+
+  def __init__(self, scale: int) -> None:
+    self.scale = scale
+    self.codes: list[str] = []
+    self.types = array("B")
+    self.feature_offsets = array("q", [0])
+    self.polygon_offsets = array("q", [0])
+    self.ring_offsets = array("q", [0])
+    self.coords: list[np.ndarray] = []
+    self.points = 0
+    self.properties = bytearray()
+    self.property_offsets = array("q", [0])
+
+  def add(self, feature: dict) -> None:
+    props = feature.get("properties") or {}
+    geometry = feature.get("geometry") or {}
+    kind = GEOMETRY_TYPES.get(geometry.get("type"), 0)
+    polygons = [] if not kind else [geometry["coordinates"]] if kind == 1 else geometry["coordinates"]
+    for polygon in polygons:
+      for ring in polygon:
+        if ring:
+          points = np.rint(np.asarray(ring, dtype=np.float64)[:, :2] * self.scale).astype("<i4")
+          self.coords.append(points)
+          self.points += len(points)
+        self.ring_offsets.append(self.points)
+      self.polygon_offsets.append(len(self.ring_offsets) - 1)
+    self.feature_offsets.append(len(self.polygon_offsets) - 1)
+    self.types.append(kind)
+    self.codes.append(str(props.get("code", "")))
+    self.properties += json.dumps(props, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    self.property_offsets.append(len(self.properties))
+
+  def arrays(self) -> dict[str, np.ndarray]:
+    codes = np.array(self.codes or [""], dtype=str)[:len(self.codes)]
+    return {
+      "codes": codes.astype(codes.dtype.newbyteorder("<")),
+      "order": np.argsort(codes, kind="stable").astype("<i8"),
+      "types": np.frombuffer(self.types.tobytes(), dtype=np.uint8),
+      "feature_offsets": np.asarray(self.feature_offsets, dtype="<i8"),
+      "polygon_offsets": np.asarray(self.polygon_offsets, dtype="<i8"),
+      "ring_offsets": np.asarray(self.ring_offsets, dtype="<i8"),
+      "coords": np.concatenate(self.coords) if self.coords else np.empty((0, 2), dtype="<i4"),
+      "property_offsets": np.asarray(self.property_offsets, dtype="<i8"),
+      "properties": np.frombuffer(bytes(self.properties), dtype=np.uint8),
+    }
+
+
+def write_store(
+  path: Path,
+  levels: dict[str, Iterable[dict]],
+  scale: int = DEFAULT_SCALE,
+  metadata: dict | None = None,
+) -> int:
+  """Pack ``levels`` (level name -> features) into a store; returns the file size."""
+  if scale < 1 or 10 ** (len(str(scale)) - 1) != scale:
+    raise ValueError(f"scale must be a power of ten: {scale}")
+  packed = {}
+  for name, features in levels.items():
+    writer = LevelWriter(scale)
+    for feature in features:
+      writer.add(feature)
+    packed[name] = writer.arrays()
+  return write_snapshot(path, {}, metadata={**(metadata or {}), "format": STORE_FORMAT, "scale": scale}, packed=packed)
+
+
+def is_store(path: Path) -> bool:
+  if not is_snapshot(path):
+    return False
+  with Snapshot(path) as snapshot:
+    return snapshot.metadata.get("format") == STORE_FORMAT
+
+
+def iter_geojson(path: Path) -> Iterator[dict]:
+  return iter_array_items(iter_file_chunks(path), "features")
+
+
+def iter_snapshot(path: Path, level: str) -> Iterator[dict]:
+  """Features of one level of a snapshot; the file is mapped while they are read."""
+  with Snapshot(path) as snapshot:
+    yield from snapshot.features(level)
+
+
+def feature_sources(path: Path, levels: dict[str, float] | None = None) -> dict[str, tuple[Callable[[], Iterable[dict]], list[Path]]]:
+  """Level name -> (feature iterator factory, input files) for a GeoJSON file or snapshot.
+
+  A GeoJSON ``path`` is the finest of ``levels``; the other levels are read
+  from the files ``fetch_geojson.py`` writes next to it, when they exist.
+  Without ``levels`` a GeoJSON file is the single level ``full`` and a
+  snapshot contributes every level it holds.
+  """
+  if is_snapshot(path):
+    with Snapshot(path) as snapshot:
+      names = [name for name in snapshot.levels if levels is None or name in levels] or [snapshot.finest_level]
+    return {name: (partial(iter_snapshot, path, name), [path]) for name in names}
+  if not levels:
+    return {"full": (partial(iter_geojson, path), [path])}
+  return {
+    name: (partial(iter_geojson, level_path), [level_path])
+    for name, level_path in level_paths(path, levels).items()
+    if level_path.exists()
+  }
+
+
+def _stamp(paths: Iterable[Path]) -> list[list]:
+  return [[str(path), path.stat().st_mtime_ns, path.stat().st_size] for path in paths]
+
+
+def ensure_store(
+  store_path: Path,
+  sources: dict[str, tuple[Callable[[], Iterable[dict]], list[Path]]],
+  scale: int = DEFAULT_SCALE,
+) -> bool:
+  """(Re)build ``store_path`` unless it was built from the same input files; returns True if built."""
+  stamps = {name: _stamp(paths) for name, (_, paths) in sources.items()}
+  if store_path.exists() and is_store(store_path):
+    # Closed before write_store replaces the file (a mapped file cannot be replaced on Windows).
+    with Snapshot(store_path) as snapshot:
+      metadata = snapshot.metadata
+    if metadata.get("sources") == stamps and metadata.get("scale") == scale:
+      return False
+  write_store(store_path, {name: factory() for name, (factory, _) in sources.items()}, scale, {"sources": stamps})
+  return True
+
+
+def _digits(values: np.ndarray, width: int) -> np.ndarray:
+  """ASCII digit matrix ``(len(values), width)`` of non-negative ``values``, zero-padded."""
+  powers = 10 ** np.arange(width - 1, -1, -1, dtype=np.int64)
+  return (values[:, None] // powers % 10 + ord("0")).astype(np.uint8)
+
+
+def points_text(points: np.ndarray, scale: int) -> tuple[bytes, np.ndarray]:
+  """JSON text ``[x,y],[x,y],...,`` of fixed-point ``points`` plus each point's end offset.
+
+  Numbers are written in their shortest decimal form (``139.7635``,
+  ``35.0``), which for coordinates with at most ``log10(scale)`` decimals is
+  exactly what ``json.dumps`` writes for the float. Every character is laid
+  out in a byte matrix with NumPy and the unused cells masked away, so no
+  Python number or string objects are created per point.
+  """
+  digits = len(str(scale)) - 1
+  values = points.astype(np.int64).reshape(-1)
+  magnitude = np.abs(values)
+  whole, fraction = np.divmod(magnitude, scale)
+  width = max(1, len(str(int(whole.max())))) if len(whole) else 1
+  whole_digits = 1 + sum((whole >= 10**k).astype(np.int64) for k in range(1, width))
+  trailing = sum((fraction % 10**k == 0).astype(np.int64) for k in range(1, digits + 1))
+  fraction_digits = np.maximum(1, digits - trailing)
+
+  columns = np.arange(width)
+  chars = np.concatenate([
+    np.full((len(values), 1), ord("-"), dtype=np.uint8),
+    _digits(whole, width),
+    np.full((len(values), 1), ord("."), dtype=np.uint8),
+    _digits(fraction, digits),
+  ], axis=1)
+  keep = np.concatenate([
+    (values < 0)[:, None],
+    columns[None, :] >= width - whole_digits[:, None],
+    np.ones((len(values), 1), dtype=bool),
+    np.arange(digits)[None, :] < fraction_digits[:, None],
+  ], axis=1)
+
+  # Two numbers per point: "[" x "," y "]" ",".
+  n = len(points)
+  number = chars.shape[1]
+  punctuation = lambda char: np.full((n, 1), ord(char), dtype=np.uint8)
+  row_chars = np.concatenate([
+    punctuation("["), chars[0::2], punctuation(","), chars[1::2], punctuation("]"), punctuation(","),
+  ], axis=1)
+  always = np.ones((n, 1), dtype=bool)
+  row_keep = np.concatenate([always, keep[0::2], always, keep[1::2], always, always], axis=1)
+  assert row_chars.shape[1] == 2 * number + 4
+  return row_chars[row_keep].tobytes(), np.cumsum(row_keep.sum(axis=1))
+
+
+class GeometryStore:
+  """One level of a geometry store, read lazily from the mapped file."""
+
+  def __init__(self, path: Path, level: str | None = None) -> None:
+    self.path = Path(path)
+    self.snapshot = Snapshot(self.path)
+    if self.snapshot.metadata.get("format") != STORE_FORMAT:
+      self.snapshot.close()
+      raise ValueError(f"{self.path} is not a geometry store")
+    self.scale: int = self.snapshot.metadata["scale"]
+    self.level = level or self.snapshot.finest_level
+    if self.level not in self.snapshot.levels:
+      self.snapshot.close()
+      raise KeyError(f"{self.path} has no level {self.level!r} (levels: {', '.join(self.snapshot.levels)})")
+    prefix = f"{GEOMETRY_PREFIX}{self.level}."
+    self._array = lambda name: self.snapshot.array(prefix + name)
+    self._sorted_codes: np.ndarray | None = None
+
+  def __enter__(self) -> "GeometryStore":
+    return self
+
+  def __exit__(self, *exc: object) -> None:
+    self.snapshot.close()
+
+  def __len__(self) -> int:
+    return len(self._array("types"))
+
+  @property
+  def levels(self) -> list[str]:
+    return self.snapshot.levels
+
+  @property
+  def codes(self) -> np.ndarray:
+    return self._array("codes")
+
+  def row(self, code: str) -> int | None:
+    """Row of ``code`` by binary search (no dictionary is built)."""
+    if self._sorted_codes is None:
+      self._sorted_codes = self.codes[self._array("order")]
+    position = int(np.searchsorted(self._sorted_codes, code))
+    if position < len(self._sorted_codes) and self._sorted_codes[position] == code:
+      return int(self._array("order")[position])
+    return None
+
+  def __contains__(self, code: str) -> bool:
+    return self.row(code) is not None
+
+  def properties_json(self, row: int) -> str:
+    start, end = self._array("property_offsets")[row:row + 2].tolist()
+    return self._array("properties")[start:end].tobytes().decode("utf-8")
+
+  def properties(self, row: int) -> dict:
+    return json.loads(self.properties_json(row))
+
+  def _parts(self, row: int) -> tuple[int, np.ndarray, np.ndarray, np.ndarray]:
+    """(type, polygon offsets, ring offsets, int32 points) of ``row``; offsets are relative."""
+    first, last = self._array("feature_offsets")[row:row + 2].tolist()
+    polygons = self._array("polygon_offsets")[first:last + 1]
+    rings = self._array("ring_offsets")[polygons[0]:polygons[-1] + 1]
+    points = self._array("coords")[rings[0]:rings[-1]]
+    return int(self._array("types")[row]), polygons - polygons[0], rings - rings[0], points
+
+  def geometry(self, row: int) -> dict | None:
+    """Decode ``row`` to a GeoJSON geometry with float coordinates."""
+    kind, polygons, rings, points = self._parts(row)
+    if not kind:
+      return None
+    points = (points / self.scale).tolist()
+    rings = rings.tolist()
+    coordinates = [
+      [points[rings[ring]:rings[ring + 1]] for ring in range(start, end)]
+      for start, end in zip(polygons.tolist(), polygons[1:].tolist())
+    ]
+    if kind == GEOMETRY_TYPES["Polygon"]:
+      return {"type": "Polygon", "coordinates": coordinates[0]}
+    return {"type": "MultiPolygon", "coordinates": coordinates}
+
+  def feature(self, row: int) -> dict:
+    return {"type": "Feature", "properties": self.properties(row), "geometry": self.geometry(row)}
+
+  def geometries_json(self, rows: Iterable[int]) -> list[str]:
+    """GeoJSON text of every row's geometry, formatted from the int32 slices in one pass."""
+    rows = np.asarray(list(rows), dtype=np.int64)
+    if not len(rows):
+      return []
+    kinds = self._array("types")[rows].tolist()
+    feature_offsets = self._array("feature_offsets")
+    polygon_offsets = self._array("polygon_offsets")
+    ring_offsets = self._array("ring_offsets")
+    first_polygons, end_polygons = feature_offsets[rows].tolist(), feature_offsets[rows + 1].tolist()
+    point_starts = ring_offsets[polygon_offsets[feature_offsets[rows]]].tolist()
+    point_ends = ring_offsets[polygon_offsets[feature_offsets[rows + 1]]].tolist()
+    coords = self._array("coords")
+    text, ends = points_text(np.concatenate([coords[a:b] for a, b in zip(point_starts, point_ends)]), self.scale)
+    text, ends = text.decode("ascii"), [0, *ends.tolist()]
+    polygon_offsets, ring_offsets = polygon_offsets.tolist(), ring_offsets.tolist()
+
+    out, base = [], 0
+    for kind, first, last, start, end in zip(kinds, first_polygons, end_polygons, point_starts, point_ends):
+      if not kind:
+        out.append("null")
+        continue
+      shift = base - start
+      # Each ring is its points' text minus the trailing comma.
+      polygons = [
+        "[" + ",".join(
+          "[" + text[ends[ring_offsets[ring] + shift]:ends[ring_offsets[ring + 1] + shift] - 1] + "]"
+          for ring in range(polygon_offsets[polygon], polygon_offsets[polygon + 1])
+        ) + "]"
+        for polygon in range(first, last)
+      ]
+      if kind == GEOMETRY_TYPES["Polygon"]:
+        out.append('{"type":"Polygon","coordinates":' + polygons[0] + "}")
+      else:
+        out.append('{"type":"MultiPolygon","coordinates":[' + ",".join(polygons) + "]}")
+      base += end - start
+    return out
+
+  def geometry_json(self, row: int) -> str:
+    return self.geometries_json([row])[0]
+
+  def features_json(self, rows: Iterable[int]) -> list[str]:
+    """GeoJSON Feature text of every row (properties are copied as stored)."""
+    rows = list(rows)
+    return [
+      '{"type":"Feature","properties":' + self.properties_json(row) + ',"geometry":' + geometry + "}"
+      for row, geometry in zip(rows, self.geometries_json(rows))
+    ]
+
+  def compact_ints(self, row: int) -> tuple[str, np.ndarray]:
+    """``(type letter, int32 stream)`` of ``row`` in the page's compact format.
+
+    Polygon count, then per polygon its ring count, then per ring its point
+    count followed by the x/y deltas from the previous point (the first one
+    from 0). Only valid when the store's scale is the compact format's.
+    """
+    kind, polygons, rings, points = self._parts(row)
+    if not kind:
+      return "-", np.zeros(1, dtype="<i4")
+    deltas = np.diff(points, axis=0, prepend=np.zeros((1, 2), dtype=points.dtype))
+    lengths = np.diff(rings)
+    starts = rings[:-1]
+    # Each ring's first point is stored absolute (its delta from 0).
+    deltas[starts[lengths > 0]] = points[starts[lengths > 0]]
+    parts = [np.array([len(polygons) - 1], dtype="<i4")]
+    for start, end in zip(polygons[:-1].tolist(), polygons[1:].tolist()):
+      parts.append(np.array([end - start], dtype="<i4"))
+      for ring in range(start, end):
+        parts.append(np.array([lengths[ring]], dtype="<i4"))
+        parts.append(deltas[rings[ring]:rings[ring + 1]].ravel())
+    return "P" if kind == GEOMETRY_TYPES["Polygon"] else "M", np.concatenate(parts).astype("<i4")
+
+  def bbox(self, rows: Iterable[int]) -> list[float] | None:
+    """``[west, south, east, north]`` over ``rows``."""
+    bounds = [
+      (points.min(axis=0), points.max(axis=0))
+      for points in (self._parts(row)[3] for row in rows)
+      if len(points)
+    ]
+    if not bounds:
+      return None
+    low = np.min([low for low, _ in bounds], axis=0) / self.scale
+    high = np.max([high for _, high in bounds], axis=0) / self.scale
+    return [float(low[0]), float(low[1]), float(high[0]), float(high[1])]
+
+  def geometry_hash(self, row: int) -> str:
+    """Digest of ``row``'s packed geometry; equal geometries hash equal at the same scale."""
+    kind, polygons, rings, points = self._parts(row)
+    digest = hashlib.sha256(bytes([kind]))
+    for values in (polygons, rings, points):
+      digest.update(np.ascontiguousarray(values, dtype="<i8").tobytes())
+    return digest.hexdigest()
+
+
+class StoredGeometries(Mapping):
+  """Level -> geometry of one feature across the levels of a store, decoded on access."""
+
+  def __init__(self, rows: dict[str, tuple[GeometryStore, int]]) -> None:
+    self._rows = rows
+
+  def __getitem__(self, level: str) -> dict | None:
+    store, row = self._rows[level]
+    return store.geometry(row)
+
+  def __iter__(self) -> Iterator[str]:
+    return iter(self._rows)
+
+  def __len__(self) -> int:
+    return len(self._rows)
+
+  def content_hash(self) -> str:
+    """Digest over every level's packed geometry, computed without decoding."""
+    digest = hashlib.sha256()
+    for level in sorted(self._rows):
+      store, row = self._rows[level]
+      digest.update(f"{level}:{store.geometry_hash(row)};".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--input", default="data/municipalities.geojson", help="最も細かい詳細度の GeoJSON またはスナップショット（.snap）")
+  parser.add_argument("--output", help="出力先（既定: --input の拡張子を .geom にしたもの）")
+  parser.add_argument("--levels", help="含める詳細度（fetch_geojson.py の --levels と同じ指定）")
+  parser.add_argument("--scale", type=int, default=DEFAULT_SCALE, help="1 度あたりの整数座標の単位数（10 のべき乗）")
+  args = parser.parse_args()
+
+  source = Path(args.input)
+  output = Path(args.output) if args.output else source.with_suffix(STORE_SUFFIX)
+  levels = parse_levels(args.levels) if args.levels is not None else DEFAULT_LEVELS
+  built = ensure_store(output, feature_sources(source, levels), args.scale)
+  with GeometryStore(output) as store:
+    levels = store.levels
+  sizes = {}
+  for level in levels:
+    with GeometryStore(output, level) as store:
+      sizes[level] = len(store)
+  state = "saved" if built else "up to date"
+  print(f"{state}: {output} ({', '.join(f'{level}={count:,}' for level, count in sizes.items())}, {os.path.getsize(output):,} bytes)")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,276 @@
+"""On-disk HTTP response cache shared by the pipeline scripts.
+
+Bodies are stored content-addressed (``objects/<sha256>``) and an index maps
+each request (URL + query) to its body and validators. Fresh entries (younger
+than the TTL) are served without any request; stale ones are revalidated
+with ``If-None-Match`` / ``If-Modified-Since`` so an unchanged resource only
+costs a ``304``. The cache is bounded in size and evicts least recently used
+entries. In offline mode only cached bodies are served. A caller that finds
+a stored body unusable (an API error sent with status 200) ``forget``s it so
+that the next run asks the server again.
+
+Index changes are appended to a journal (one JSON line per entry) instead of
+rewriting the whole index after every response; ``close()`` folds the
+journal into ``index.json``. A journal left behind by a run that did not
+close its session is replayed on the next start.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, fields
+from pathlib import Path
+from typing import TextIO
+from urllib.parse import urlencode
+
+import requests
+
+DEFAULT_CACHE_DIR = "data/.http-cache"
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_MAX_BYTES = 2 << 30
+CHUNK_SIZE = 1 << 20
+
+
+class OfflineCacheMiss(RuntimeError):
+  pass
+
+
+@dataclass
+class CacheStats:
+  hits: int = 0
+  revalidated: int = 0
+  misses: int = 0
+  evictions: int = 0
+  bytes_from_cache: int = 0
+  bytes_downloaded: int = 0
+
+  def summary(self) -> str:
+    return ", ".join(f"{f.name}={getattr(self, f.name):,}" for f in fields(self))
+
+
+def request_key(url: str, params: dict | None) -> str:
+  query = urlencode(sorted((params or {}).items()), doseq=True)
+  return hashlib.sha256(f"{url}?{query}".encode()).hexdigest()
+
+
+class CachedSession(requests.Session):
+  """A ``requests.Session`` whose GETs go through the on-disk cache.
+
+  Cached responses are returned as regular ``requests.Response`` objects
+  reading from the stored body file, so ``iter_content`` streams from disk
+  and ``json()`` works as usual.
+  """
+
+  def __init__(
+    self,
+    cache_dir: Path,
+    ttl: float = DEFAULT_TTL,
+    max_bytes: int = DEFAULT_MAX_BYTES,
+    offline: bool = False,
+  ) -> None:
+    super().__init__()
+    self.cache_dir = cache_dir
+    self.ttl = ttl
+    self.max_bytes = max_bytes
+    self.offline = offline
+    self.stats = CacheStats()
+    self._lock = threading.Lock()
+    self._index_path = cache_dir / "index.json"
+    self._journal_path = cache_dir / "index.journal"
+    self._journal: TextIO | None = None
+    self._index: dict[str, dict] = {}
+    if self._index_path.exists():
+      self._index = json.loads(self._index_path.read_text(encoding="utf-8"))
+    self._replay()
+    # Sum of the entry sizes; bodies shared by several entries are counted
+    # more than once, so the exact total only needs computing above the bound.
+    self._entry_bytes = sum(entry["size"] for entry in self._index.values())
+
+  def _replay(self) -> None:
+    if not self._journal_path.exists():
+      return
+    with self._journal_path.open(encoding="utf-8") as fp:
+      for line in fp:
+        try:
+          record = json.loads(line)
+        except json.JSONDecodeError:
+          # The last line of an interrupted run may be cut off.
+          break
+        if record["entry"] is None:
+          self._index.pop(record["key"], None)
+        else:
+          self._index[record["key"]] = record["entry"]
+
+  def object_path(self, digest: str) -> Path:
+    return self.cache_dir / "objects" / digest[:2] / digest
+
+  def get(self, url: str, params: dict | None = None, **kwargs) -> requests.Response:
+    key = request_key(url, params)
+    with self._lock:
+      entry = self._index.get(key)
+    if entry and not self.object_path(entry["body"]).exists():
+      entry = None
+
+    if entry and (self.offline or time.time() - entry["fetched_at"] < self.ttl):
+      return self._cached_response(key, entry, url, "hit")
+    if self.offline:
+      raise OfflineCacheMiss(f"not cached (offline mode): {url}")
+
+    headers = dict(kwargs.pop("headers", None) or {})
+    if entry and entry.get("etag"):
+      headers["If-None-Match"] = entry["etag"]
+    if entry and entry.get("last_modified"):
+      headers["If-Modified-Since"] = entry["last_modified"]
+    kwargs["stream"] = True
+    response = super().get(url, params=params, headers=headers, **kwargs)
+
+    if entry and response.status_code == 304:
+      response.close()
+      entry = {
+        **entry,
+        "fetched_at": time.time(),
+        "etag": response.headers.get("ETag", entry.get("etag")),
+        "last_modified": response.headers.get("Last-Modified", entry.get("last_modified")),
+      }
+      return self._cached_response(key, entry, url, "revalidated")
+    if response.status_code != 200:
+      return response
+    return self._store(key, url, response)
+
+  def _store(self, key: str, url: str, response: requests.Response) -> requests.Response:
+    self.cache_dir.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    with response, tempfile.NamedTemporaryFile(dir=self.cache_dir, delete=False) as tmp:
+      try:
+        for chunk in response.iter_content(CHUNK_SIZE):
+          digest.update(chunk)
+          tmp.write(chunk)
+          size += len(chunk)
+      except BaseException:
+        tmp.close()
+        os.unlink(tmp.name)
+        raise
+    path = self.object_path(digest.hexdigest())
+    path.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(tmp.name, path)
+
+    entry = {
+      "url": url,
+      "body": digest.hexdigest(),
+      "size": size,
+      "content_type": response.headers.get("Content-Type", ""),
+      "etag": response.headers.get("ETag"),
+      "last_modified": response.headers.get("Last-Modified"),
+      "fetched_at": time.time(),
+    }
+    with self._lock:
+      self.stats.misses += 1
+      self.stats.bytes_downloaded += size
+    return self._cached_response(key, entry, url, "miss")
+
+  def _cached_response(self, key: str, entry: dict, url: str, outcome: str) -> requests.Response:
+    entry = {**entry, "accessed_at": time.time()}
+    with self._lock:
+      self._set(key, entry)
+      if outcome == "hit":
+        self.stats.hits += 1
+      elif outcome == "revalidated":
+        self.stats.revalidated += 1
+      if outcome != "miss":
+        self.stats.bytes_from_cache += entry["size"]
+      if self._entry_bytes > self.max_bytes:
+        self._evict(keep=key)
+
+    response = requests.Response()
+    response.status_code = 200
+    response.url = url
+    response.headers["Content-Type"] = entry["content_type"]
+    response.headers["Content-Length"] = str(entry["size"])
+    response.headers["X-Cache"] = outcome
+    response.raw = self.object_path(entry["body"]).open("rb")
+    return response
+
+  def _evict(self, keep: str) -> None:
+    sizes = {entry["body"]: entry["size"] for entry in self._index.values()}
+    total = sum(sizes.values())
+    for key, entry in sorted(self._index.items(), key=lambda item: item[1]["accessed_at"]):
+      if total <= self.max_bytes:
+        break
+      if key == keep:
+        continue
+      self._set(key, None)
+      self.stats.evictions += 1
+      if self._drop_body(entry):
+        total -= sizes[entry["body"]]
+
+  def _drop_body(self, entry: dict) -> bool:
+    """Delete the body of a removed entry unless another entry shares it; call with the lock held."""
+    if any(other["body"] == entry["body"] for other in self._index.values()):
+      return False
+    self.object_path(entry["body"]).unlink(missing_ok=True)
+    return True
+
+  def forget(self, url: str, params: dict | None = None) -> None:
+    """Drop the cached response of a request, e.g. one whose body turned out to be an error."""
+    key = request_key(url, params)
+    with self._lock:
+      entry = self._index.get(key)
+      if entry is not None:
+        self._set(key, None)
+        self._drop_body(entry)
+
+  def _set(self, key: str, entry: dict | None) -> None:
+    """Update (or with None remove) an index entry and journal the change; call with the lock held."""
+    previous = self._index.pop(key, None)
+    if previous is not None:
+      self._entry_bytes -= previous["size"]
+    if entry is not None:
+      self._index[key] = entry
+      self._entry_bytes += entry["size"]
+    if self._journal is None:
+      self.cache_dir.mkdir(parents=True, exist_ok=True)
+      self._journal = self._journal_path.open("a", encoding="utf-8")
+    self._journal.write(json.dumps({"key": key, "entry": entry}) + "\n")
+    self._journal.flush()
+
+  def close(self) -> None:
+    """Write the index once and drop the journal it now includes."""
+    with self._lock:
+      if self._journal is not None:
+        self._journal.close()
+        self._journal = None
+      if self._journal_path.exists():
+        tmp = self._index_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self._index), encoding="utf-8")
+        os.replace(tmp, self._index_path)
+        self._journal_path.unlink(missing_ok=True)
+    super().close()
+
+
+def add_cache_arguments(parser: argparse.ArgumentParser) -> None:
+  group = parser.add_argument_group("HTTP キャッシュ")
+  group.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+  group.add_argument("--no-cache", action="store_true", help="キャッシュを使わず毎回取得する")
+  group.add_argument("--cache-ttl", type=float, default=DEFAULT_TTL, help="再検証なしで使う期間（秒）")
+  group.add_argument("--cache-max-bytes", type=int, default=DEFAULT_MAX_BYTES, help="超えたら古い順に削除")
+  group.add_argument("--offline", action="store_true", help="キャッシュ済みの応答のみ使用し、ネットワークに接続しない")
+
+
+def session_from_args(args: argparse.Namespace) -> requests.Session:
+  if args.no_cache:
+    if args.offline:
+      raise SystemExit("--offline と --no-cache は同時に指定できません。")
+    return requests.Session()
+  return CachedSession(Path(args.cache_dir), args.cache_ttl, args.cache_max_bytes, args.offline)
+
+
+def print_cache_stats(session: requests.Session) -> None:
+  if isinstance(session, CachedSession):
+    print(f"cache: {session.stats.summary()}")
@@ -7,38 +7,98 @@ import argparse
 import csv
 import json
 import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
 from pathlib import Path
+from typing import Callable, Iterable, Iterator, Sized
 
+import httpx
+from postgrest.exceptions import APIError
+from postgrest.types import ReturnMethod
 from supabase import Client, create_client
 
+from change_detection import detect_changes, fetch_remote_state, load_manifest, save_manifest
+from classify import DEFAULT_METHOD, METHODS, classify
+from geometry_store import STORE_SUFFIX, GeometryStore, StoredGeometries, ensure_store, feature_sources, is_store
+from rent_stats import NATIONAL_SCOPE, compute_stats
+from simplify import DEFAULT_LEVELS, parse_levels
+from snapshot import is_snapshot, load_rent
+
+DEFAULT_BATCH_ROWS = 200
+DEFAULT_BATCH_BYTES = 4 << 20
+
+
+@dataclass
+class UpsertReport:
+  rows: int = 0
+  bytes: int = 0
+  batches: int = 0
+  retries: int = 0
+  seconds: float = 0.0
+
+  def summary(self) -> str:
+    rate = self.bytes / self.seconds / 1e6 if self.seconds else 0.0
+    rows_per_s = self.rows / self.seconds if self.seconds else 0.0
+    return (
+      f"{self.rows} rows in {self.batches} batches, {self.bytes / 1e6:.1f} MB, "
+      f"{self.seconds:.1f} s ({rows_per_s:.0f} rows/s, {rate:.2f} MB/s), retries={self.retries}"
+    )
+
 
 def load_rent_map(path: Path) -> dict[str, float]:
+  if is_snapshot(path):
+    return load_rent(path)
   with path.open(encoding="utf-8") as fp:
     reader = csv.DictReader(fp)
     return {row["municipality_code"]: float(row["rent_avg"]) for row in reader}
 
 
-def main() -> None:
-  parser = argparse.ArgumentParser()
-  parser.add_argument("--geojson", default="data/municipalities.geojson")
-  parser.add_argument("--rent", default="data/rent_avg.csv")
-  parser.add_argument("--supabase-url", default=os.getenv("NEXT_PUBLIC_SUPABASE_URL", ""))
-  parser.add_argument("--service-role-key", default=os.getenv("SUPABASE_SERVICE_ROLE_KEY", ""))
-  args = parser.parse_args()
+@contextmanager
+def open_rows(path: Path, levels: dict[str, float] | None, rent_map: dict[str, float]) -> Iterator[list[dict]]:
+  """Rows backed by the geometry store (geometry_store.py) of a GeoJSON file or snapshot.
 
-  if not args.supabase_url or not args.service_role_key:
-    raise SystemExit("Supabase URL/Service role key が必要です。")
+  The store is (re)built next to the input when the input changed. Geometry
+  stays in the mapped file: rows are hashed from the packed coordinates and
+  only decoded when they are written, so the store stays open until the
+  ``with`` block exits.
+  """
+  store_path = path
+  if not is_store(path):
+    store_path = path.with_suffix(STORE_SUFFIX)
+    if ensure_store(store_path, feature_sources(path, levels)):
+      print(f"saved: {store_path}")
+  with ExitStack() as stack:
+    finest = stack.enter_context(GeometryStore(store_path))
+    names = [level for level in finest.levels if levels is None or level in levels]
+    for name in levels or {}:
+      if name not in finest.levels:
+        print(f"skipped level {name}: not found in {store_path}")
+    coarser = [stack.enter_context(GeometryStore(store_path, name)) for name in names if name != finest.level]
+    yield store_rows(finest, coarser, names, rent_map)
 
-  supabase: Client = create_client(args.supabase_url, args.service_role_key)
-  rent_map = load_rent_map(Path(args.rent))
-  geo = json.loads(Path(args.geojson).read_text(encoding="utf-8"))
 
+def store_rows(
+  finest: GeometryStore,
+  coarser: list[GeometryStore],
+  names: list[str],
+  rent_map: dict[str, float],
+) -> list[dict]:
+  """One row per coded feature of ``finest``, with its geometry in each of the ``names`` levels."""
   rows = []
-  for feature in geo.get("features", []):
-    props = feature.get("properties", {})
+  for row in range(len(finest)):
+    props = finest.properties(row)
     code = props.get("code")
     if not code:
       continue
+    located = {finest.level: (finest, row)} if finest.level in names else {}
+    for store in coarser:
+      match = store.row(code)
+      if match is not None:
+        located[store.level] = (store, match)
     rows.append(
       {
         "code": code,
@@ -47,12 +107,267 @@ def main() -> None:
         "rent_avg": rent_map.get(code),
         "population": props.get("population"),
         "area_km2": props.get("area_km2"),
-        "geojson": feature.get("geometry"),
+        "geometries": StoredGeometries(located),
       }
     )
+  return rows
+
+
+def split_rows(rows: Iterable[dict], now: str) -> tuple[list[dict], Iterator[dict]]:
+  """Split full rows into ``municipalities`` rows and ``municipality_geometries`` rows.
+
+  The attribute rows are small and returned as a list; geometry rows are
+  yielded one at a time, so each geometry is only decoded when its batch is
+  built. ``rows`` is iterated once for each.
+  """
+  attributes = [{key: value for key, value in row.items() if key != "geometries"} for row in rows]
+
+  def geometries() -> Iterator[dict]:
+    for row in rows:
+      for lod, geometry in row["geometries"].items():
+        if geometry:
+          yield {"code": row["code"], "lod": lod, "geojson": geometry, "updated_at": now}
+
+  return attributes, geometries()
+
+
+def iter_batches(rows: Iterable[dict], max_rows: int, max_bytes: int) -> Iterator[tuple[list[dict], int]]:
+  """Group rows into batches bounded by row count and serialized JSON size.
+
+  A single row larger than ``max_bytes`` still goes out, alone in its batch.
+  """
+  batch: list[dict] = []
+  size = 0
+  for row in rows:
+    row_size = len(json.dumps(row, ensure_ascii=False).encode("utf-8")) + 1
+    if batch and (len(batch) >= max_rows or size + row_size > max_bytes):
+      yield batch, size
+      batch, size = [], 0
+    batch.append(row)
+    size += row_size
+  if batch:
+    yield batch, size
+
+
+def run_requests(
+  table: str,
+  jobs: Iterable[tuple[Callable[[], object], int, int]],
+  *,
+  total: int | None = None,
+  workers: int = 4,
+  retries: int = 4,
+  backoff: float = 1.0,
+) -> UpsertReport:
+  """Run ``(request, rows, bytes)`` jobs on a pool of ``workers`` with per-request retry.
+
+  ``jobs`` is consumed lazily: at most ``2 * workers`` requests (and the
+  batches they hold) are in flight or queued at once.
+  """
+  report = UpsertReport()
+  lock = threading.Lock()
+  started = time.perf_counter()
+  of_total = f"/{total}" if total is not None else ""
+
+  def send(request: Callable[[], object], rows: int, size: int) -> None:
+    for attempt in range(retries + 1):
+      try:
+        request()
+        break
+      except (APIError, httpx.HTTPError):
+        if attempt == retries:
+          raise
+        with lock:
+          report.retries += 1
+        time.sleep(backoff * 2**attempt)
+    with lock:
+      report.rows += rows
+      report.bytes += size
+      report.batches += 1
+      elapsed = time.perf_counter() - started
+      print(
+        f"  {table}: {report.rows}{of_total} rows "
+        f"({report.bytes / 1e6:.1f} MB, {report.bytes / 1e6 / elapsed:.2f} MB/s)"
+      )
+
+  window = 2 * max(1, workers)
+  pending = set()
+  with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+    for job in jobs:
+      if len(pending) >= window:
+        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in finished:
+          future.result()
+      pending.add(pool.submit(send, *job))
+    for future in pending:
+      future.result()
+  report.seconds = time.perf_counter() - started
+  return report
+
+
+def upsert_rows(
+  supabase: Client,
+  table: str,
+  rows: Iterable[dict],
+  *,
+  batch_rows: int = DEFAULT_BATCH_ROWS,
+  batch_bytes: int = DEFAULT_BATCH_BYTES,
+  workers: int = 4,
+  retries: int = 4,
+  backoff: float = 1.0,
+) -> UpsertReport:
+  """Upsert ``rows`` in bounded batches on a pool of ``workers`` with per-batch retry."""
+
+  def request(batch: list[dict]) -> Callable[[], object]:
+    # Minimal return: the rows (with full geometry) are not echoed back.
+    return lambda: supabase.table(table).upsert(batch, returning=ReturnMethod.minimal).execute()
 
-  supabase.table("municipalities").upsert(rows).execute()
-  print(f"upserted: {len(rows)} municipalities")
+  jobs = ((request(batch), len(batch), size) for batch, size in iter_batches(rows, batch_rows, batch_bytes))
+  total = len(rows) if isinstance(rows, Sized) else None
+  return run_requests(table, jobs, total=total, workers=workers, retries=retries, backoff=backoff)
+
+
+def patch_rows(
+  supabase: Client,
+  table: str,
+  patches: list[tuple[str, dict]],
+  *,
+  key: str = "code",
+  workers: int = 4,
+  retries: int = 4,
+  backoff: float = 1.0,
+) -> UpsertReport:
+  """Update only the given columns of existing rows, one small PATCH per row.
+
+  Used instead of an upsert when only some columns changed: an upsert would
+  have to resend every NOT NULL column of the row.
+  """
+
+  def request(code: str, values: dict) -> Callable[[], object]:
+    return lambda: supabase.table(table).update(values, returning=ReturnMethod.minimal).eq(key, code).execute()
+
+  jobs = [
+    (request(code, values), 1, len(json.dumps(values, ensure_ascii=False).encode("utf-8")))
+    for code, values in patches
+  ]
+  return run_requests(table, jobs, total=len(jobs), workers=workers, retries=retries, backoff=backoff)
+
+
+def write_rows(supabase: Client, rows: list[dict], **options) -> tuple[UpsertReport, UpsertReport]:
+  """Upsert attributes first (geometries reference them), then every level of detail."""
+  attributes, geometries = split_rows(rows, datetime.now(timezone.utc).isoformat())
+  report = upsert_rows(supabase, "municipalities", attributes, **options)
+  print(f"upserted: {len(attributes)} municipalities ({report.summary()})")
+  geometry_report = upsert_rows(supabase, "municipality_geometries", geometries, **options)
+  print(f"upserted: {geometry_report.rows} geometries ({geometry_report.summary()})")
+  return report, geometry_report
+
+
+def write_stats(supabase: Client, rows: list[dict], method: str = DEFAULT_METHOD, **options) -> None:
+  """Recompute rent summaries, ranks and color classes over all ``rows`` and replace the stats tables.
+
+  The national summary carries the class breaks, palette and legend; every
+  ranked municipality carries its class index (``rent_class``). Every row is
+  written with the same ``updated_at``; rows older than it (municipalities
+  that lost their rent or were removed, prefectures without any rent) are
+  deleted afterwards.
+  """
+  codes = [row["code"] for row in rows]
+  rents = [row["rent_avg"] for row in rows]
+  stats = compute_stats(codes, [row["prefecture_code"] or row["code"][:2] for row in rows], rents)
+  classification = classify(codes, rents, method)
+  summaries = [
+    {**row, "classification": classification.scheme() if row["scope"] == NATIONAL_SCOPE else None}
+    for row in stats.summary_rows()
+  ]
+  ranks = [{**row, "rent_class": classification.classes.get(row["code"])} for row in stats.rank_rows()]
+  now = datetime.now(timezone.utc).isoformat()
+  for table, stat_rows in (("rent_stats", summaries), ("municipality_rent_ranks", ranks)):
+    stat_rows = [{**row, "updated_at": now} for row in stat_rows]
+    report = upsert_rows(supabase, table, stat_rows, **options)
+    print(f"stats: {table} {len(stat_rows)} rows ({report.summary()})")
+    delete_stale(supabase, table, now, **options)
+
+
+def delete_stale(supabase: Client, table: str, updated_at: str, **options) -> None:
+  """Delete the rows of ``table`` not written by the run that stamped ``updated_at``."""
+
+  def request() -> object:
+    return supabase.table(table).delete(returning=ReturnMethod.minimal).lt("updated_at", updated_at).execute()
+
+  run_requests(table, [(request, 0, 0)], **options)
+
+
+def run(args: argparse.Namespace, supabase: Client, rows: list[dict]) -> None:
+  """Write ``rows`` (with --incremental only the changed ones) and the stats tables."""
+  options = {"workers": args.workers, "retries": args.retries}
+  batching = {"batch_rows": args.batch_rows, "batch_bytes": args.batch_bytes}
+  if not args.incremental:
+    write_rows(supabase, rows, **batching, **options)
+    if not args.no_stats:
+      write_stats(supabase, rows, args.classification, **options)
+    return
+
+  manifest_path = Path(args.manifest)
+  if args.incremental == "manifest":
+    previous = load_manifest(manifest_path)
+  else:
+    previous = fetch_remote_state(supabase)
+  changes = detect_changes(rows, previous, hash_columns=args.incremental == "db")
+  print(f"changes: {changes.summary()}")
+
+  # Geometry is only sent for new municipalities or changed boundaries.
+  if changes.full:
+    write_rows(supabase, changes.full, **batching, **options)
+  patches = changes.attributes + changes.rent
+  if patches:
+    report = patch_rows(supabase, "municipalities", patches, **options)
+    print(f"patched: {len(patches)} municipalities ({report.summary()})")
+  if args.incremental == "manifest":
+    save_manifest(manifest_path, {**previous, **changes.state})
+  # Ranks and percentiles depend on every row, so any change refreshes them.
+  if not args.no_stats and (changes.full or patches):
+    write_stats(supabase, rows, args.classification, **options)
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--geojson", default="data/municipalities.geojson", help="GeoJSON またはスナップショット（.snap）")
+  parser.add_argument("--rent", default="data/rent_avg.csv", help="CSV またはスナップショット（.snap）")
+  parser.add_argument(
+    "--levels",
+    help=(
+      "取り込む詳細度（fetch_geojson.py の --levels と同じ指定）。最も細かいものが --geojson、"
+      "他は同じ場所の <名前>.<詳細度>.geojson。--geojson がスナップショット（.snap）なら含まれる詳細度から選択"
+    ),
+  )
+  parser.add_argument("--supabase-url", default=os.getenv("NEXT_PUBLIC_SUPABASE_URL", ""))
+  parser.add_argument("--service-role-key", default=os.getenv("SUPABASE_SERVICE_ROLE_KEY", ""))
+  parser.add_argument("--batch-rows", type=int, default=DEFAULT_BATCH_ROWS, help="1 リクエストあたりの最大行数")
+  parser.add_argument("--batch-bytes", type=int, default=DEFAULT_BATCH_BYTES, help="1 リクエストあたりの最大 JSON サイズ（バイト）")
+  parser.add_argument("--workers", type=int, default=4, help="同時に送信するバッチ数")
+  parser.add_argument("--retries", type=int, default=4, help="バッチごとの再試行回数")
+  parser.add_argument(
+    "--incremental",
+    choices=["manifest", "db"],
+    help="前回から変わった行だけを書き込む。比較元はローカルのマニフェスト（manifest）か municipalities のハッシュ列（db）",
+  )
+  parser.add_argument("--manifest", default="data/import_manifest.json", help="--incremental manifest の比較元")
+  parser.add_argument("--no-stats", action="store_true", help="集計テーブル（rent_stats / municipality_rent_ranks）を更新しない")
+  parser.add_argument("--classification", choices=METHODS, default=DEFAULT_METHOD, help="家賃の色分けの区切り方（scripts/classify.py）")
+  args = parser.parse_args()
+
+  if not args.supabase_url or not args.service_role_key:
+    raise SystemExit("Supabase URL/Service role key が必要です。")
+
+  supabase: Client = create_client(args.supabase_url, args.service_role_key)
+  rent_map = load_rent_map(Path(args.rent))
+  levels = parse_levels(args.levels) if args.levels is not None else DEFAULT_LEVELS
+  if not levels:
+    raise SystemExit("--levels には 1 つ以上の詳細度を指定してください。")
+  geojson_path = Path(args.geojson)
+  # Snapshots hold every level; without --levels all of them are imported.
+  with open_rows(geojson_path, None if args.levels is None and is_snapshot(geojson_path) else levels, rent_map) as rows:
+    run(args, supabase, rows)
 
 
 if __name__ == "__main__":
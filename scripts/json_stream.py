@@ -0,0 +1,124 @@
+"""Incremental JSON helpers for large pipeline payloads.
+
+The nationwide N03 GeoJSON and large e-Stat tables are a single huge array
+wrapped in a small envelope. These helpers decode the array one element at a
+time from a stream of byte chunks so that memory stays bounded by the largest
+element instead of the whole document.
+"""
+
+from __future__ import annotations
+
+import codecs
+import json
+import re
+from pathlib import Path
+from typing import Any, Iterable, Iterator, TextIO
+
+CHUNK_SIZE = 1 << 20
+_SEPARATORS = " \t\r\n,"
+
+
+def iter_file_chunks(path: Path, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+  with path.open("rb") as fp:
+    while chunk := fp.read(chunk_size):
+      yield chunk
+
+
+def iter_array_items(chunks: Iterable[bytes], key: str) -> Iterator[Any]:
+  """Yield the elements of the first array stored under ``key``.
+
+  Only the part of the document that is currently being decoded is kept in
+  memory. Everything before the array (and after it) is skipped.
+  """
+  decoder = json.JSONDecoder()
+  text_decoder = codecs.getincrementaldecoder("utf-8-sig")()
+  source = iter(chunks)
+  key_pattern = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+  keep = len(key) + 64
+
+  buf = ""
+  exhausted = False
+
+  def read(min_chars: int) -> bool:
+    nonlocal buf, exhausted
+    parts = []
+    size = 0
+    while size < min_chars and not exhausted:
+      chunk = next(source, None)
+      if chunk is None:
+        exhausted = True
+        text = text_decoder.decode(b"", final=True)
+      else:
+        text = text_decoder.decode(chunk)
+      parts.append(text)
+      size += len(text)
+    if not size:
+      return False
+    buf += "".join(parts)
+    return True
+
+  while True:
+    match = key_pattern.search(buf)
+    if match:
+      pos = match.end()
+      break
+    buf = buf[-keep:]
+    if not read(1):
+      raise ValueError(f"array '{key}' not found in JSON stream")
+
+  while True:
+    while pos < len(buf) and buf[pos] in _SEPARATORS:
+      pos += 1
+    if pos >= len(buf):
+      buf, pos = "", 0
+      if not read(1):
+        raise ValueError(f"unexpected end of JSON stream inside '{key}'")
+      continue
+    if buf[pos] == "]":
+      return
+
+    try:
+      item, end = decoder.raw_decode(buf, pos)
+    except json.JSONDecodeError:
+      if exhausted:
+        raise
+      # The element is split across chunks; grow the buffer geometrically so
+      # that a large element is not re-scanned once per chunk.
+      read(max(len(buf) - pos, 1))
+      continue
+    if not exhausted and (end == len(buf) or buf[end] not in _SEPARATORS + "]"):
+      # A scalar cut at the chunk boundary (``2.`` of ``2.5``) decodes to a
+      # prefix of itself; wait until its terminator is buffered.
+      read(1)
+      continue
+
+    yield item
+    pos = end
+    if pos > CHUNK_SIZE:
+      buf, pos = buf[pos:], 0
+
+
+class FeatureCollectionWriter:
+  """Write a GeoJSON FeatureCollection one feature at a time.
+
+  The output is byte-identical to ``json.dumps`` of the equivalent in-memory
+  collection with ``ensure_ascii=False``.
+  """
+
+  def __init__(self, fp: TextIO) -> None:
+    self.fp = fp
+    self.count = 0
+
+  def __enter__(self) -> "FeatureCollectionWriter":
+    self.fp.write('{"type": "FeatureCollection", "features": [')
+    return self
+
+  def write(self, feature: dict) -> None:
+    if self.count:
+      self.fp.write(", ")
+    self.fp.write(json.dumps(feature, ensure_ascii=False))
+    self.count += 1
+
+  def __exit__(self, exc_type, exc, tb) -> None:
+    if exc_type is None:
+      self.fp.write("]}")
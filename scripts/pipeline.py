@@ -0,0 +1,568 @@
+#!/usr/bin/env python3
+"""Run fetch_geojson → fetch_rent_data → import_to_supabase as one dependency graph.
+
+Stages are nodes with ``after`` edges (the upstream output must be complete
+before the stage starts), ``waits`` edges (the stage starts at once and
+blocks on the upstream stage only when it needs its output) and at most one
+``stream`` edge (upstream features are consumed while they are being
+produced). The boundary download and the e-Stat fetch run concurrently.
+The import compares every row with the ``attr_hash`` / ``geom_hash`` /
+``rent_avg`` columns (change_detection.py): it upserts changed attributes in
+batches while the boundaries are still arriving (through a bounded queue, so
+memory stays flat), then simplifies the whole collection into every level of
+detail and, once the e-Stat stage is done, writes new municipalities and
+changed boundaries whole and patches changed ``rent_avg`` values.
+
+A stage is skipped when its parameters, its local input files and every
+upstream output are the same as on its last successful run (recorded in
+``--state``) and its own outputs are untouched. Remote sources count as
+unchanged; ``--force`` re-runs a stage anyway. Wall time, bytes and rows of
+every stage are printed at the end and stored in the state file.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+
+from supabase import create_client
+
+from async_http import add_async_arguments, fetcher_from_args, print_fetch_stats
+from change_detection import ATTRIBUTE_FIELDS, attribute_hash, detect_changes, fetch_remote_state
+from classify import DEFAULT_METHOD, METHODS
+from estat import ESTAT_ENDPOINT, PAGE_SIZE, make_session
+from estat_plan import add_plan_arguments, plan_from_args
+from fetch_geojson import N03_GEOJSON_URL, iter_features, simplify_feature
+from fetch_rent_data import DEFAULT_CHECKPOINT_DIR, DEFAULT_STATS_DATA_ID, fetch_rows, planned_cell, rent_values, to_csv
+from geometry_store import STORE_SUFFIX, write_store
+from http_cache import add_cache_arguments, print_cache_stats, session_from_args
+from import_to_supabase import (
+  DEFAULT_BATCH_BYTES,
+  DEFAULT_BATCH_ROWS,
+  UpsertReport,
+  load_rent_map,
+  open_rows,
+  patch_rows,
+  upsert_rows,
+  write_rows,
+  write_stats,
+)
+from json_stream import FeatureCollectionWriter
+from rate_limit import add_rate_arguments, print_throttle_stats, throttle_from_args
+from simplify import DEFAULT_LEVELS, SimplifyReport, parse_levels, simplify_levels
+
+DEFAULT_STATE = "data/.pipeline-state.json"
+# Features buffered between a streaming stage and its consumer.
+STREAM_BUFFER = 1000
+_CLOSED = object()
+
+
+@dataclass
+class StageMetrics:
+  status: str = "pending"
+  seconds: float = 0.0
+  bytes: int = 0
+  rows: int = 0
+
+  def summary(self) -> str:
+    return f"{self.status:<8} {self.seconds:8.2f} s {self.bytes:>14,} B {self.rows:>9,} rows"
+
+
+class FeatureStream:
+  """Bounded hand-off of features from a producing stage's thread to its consumer's."""
+
+  def __init__(self, maxsize: int = STREAM_BUFFER) -> None:
+    self._queue: queue.Queue = queue.Queue(maxsize)
+    self._error: BaseException | None = None
+    self._abandoned = False
+
+  def put(self, feature: dict) -> None:
+    if not self._abandoned:
+      self._queue.put(feature)
+
+  def abandon(self) -> None:
+    """The consumer gave up: drop what is buffered and everything put from now on."""
+    self._abandoned = True
+    while True:
+      try:
+        self._queue.get_nowait()
+      except queue.Empty:
+        return
+
+  def close(self, error: BaseException | None = None) -> None:
+    self._error = error
+    self._queue.put(_CLOSED)
+
+  def __iter__(self) -> Iterator[dict]:
+    while (feature := self._queue.get()) is not _CLOSED:
+      yield feature
+    if self._error is not None:
+      raise RuntimeError("upstream stage failed") from self._error
+
+
+@dataclass
+class StageContext:
+  """What a running stage sees: where to emit features, where to read its stream from and how to wait."""
+
+  emit: Callable[[dict], None] = lambda feature: None
+  source: Iterable[dict] = ()
+  # Blocks until one of the stage's ``waits`` finished; raises if it did not succeed.
+  wait: Callable[[str], None] = lambda name: None
+
+
+@dataclass
+class Stage:
+  name: str
+  # Runs in a worker thread; returns (bytes, rows).
+  run: Callable[[StageContext], tuple[int, int]]
+  outputs: list[Path] = field(default_factory=list)
+  inputs: list[Path] = field(default_factory=list)
+  params: dict = field(default_factory=dict)
+  after: tuple[str, ...] = ()
+  # Upstream stages whose outputs are only read part-way through ``run``
+  # (through ``StageContext.wait``), so the stage does not wait to start.
+  waits: tuple[str, ...] = ()
+  # Upstream stage whose features are consumed as they are produced. When it
+  # is skipped, ``read_stream`` replays its output instead.
+  stream: str | None = None
+  read_stream: Callable[[], Iterable[dict]] | None = None
+
+  @property
+  def upstream(self) -> tuple[str, ...]:
+    return self.after + self.waits + ((self.stream,) if self.stream else ())
+
+
+def file_stamp(path: Path) -> list | None:
+  if not path.exists():
+    return None
+  stat = path.stat()
+  return [str(path), stat.st_mtime_ns, stat.st_size]
+
+
+def fingerprint(stage: Stage, stages: dict[str, Stage]) -> str:
+  """Hash of the stage's parameters, local inputs and every upstream output."""
+  upstream_outputs = [path for name in stage.upstream for path in stages[name].outputs]
+  key = {
+    "params": stage.params,
+    "inputs": [file_stamp(path) for path in stage.inputs],
+    "upstream": [file_stamp(path) for path in upstream_outputs],
+  }
+  return hashlib.sha256(json.dumps(key, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class Pipeline:
+  def __init__(self, stages: list[Stage], state_path: Path) -> None:
+    self.stages = {stage.name: stage for stage in stages}
+    self.state_path = state_path
+    self.state: dict = {}
+    if state_path.exists():
+      self.state = json.loads(state_path.read_text(encoding="utf-8"))
+    self.metrics = {name: StageMetrics() for name in self.stages}
+
+  def order(self) -> list[str]:
+    """Stage names in dependency order; raises on unknown or cyclic edges."""
+    ordered: list[str] = []
+    visiting: set[str] = set()
+
+    def visit(name: str) -> None:
+      if name in ordered:
+        return
+      if name in visiting:
+        raise ValueError(f"dependency cycle at stage {name}")
+      if name not in self.stages:
+        raise ValueError(f"unknown stage: {name}")
+      visiting.add(name)
+      for upstream in self.stages[name].upstream:
+        visit(upstream)
+      visiting.discard(name)
+      ordered.append(name)
+
+    for name in self.stages:
+      visit(name)
+    return ordered
+
+  def up_to_date(self, stage: Stage) -> bool:
+    previous = self.state.get("stages", {}).get(stage.name)
+    if not previous:
+      return False
+    outputs = [file_stamp(path) for path in stage.outputs]
+    return previous.get("fingerprint") == fingerprint(stage, self.stages) and previous.get("outputs") == outputs
+
+  def plan(self, force: set[str]) -> dict[str, bool]:
+    """``name -> runs``: a stage runs when forced, changed or downstream of a stage that runs."""
+    runs: dict[str, bool] = {}
+    for name in self.order():
+      stage = self.stages[name]
+      runs[name] = (
+        name in force
+        or any(runs[upstream] for upstream in stage.upstream)
+        or not self.up_to_date(stage)
+      )
+    return runs
+
+  async def run(self, force: set[str] = frozenset()) -> None:
+    runs = self.plan(force)
+    streams = {
+      name: FeatureStream()
+      for name, stage in self.stages.items()
+      if runs[name] and stage.stream and runs[stage.stream]
+    }
+    done = {name: asyncio.Event() for name in self.stages}
+    # The same, for stage threads blocked in StageContext.wait.
+    finished = {name: threading.Event() for name in self.stages}
+    failed: list[str] = []
+
+    def finish(name: str) -> None:
+      done[name].set()
+      finished[name].set()
+
+    def wait(name: str) -> None:
+      finished[name].wait()
+      if self.metrics[name].status not in {"ran", "skipped"}:
+        raise RuntimeError(f"{name} did not finish ({self.metrics[name].status})")
+
+    def release() -> None:
+      """Unblock every stage thread: producers stop queueing, consumers and waiters return."""
+      for stream in streams.values():
+        stream.abandon()
+        stream.close(RuntimeError("pipeline cancelled"))
+      for event in finished.values():
+        event.set()
+
+    async def execute(stage: Stage) -> None:
+      for upstream in stage.after:
+        await done[upstream].wait()
+      metrics = self.metrics[stage.name]
+      consumers = [streams[name] for name, other in self.stages.items() if other.stream == stage.name and name in streams]
+      if failed or any(self.metrics[name].status in {"failed", "cancelled"} for name in stage.after):
+        metrics.status = "cancelled"
+        if stage.name in streams:
+          streams[stage.name].abandon()
+        for consumer in consumers:
+          consumer.close(RuntimeError(f"{stage.name} was cancelled"))
+        finish(stage.name)
+        return
+      if not runs[stage.name]:
+        metrics.status = "skipped"
+        print(f"[{stage.name}] skipped (inputs unchanged)")
+        finish(stage.name)
+        return
+
+      context = StageContext(wait=wait)
+      if consumers:
+        context.emit = lambda feature: [consumer.put(feature) for consumer in consumers]
+      if stage.stream:
+        context.source = streams[stage.name] if stage.name in streams else stage.read_stream()
+
+      print(f"[{stage.name}] started")
+      started = time.perf_counter()
+      try:
+        metrics.bytes, metrics.rows = await asyncio.to_thread(stage.run, context)
+      except asyncio.CancelledError:
+        raise
+      except BaseException as error:
+        metrics.status = "failed"
+        failed.append(stage.name)
+        if stage.name in streams:
+          streams[stage.name].abandon()
+        for consumer in consumers:
+          consumer.close(error)
+        if isinstance(error, Exception):
+          raise
+        # SystemExit or KeyboardInterrupt would escape asyncio.run and leave
+        # the other stage threads blocked on their streams.
+        raise RuntimeError(f"{stage.name} failed: {error!r}") from error
+      finally:
+        metrics.seconds = time.perf_counter() - started
+        finish(stage.name)
+      for consumer in consumers:
+        consumer.close()
+      metrics.status = "ran"
+      print(f"[{stage.name}] done: {metrics.summary()}")
+
+    async def guarded(stage: Stage) -> None:
+      try:
+        await execute(stage)
+      except asyncio.CancelledError:
+        if self.metrics[stage.name].status == "pending":
+          self.metrics[stage.name].status = "cancelled"
+        release()
+        raise
+
+    tasks = [asyncio.create_task(guarded(stage)) for stage in self.stages.values()]
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    self.save(runs)
+    for result in results:
+      if isinstance(result, BaseException):
+        raise result
+
+  def save(self, runs: dict[str, bool]) -> None:
+    """Record the stages that finished (fingerprints are taken after their upstream finished)."""
+    recorded = self.state.setdefault("stages", {})
+    for name, stage in self.stages.items():
+      metrics = self.metrics[name]
+      if metrics.status == "ran":
+        recorded[name] = {
+          "fingerprint": fingerprint(stage, self.stages),
+          "outputs": [file_stamp(path) for path in stage.outputs],
+          "finished_at": datetime.now(timezone.utc).isoformat(),
+          "metrics": asdict(metrics),
+        }
+      elif metrics.status == "failed":
+        recorded.pop(name, None)
+    self.state_path.parent.mkdir(parents=True, exist_ok=True)
+    self.state_path.write_text(json.dumps(self.state, ensure_ascii=False, indent=2), encoding="utf-8")
+
+  def print_metrics(self, seconds: float) -> None:
+    print("stage                    status      wall time           bytes        rows")
+    for name, metrics in self.metrics.items():
+      print(f"{name:<24} {metrics.summary()}")
+    print(f"total: {seconds:.2f} s (sum of stages {sum(m.seconds for m in self.metrics.values()):.2f} s)")
+
+
+def stream_import(
+  supabase,
+  features: Iterable[dict],
+  previous: dict[str, dict],
+  *,
+  batch_rows: int = DEFAULT_BATCH_ROWS,
+  batch_bytes: int = DEFAULT_BATCH_BYTES,
+  workers: int = 4,
+  retries: int = 4,
+) -> tuple[list[dict], UpsertReport]:
+  """Upsert changed municipality attributes batch by batch as features arrive.
+
+  Only municipalities already in ``previous`` (code -> stored hash columns)
+  whose ``attr_hash`` differs are sent, together with the new hash. The rows
+  leave ``rent_avg`` out, so an upsert keeps the stored value until the rent
+  is compared. New municipalities are written whole once their geometry is
+  simplified. Returns the upserted rows and the report.
+  """
+  written: list[dict] = []
+  now = datetime.now(timezone.utc).isoformat()
+
+  def rows() -> Iterator[dict]:
+    # Every feature is consumed, so the producing stage is never left blocked.
+    for feature in features:
+      props = feature.get("properties") or {}
+      code = props.get("code")
+      if not code or code not in previous:
+        continue
+      row = {"code": code, **{key: props.get(key) for key in ATTRIBUTE_FIELDS}}
+      row["attr_hash"] = attribute_hash(row)
+      if row["attr_hash"] == previous[code].get("attr_hash"):
+        continue
+      row["updated_at"] = now
+      written.append(row)
+      yield row
+
+  report = upsert_rows(
+    supabase,
+    "municipalities",
+    rows(),
+    batch_rows=batch_rows,
+    batch_bytes=batch_bytes,
+    workers=workers,
+    retries=retries,
+  )
+  return written, report
+
+
+def store_levels(path: Path, features: Iterable[dict], levels: dict[str, float]) -> SimplifyReport:
+  """Simplify the whole collection at every level into the geometry store at ``path``.
+
+  Shared borders are only found with every feature at hand, so this runs
+  after the stream, like fetch_geojson.py does. Rows read back from the
+  store hash their geometry the same way import_to_supabase.py does.
+  """
+  outputs, simplified = simplify_levels(list(features), levels)
+  write_store(path, outputs)
+  return simplified
+
+
+def build_stages(args: argparse.Namespace) -> list[Stage]:
+  geojson, rent = Path(args.geojson), Path(args.rent)
+  levels_store = geojson.with_name(f"{geojson.stem}.levels{STORE_SUFFIX}")
+  levels = parse_levels(args.levels) if args.levels is not None else DEFAULT_LEVELS
+  local_source = [Path(args.source)] if Path(args.source).is_file() else []
+
+  def fetch_boundaries(context: StageContext) -> tuple[int, int]:
+    session = session_from_args(args)
+    geojson.parent.mkdir(parents=True, exist_ok=True)
+    with session, geojson.open("w", encoding="utf-8") as fp, FeatureCollectionWriter(fp) as writer:
+      for feature in iter_features(args.source, session):
+        simplified = simplify_feature(feature)
+        writer.write(simplified)
+        context.emit(simplified)
+    print(f"saved: {geojson} ({writer.count} features, streamed)")
+    print_cache_stats(session)
+    return geojson.stat().st_size, writer.count
+
+  def fetch_rent(context: StageContext) -> tuple[int, int]:
+    fetcher = fetcher_from_args(args)
+    throttle = throttle_from_args(args, args.per_host if fetcher else args.workers)
+    with make_session(args.workers, session_from_args(args)) as session:
+      plan = None if args.no_plan else plan_from_args(args, session, throttle)
+      rows = fetch_rows(
+        args.api_key,
+        args.stats_data_id,
+        session=session,
+        endpoint=args.endpoint,
+        workers=args.workers,
+        page_size=args.page_size,
+        checkpoint_dir=Path(args.checkpoint_dir),
+        fetcher=fetcher,
+        throttle=throttle,
+        filters=plan.params if plan else None,
+      )
+    if plan and plan.areas is not None:
+      rows = [row for row in rows if planned_cell(plan.areas, None, row)]
+    records = rent_values(rows)
+    to_csv(records, rent)
+    print(f"saved: {rent} ({len(rows)} values)")
+    print_cache_stats(session)
+    print_fetch_stats(fetcher)
+    print_throttle_stats(throttle)
+    return rent.stat().st_size, len(records)
+
+  def import_rows(context: StageContext) -> tuple[int, int]:
+    supabase = create_client(args.supabase_url, args.service_role_key)
+    options = {"workers": args.import_workers, "retries": args.retries}
+    batching = {"batch_rows": args.batch_rows, "batch_bytes": args.batch_bytes}
+    previous = fetch_remote_state(supabase)
+    streamed, report = stream_import(supabase, context.source, previous, **batching, **options)
+    print(f"upserted: attributes of {len(streamed)} municipalities ({report.summary()})")
+    sent = report.bytes
+    for row in streamed:
+      previous[row["code"]] = {**previous[row["code"]], "attr_hash": row["attr_hash"]}
+
+    simplified = store_levels(levels_store, iter_features(str(geojson)), levels)
+    print(f"saved: {levels_store} (" + ", ".join(f"{name}={simplified.vertices[name]:,} vertices" for name in levels) + ")")
+    context.wait("fetch_rent_data")
+    with open_rows(levels_store, levels, load_rent_map(rent)) as rows:
+      changes = detect_changes(rows, previous, hash_columns=True)
+      print(f"changes: {changes.summary()}")
+      # Geometry is only sent for new municipalities or changed boundaries.
+      if changes.full:
+        sent += sum(written.bytes for written in write_rows(supabase, changes.full, **batching, **options))
+      patches = changes.attributes + changes.rent
+      if patches:
+        patch_report = patch_rows(supabase, "municipalities", patches, **options)
+        print(f"patched: {len(patches)} municipalities ({patch_report.summary()})")
+        sent += patch_report.bytes
+      # The stage only runs when an input or a parameter (e.g. the
+      # classification) changed, so the stats are always refreshed.
+      if not args.no_stats:
+        write_stats(supabase, rows, args.classification, **options)
+      return sent, len(rows)
+
+  return [
+    Stage(
+      "fetch_geojson",
+      fetch_boundaries,
+      outputs=[geojson],
+      inputs=local_source,
+      params={"source": args.source},
+    ),
+    Stage(
+      "fetch_rent_data",
+      fetch_rent,
+      outputs=[rent],
+      params={
+        "stats_data_id": args.stats_data_id,
+        "endpoint": args.endpoint,
+        "plan": None if args.no_plan else [args.area_level, args.time, args.dwelling, sorted(args.select)],
+      },
+    ),
+    Stage(
+      "import",
+      import_rows,
+      params={
+        "supabase_url": args.supabase_url,
+        "levels": levels,
+        "stats": not args.no_stats,
+        "classification": args.classification,
+      },
+      waits=("fetch_rent_data",),
+      stream="fetch_geojson",
+      read_stream=lambda: iter_features(str(geojson)),
+    ),
+  ]
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--state", default=DEFAULT_STATE, help="前回の実行結果（入力の指紋・出力・計測値）の保存先")
+  parser.add_argument(
+    "--force",
+    default="",
+    help="入力が変わっていなくても実行するステージ（カンマ区切り、all で全部）。URL から取得する入力は変更を検知しないため、再取得はこれで指定",
+  )
+  parser.add_argument("--geojson", default="data/municipalities.geojson")
+  parser.add_argument("--source", default=N03_GEOJSON_URL, help="URL またはローカルの GeoJSON ファイル")
+  parser.add_argument("--rent", default="data/rent_avg.csv")
+  parser.add_argument("--api-key", default=os.getenv("ESTAT_API_KEY", ""))
+  parser.add_argument("--stats-data-id", default=DEFAULT_STATS_DATA_ID)
+  parser.add_argument("--endpoint", default=ESTAT_ENDPOINT)
+  parser.add_argument("--workers", type=int, default=4, help="e-Stat のページ取得の並列数")
+  parser.add_argument("--page-size", type=int, default=PAGE_SIZE)
+  parser.add_argument("--checkpoint-dir", default=DEFAULT_CHECKPOINT_DIR)
+  parser.add_argument("--supabase-url", default=os.getenv("NEXT_PUBLIC_SUPABASE_URL", ""))
+  parser.add_argument("--service-role-key", default=os.getenv("SUPABASE_SERVICE_ROLE_KEY", ""))
+  parser.add_argument(
+    "--levels",
+    help="取り込む詳細度（fetch_geojson.py の --levels と同じ指定）。属性はストリーミングで取り込み、境界は取得後にまとめて簡略化します",
+  )
+  parser.add_argument("--batch-rows", type=int, default=DEFAULT_BATCH_ROWS)
+  parser.add_argument("--batch-bytes", type=int, default=DEFAULT_BATCH_BYTES)
+  parser.add_argument("--import-workers", type=int, default=4, help="同時に送信するバッチ数")
+  parser.add_argument("--retries", type=int, default=4)
+  parser.add_argument("--no-stats", action="store_true")
+  parser.add_argument("--classification", choices=METHODS, default=DEFAULT_METHOD)
+  add_cache_arguments(parser)
+  # Only the e-Stat stage uses --transport async; the boundaries are streamed.
+  add_async_arguments(parser)
+  add_rate_arguments(parser)
+  add_plan_arguments(parser)
+  args = parser.parse_args()
+
+  try:
+    levels = parse_levels(args.levels) if args.levels is not None else DEFAULT_LEVELS
+  except ValueError as exc:
+    raise SystemExit(f"--levels の指定が正しくありません: {exc}")
+  if not levels:
+    raise SystemExit("--levels には 1 つ以上の詳細度を指定してください。")
+
+  pipeline = Pipeline(build_stages(args), Path(args.state))
+  force = {name.strip() for name in args.force.split(",") if name.strip()}
+  if "all" in force:
+    force = set(pipeline.stages)
+  unknown = force - set(pipeline.stages)
+  if unknown:
+    raise SystemExit(f"不明なステージです: {', '.join(sorted(unknown))}（{', '.join(pipeline.stages)}）")
+  # Checked before any stage starts: a stage that exits leaves the others' streams half-read.
+  runs = pipeline.plan(force)
+  if runs["fetch_rent_data"] and not args.api_key:
+    raise SystemExit("ESTAT APIキーが必要です。--api-key か ESTAT_API_KEY を指定してください。")
+  if runs["import"] and (not args.supabase_url or not args.service_role_key):
+    raise SystemExit("Supabase URL/Service role key が必要です。")
+
+  started = time.perf_counter()
+  try:
+    asyncio.run(pipeline.run(force))
+  finally:
+    pipeline.print_metrics(time.perf_counter() - started)
+
+
+if __name__ == "__main__":
+  main()
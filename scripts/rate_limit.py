@@ -0,0 +1,271 @@
+"""Rate limiting and adaptive concurrency for e-Stat API calls.
+
+Every API key gets one ``Throttle``, shared by all threads and coroutines
+that use the key:
+
+- a token bucket caps the request rate (``rate`` per second, bursts of
+  ``burst``). A ``Retry-After`` from the server holds every request back
+  for that long;
+- an AIMD limit caps requests in flight. Every healthy response adds about
+  one slot per window (``+1 / limit``). An error (including an e-Stat
+  ``RESULT.STATUS`` error sent with HTTP 200) or a latency spike (``spike``
+  times the moving baseline) halves it, at most once per window:
+  responses to requests sent before the last decrease are not counted again.
+
+The limit only moves between ``minimum`` and ``maximum`` (the worker count or
+the per-host limit), so the fetch settles just under the rate at which the
+server starts to push back instead of failing on the first 503.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import threading
+import time
+from contextlib import (
+  AbstractAsyncContextManager,
+  AbstractContextManager,
+  asynccontextmanager,
+  contextmanager,
+  nullcontext,
+)
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Iterator
+
+DEFAULT_RATE = 8.0
+DEFAULT_BURST = 8
+SPIKE_FACTOR = 3.0
+DECREASE = 0.5
+# Weight of a new healthy latency in the baseline.
+BASELINE_WEIGHT = 0.2
+# Healthy responses needed before latency spikes count.
+BASELINE_SAMPLES = 5
+
+
+@dataclass
+class ThrottleStats:
+  requests: int = 0
+  errors: int = 0
+  spikes: int = 0
+  decreases: int = 0
+  waited: float = 0.0
+  limit: float = 0.0
+  peak_limit: float = 0.0
+  first_start: float | None = None
+  last_finish: float | None = None
+  # Concurrency limit after each change, as (seconds since first request, limit).
+  history: list[tuple[float, float]] = field(default_factory=list)
+
+  @property
+  def requests_per_second(self) -> float:
+    if self.first_start is None or self.last_finish is None or self.last_finish <= self.first_start:
+      return 0.0
+    return self.requests / (self.last_finish - self.first_start)
+
+  def summary(self) -> str:
+    return (
+      f"{self.requests:,} requests, {self.requests_per_second:.1f} req/s, errors={self.errors:,}, "
+      f"spikes={self.spikes:,}, decreases={self.decreases:,}, limit={self.limit:.1f} (peak {self.peak_limit:.1f}), "
+      f"waited={self.waited:.1f} s"
+    )
+
+
+@dataclass
+class Outcome:
+  """Filled in by the caller when a response is an error without raising (e.g. before a retry)."""
+
+  ok: bool = True
+  retry_after: float | None = None
+
+
+class Throttle:
+  """Token bucket + AIMD concurrency limit; usable from threads and from one event loop."""
+
+  def __init__(
+    self,
+    rate: float = DEFAULT_RATE,
+    burst: int = DEFAULT_BURST,
+    *,
+    minimum: int = 1,
+    maximum: int = 8,
+    spike: float = SPIKE_FACTOR,
+  ) -> None:
+    self.rate = rate
+    self.burst = max(1, burst)
+    self.minimum = max(1, minimum)
+    self.maximum = max(self.minimum, maximum)
+    self.spike = spike
+    self.limit = float(self.maximum)
+    self.in_flight = 0
+    self.stats = ThrottleStats(limit=self.limit, peak_limit=self.limit)
+    self._tokens = float(self.burst)
+    self._refilled = time.monotonic()
+    self._paused_until = 0.0
+    self._baseline: float | None = None
+    self._samples = 0
+    self._last_decrease = float("-inf")
+    self._lock = threading.Lock()
+    self._slots = threading.Condition(self._lock)
+    self._waiters: list[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+  def _reserve(self) -> float:
+    """Take a token (possibly one not refilled yet); return how long to wait for it."""
+    now = time.monotonic()
+    pause = max(0.0, self._paused_until - now)
+    if self.rate <= 0:
+      return pause
+    self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+    self._refilled = now
+    self._tokens -= 1
+    return max(pause, -self._tokens / self.rate)
+
+  def _start(self) -> float:
+    self.in_flight += 1
+    started = time.monotonic()
+    if self.stats.first_start is None:
+      self.stats.first_start = started
+    return started
+
+  def _finish(self, started: float, ok: bool, retry_after: float | None) -> None:
+    now = time.monotonic()
+    self.in_flight -= 1
+    self.stats.requests += 1
+    self.stats.last_finish = now
+    latency = now - started
+    spiked = (
+      ok
+      and self._baseline is not None
+      and self._samples >= BASELINE_SAMPLES
+      and latency > self.spike * self._baseline
+    )
+    if not ok or spiked:
+      self.stats.errors += not ok
+      self.stats.spikes += spiked
+      if retry_after:
+        self._paused_until = max(self._paused_until, now + retry_after)
+      # One decrease per window: requests sent before the last one saw the old limit.
+      if started >= self._last_decrease and self.limit > self.minimum:
+        self._set_limit(max(self.minimum, self.limit * DECREASE))
+        self._last_decrease = now
+        self.stats.decreases += 1
+    else:
+      self._samples += 1
+      self._baseline = latency if self._baseline is None else (
+        (1 - BASELINE_WEIGHT) * self._baseline + BASELINE_WEIGHT * latency
+      )
+      self._set_limit(min(self.maximum, self.limit + 1 / self.limit))
+    self._slots.notify_all()
+    for loop, waiter in self._waiters:
+      loop.call_soon_threadsafe(lambda waiter=waiter: waiter.done() or waiter.set_result(None))
+    self._waiters.clear()
+
+  def _set_limit(self, limit: float) -> None:
+    if int(limit) != int(self.limit) and self.stats.first_start is not None:
+      self.stats.history.append((time.monotonic() - self.stats.first_start, limit))
+    self.limit = limit
+    self.stats.limit = limit
+    self.stats.peak_limit = max(self.stats.peak_limit, limit)
+
+  def _has_slot(self) -> bool:
+    return self.in_flight < int(self.limit)
+
+  @contextmanager
+  def request(self) -> Iterator[Outcome]:
+    """Wait for a slot and a token around one HTTP request (blocking)."""
+    waited = time.monotonic()
+    with self._slots:
+      self._slots.wait_for(self._has_slot)
+      delay = self._reserve()
+      started = self._start()
+    if delay:
+      time.sleep(delay)
+    outcome = Outcome()
+    with self._lock:
+      self.stats.waited += time.monotonic() - waited
+    try:
+      yield outcome
+    except BaseException:
+      outcome.ok = False
+      raise
+    finally:
+      with self._lock:
+        self._finish(started + delay, outcome.ok, outcome.retry_after)
+
+  @asynccontextmanager
+  async def request_async(self) -> AsyncIterator[Outcome]:
+    """``request`` for coroutines: waits without blocking the event loop."""
+    waited = time.monotonic()
+    loop = asyncio.get_running_loop()
+    while True:
+      with self._lock:
+        if self._has_slot():
+          delay = self._reserve()
+          started = self._start()
+          break
+        waiter = loop.create_future()
+        self._waiters.append((loop, waiter))
+      await waiter
+    if delay:
+      await asyncio.sleep(delay)
+    outcome = Outcome()
+    with self._lock:
+      self.stats.waited += time.monotonic() - waited
+    try:
+      yield outcome
+    except BaseException:
+      outcome.ok = False
+      raise
+    finally:
+      with self._lock:
+        self._finish(started + delay, outcome.ok, outcome.retry_after)
+
+
+_throttles: dict[str, Throttle] = {}
+_throttles_lock = threading.Lock()
+
+
+def throttle_for(api_key: str, **options) -> Throttle:
+  """The process-wide throttle of ``api_key`` (created with ``options`` on first use)."""
+  with _throttles_lock:
+    if api_key not in _throttles:
+      _throttles[api_key] = Throttle(**options)
+    return _throttles[api_key]
+
+
+def throttled(throttle: Throttle | None) -> AbstractContextManager[Outcome]:
+  return throttle.request() if throttle is not None else nullcontext(Outcome())
+
+
+def throttled_async(throttle: Throttle | None) -> AbstractAsyncContextManager[Outcome]:
+  return throttle.request_async() if throttle is not None else nullcontext(Outcome())
+
+
+def retry_after_seconds(value: str | None) -> float | None:
+  """``Retry-After`` in seconds (the HTTP-date form is ignored)."""
+  try:
+    return max(0.0, float(value)) if value else None
+  except ValueError:
+    return None
+
+
+def add_rate_arguments(parser: argparse.ArgumentParser) -> None:
+  group = parser.add_argument_group("レート制限")
+  group.add_argument("--rate", type=float, default=DEFAULT_RATE, help="API キーあたりの毎秒リクエスト数の上限（0 で無制限）")
+  group.add_argument("--burst", type=int, default=DEFAULT_BURST, help="--rate を超えて連続で送れるリクエスト数")
+  group.add_argument(
+    "--no-adaptive",
+    action="store_true",
+    help="エラーや応答遅延の急増に合わせた同時リクエスト数の自動調整（AIMD）をしない",
+  )
+
+
+def throttle_from_args(args: argparse.Namespace, maximum: int) -> Throttle:
+  """The throttle of ``args.api_key``; ``--no-adaptive`` pins the concurrency at ``maximum``."""
+  minimum = maximum if args.no_adaptive else 1
+  return throttle_for(args.api_key, rate=args.rate, burst=args.burst, minimum=minimum, maximum=maximum)
+
+
+def print_throttle_stats(throttle: Throttle | None) -> None:
+  if throttle is not None:
+    print(f"throttle: {throttle.stats.summary()}")
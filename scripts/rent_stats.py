@@ -0,0 +1,110 @@
+"""Precomputed rent statistics: national / per-prefecture summaries and ranks.
+
+Computed once at import (and build) time with NumPy so that clients read a
+small summary instead of sorting and reducing every municipality
+themselves. Per-prefecture histograms share the national bin edges so they
+can be compared directly. Ranks use competition ranking (ties share the
+best rank, highest rent = 1).
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Sequence
+
+import numpy as np
+
+PERCENTILES = (10, 25, 50, 75, 90)
+HISTOGRAM_BINS = 10
+NATIONAL_SCOPE = "national"
+
+
+@dataclass
+class RentStats:
+  national: dict
+  prefectures: dict[str, dict] = field(default_factory=dict)
+  edges: list[float] = field(default_factory=list)
+  # code -> {"rank", "prefecture_rank", "percentile"}
+  ranks: dict[str, dict] = field(default_factory=dict)
+
+  def summary_rows(self) -> list[dict]:
+    """Rows of the ``rent_stats`` table: the national scope plus one per prefecture."""
+    scopes = {NATIONAL_SCOPE: self.national, **self.prefectures}
+    return [
+      {
+        "scope": scope,
+        "count": values["count"],
+        "mean": values["mean"],
+        "median": values["median"],
+        "min": values["min"],
+        "max": values["max"],
+        "percentiles": values["percentiles"],
+        "histogram": {"edges": self.edges, "counts": values["histogram"]},
+      }
+      for scope, values in scopes.items()
+    ]
+
+  def rank_rows(self) -> list[dict]:
+    """Rows of the ``municipality_rent_ranks`` table."""
+    return [{"code": code, **ranks} for code, ranks in self.ranks.items()]
+
+
+def summarize(values: np.ndarray, edges: np.ndarray) -> dict:
+  if not len(values):
+    return {"count": 0, "mean": None, "median": None, "min": None, "max": None,
+            "percentiles": {}, "histogram": [0] * (len(edges) - 1)}
+  percentiles = np.percentile(values, PERCENTILES)
+  return {
+    "count": int(len(values)),
+    "mean": float(values.mean()),
+    "median": float(np.median(values)),
+    "min": float(values.min()),
+    "max": float(values.max()),
+    "percentiles": {f"p{p}": float(v) for p, v in zip(PERCENTILES, percentiles)},
+    "histogram": np.histogram(values, bins=edges)[0].tolist(),
+  }
+
+
+def competition_ranks(keys: np.ndarray, groups: np.ndarray | None = None) -> np.ndarray:
+  """1-based rank of each value within its group, highest first; ties share the best rank."""
+  groups = np.zeros(len(keys), dtype=np.int64) if groups is None else groups
+  order = np.lexsort((-keys, groups))
+  sorted_keys, sorted_groups = keys[order], groups[order]
+  positions = np.arange(len(keys))
+  new_group = np.r_[True, sorted_groups[1:] != sorted_groups[:-1]]
+  new_value = new_group | np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]
+  group_start = np.maximum.accumulate(np.where(new_group, positions, 0))
+  value_start = np.maximum.accumulate(np.where(new_value, positions, 0))
+  ranks = np.empty(len(keys), dtype=np.int64)
+  ranks[order] = value_start - group_start + 1
+  return ranks
+
+
+def compute_stats(
+  codes: Sequence[str],
+  prefectures: Sequence[str],
+  rents: Sequence[float | None],
+  bins: int = HISTOGRAM_BINS,
+) -> RentStats:
+  """Summaries and ranks over every municipality that has a rent value."""
+  rent = np.array([np.nan if value is None else float(value) for value in rents], dtype=np.float64)
+  valid = ~np.isnan(rent)
+  rent = rent[valid]
+  codes = np.asarray(codes, dtype=str)[valid]
+  prefectures = np.asarray(prefectures, dtype=str)[valid]
+  edges = np.histogram_bin_edges(rent, bins=bins) if len(rent) else np.linspace(0, 1, bins + 1)
+
+  names, group = np.unique(prefectures, return_inverse=True)
+  order = np.argsort(group, kind="stable")
+  splits = np.split(rent[order], np.flatnonzero(np.diff(group[order])) + 1) if len(rent) else []
+  by_prefecture = {str(name): summarize(values, edges) for name, values in zip(names, splits)}
+
+  national_rank = competition_ranks(rent)
+  prefecture_rank = competition_ranks(rent, group)
+  # Share of municipalities whose rent is at or below this one.
+  percentile = np.searchsorted(np.sort(rent), rent, side="right") / max(len(rent), 1) * 100
+  ranks = {
+    str(code): {"rank": int(r), "prefecture_rank": int(pr), "percentile": round(float(p), 2)}
+    for code, r, pr, p in zip(codes, national_rank, prefecture_rank, percentile)
+  }
+  return RentStats(summarize(rent, edges), by_prefecture, edges.tolist(), ranks)
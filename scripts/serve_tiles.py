@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Serve an MBTiles vector tile pyramid over HTTP for local development.
+
+``GET /{z}/{x}/{y}.pbf`` returns one tile (gzip-encoded as stored, or
+decompressed for clients that do not accept gzip; ``204`` for empty tiles)
+and ``GET /tiles.json`` returns a TileJSON document for map clients.
+"""
+
+from __future__ import annotations
+
+import argparse
+import gzip
+import json
+import re
+import sqlite3
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from vector_tiles import read_metadata, read_tile
+
+TILE_PATH = re.compile(r"^/(\d+)/(\d+)/(\d+)\.pbf$")
+
+
+def make_handler(path: Path) -> type[BaseHTTPRequestHandler]:
+  local = threading.local()
+
+  def connection() -> sqlite3.Connection:
+    # sqlite3 connections must stay on the thread that created them.
+    if not hasattr(local, "db"):
+      local.db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    return local.db
+
+  class TileHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+      url = urlsplit(self.path)
+      match = TILE_PATH.match(url.path)
+      if match:
+        self.send_tile(*map(int, match.groups()))
+      elif url.path == "/tiles.json":
+        self.send_tilejson()
+      else:
+        self.send(404, b"not found", {"Content-Type": "text/plain"})
+
+    def send_tile(self, zoom: int, x: int, y: int) -> None:
+      data = read_tile(connection(), zoom, x, y)
+      if data is None:
+        self.send(204, b"", {})
+        return
+      headers = {"Content-Type": "application/vnd.mapbox-vector-tile", "Cache-Control": "public, max-age=3600"}
+      if data[:2] == b"\x1f\x8b":
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+          headers["Content-Encoding"] = "gzip"
+        else:
+          data = gzip.decompress(data)
+      self.send(200, data, headers)
+
+    def send_tilejson(self) -> None:
+      metadata = read_metadata(connection())
+      base = f"http://{self.headers.get('Host', f'localhost:{self.server.server_port}')}"
+      document = {
+        "tilejson": "3.0.0",
+        "name": metadata.get("name"),
+        "tiles": [f"{base}/{{z}}/{{x}}/{{y}}.pbf"],
+        "minzoom": int(metadata.get("minzoom", 0)),
+        "maxzoom": int(metadata.get("maxzoom", 22)),
+        "bounds": [float(v) for v in metadata.get("bounds", "-180,-85,180,85").split(",")],
+        "vector_layers": json.loads(metadata.get("json", "{}")).get("vector_layers", []),
+      }
+      self.send(200, json.dumps(document, ensure_ascii=False).encode("utf-8"), {"Content-Type": "application/json"})
+
+    def send(self, status: int, body: bytes, headers: dict[str, str]) -> None:
+      self.send_response(status)
+      self.send_header("Access-Control-Allow-Origin", "*")
+      for key, value in headers.items():
+        self.send_header(key, value)
+      self.send_header("Content-Length", str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+  return TileHandler
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--mbtiles", default="data/municipalities.mbtiles")
+  parser.add_argument("--host", default="127.0.0.1")
+  parser.add_argument("--port", type=int, default=8081)
+  args = parser.parse_args()
+
+  path = Path(args.mbtiles)
+  if not path.is_file():
+    raise SystemExit(f"{path} がありません。先に scripts/build_tiles.py を実行してください。")
+  server = ThreadingHTTPServer((args.host, args.port), make_handler(path))
+  print(f"serving {path} at http://{args.host}:{args.port}/{{z}}/{{x}}/{{y}}.pbf (TileJSON: /tiles.json)")
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+
+
+if __name__ == "__main__":
+  main()
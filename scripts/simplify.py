@@ -0,0 +1,203 @@
+"""Topology-preserving Douglas-Peucker simplification for municipality boundaries.
+
+Neighbouring municipalities share their border vertex for vertex. Simplifying
+each polygon on its own would drop different vertices on either side of the
+border and open slivers between them, so rings are first cut into arcs at
+junctions (vertices where the set of neighbours changes). Every arc is then
+simplified in a canonical direction, which guarantees that both polygons
+sharing it end up with exactly the same vertices.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterable, Iterator
+
+import numpy as np
+
+# Tolerances are in degrees (1e-4 deg is roughly 10 m in Japan).
+DEFAULT_LEVELS = {"nation": 1e-2, "prefecture": 1e-3, "city": 1e-4}
+
+Point = tuple[float, float]
+
+
+@dataclass
+class SimplifyReport:
+  source_vertices: int = 0
+  junctions: int = 0
+  vertices: dict[str, int] = field(default_factory=dict)
+
+
+def parse_levels(spec: str) -> dict[str, float]:
+  """Parse ``name=tolerance,name=tolerance`` into an ordered mapping."""
+  levels = {}
+  for item in filter(None, (part.strip() for part in spec.split(","))):
+    name, _, tolerance = item.partition("=")
+    if not tolerance:
+      raise ValueError(f"invalid level '{item}' (expected name=tolerance)")
+    levels[name.strip()] = float(tolerance)
+  return levels
+
+
+def level_paths(output: Path, levels: dict[str, float]) -> dict[str, Path]:
+  """The finest level goes to ``output``; the others are written next to it."""
+  finest = min(levels, key=levels.get)
+  return {
+    name: output if name == finest else output.with_name(f"{output.stem}.{name}{output.suffix}")
+    for name in levels
+  }
+
+
+def iter_polygons(geometry: dict | None) -> Iterator[list[list[list[float]]]]:
+  if not geometry:
+    return
+  if geometry["type"] == "Polygon":
+    yield geometry["coordinates"]
+  elif geometry["type"] == "MultiPolygon":
+    yield from geometry["coordinates"]
+
+
+def iter_rings(geometry: dict | None) -> Iterator[list[list[float]]]:
+  for polygon in iter_polygons(geometry):
+    yield from polygon
+
+
+def find_junctions(rings: Iterable[list[list[float]]]) -> set[Point]:
+  """Return vertices where two or more distinct borders meet."""
+  neighbours: dict[Point, frozenset] = {}
+  junctions: set[Point] = set()
+  for ring in rings:
+    points = [tuple(p) for p in ring[:-1]]
+    count = len(points)
+    for i, point in enumerate(points):
+      pair = frozenset((points[i - 1], points[(i + 1) % count]))
+      seen = neighbours.setdefault(point, pair)
+      if seen != pair:
+        junctions.add(point)
+  return junctions
+
+
+def cut_ring(ring: list[list[float]], junctions: set[Point]) -> list[list[Point]]:
+  """Split a closed ring into arcs that start and end on junctions.
+
+  Rings without any junction (islands, enclaves) are returned as a single
+  closed arc rotated to a canonical start vertex so that the enclave and the
+  hole around it are cut identically.
+  """
+  points = [tuple(p) for p in ring[:-1]]
+  if not points:
+    return []
+  stops = [i for i, point in enumerate(points) if point in junctions]
+  if not stops:
+    start = points.index(min(points))
+    rotated = points[start:] + points[:start]
+    return [rotated + [rotated[0]]]
+
+  arcs = []
+  for a, b in zip(stops, stops[1:] + [stops[0] + len(points)]):
+    arcs.append([points[i % len(points)] for i in range(a, b + 1)])
+  return arcs
+
+
+def segment_distance(span: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+  """Distances of the ``span`` points from the segment line ``a``-``b``."""
+  dx, dy = b - a
+  norm = np.hypot(dx, dy)
+  if norm == 0:
+    return np.hypot(*(span - a).T)
+  return np.abs(dx * (span[:, 1] - a[1]) - dy * (span[:, 0] - a[0])) / norm
+
+
+def douglas_peucker(points: np.ndarray, tolerance: float) -> np.ndarray:
+  """Simplify an ``(n, 2)`` array keeping both endpoints.
+
+  Distances for a whole span are computed in one vectorized step. Open arcs
+  keep at least their farthest interior vertex and closed arcs (first point
+  equal to the last) at least two, so a ring joined from simplified arcs is
+  never smaller than a triangle and never has to fall back to its
+  unsimplified vertices, which its neighbours would not share.
+  """
+  n = len(points)
+  if n <= 2:
+    return points
+  keep = np.zeros(n, dtype=bool)
+  keep[0] = keep[-1] = True
+  kept, minimum = 2, 3
+  stack = [(0, n - 1)]
+  if np.array_equal(points[0], points[-1]):
+    far = 1 + int(np.argmax(np.hypot(*(points[1:-1] - points[0]).T)))
+    keep[far] = True
+    kept, minimum = 3, 4
+    stack = [(0, far), (far, n - 1)]
+
+  while stack:
+    start, end = stack.pop()
+    if end - start < 2:
+      continue
+    dist = segment_distance(points[start + 1:end], points[start], points[end])
+    i = int(np.argmax(dist))
+    if dist[i] > tolerance or kept < minimum:
+      mid = start + 1 + i
+      keep[mid] = True
+      kept += 1
+      stack.append((start, mid))
+      stack.append((mid, end))
+  return points[keep]
+
+
+def simplify_arc(arc: list[Point], tolerance: float) -> list[Point]:
+  # Simplify the lexicographically smaller direction so that an arc shared by
+  # two rings (traversed in opposite directions) yields identical vertices.
+  reverse = arc[::-1] < arc
+  canonical = arc[::-1] if reverse else arc
+  simplified = [tuple(p) for p in douglas_peucker(np.asarray(canonical, dtype=np.float64), tolerance).tolist()]
+  return simplified[::-1] if reverse else simplified
+
+
+def join_arcs(arcs: list[list[Point]], tolerance: float) -> list[list[float]]:
+  # Junctions are always kept and every arc keeps an interior vertex, so a
+  # ring with three or more distinct vertices stays at least a triangle.
+  out: list[Point] = []
+  for arc in arcs:
+    simplified = simplify_arc(arc, tolerance)
+    out.extend(simplified if not out else simplified[1:])
+  return [list(p) for p in out]
+
+
+def simplify_geometry(geometry: dict | None, junctions: set[Point], levels: dict[str, float]) -> dict[str, dict | None]:
+  """Return ``geometry`` simplified at every level, cutting its rings only once."""
+  if not geometry or geometry["type"] not in {"Polygon", "MultiPolygon"}:
+    return dict.fromkeys(levels, geometry)
+  cut = [[(ring, cut_ring(ring, junctions)) for ring in polygon] for polygon in iter_polygons(geometry)]
+  out = {}
+  for name, tolerance in levels.items():
+    polygons = [[join_arcs(arcs, tolerance) if arcs else ring for ring, arcs in polygon] for polygon in cut]
+    coordinates = polygons[0] if geometry["type"] == "Polygon" else polygons
+    out[name] = {"type": geometry["type"], "coordinates": coordinates}
+  return out
+
+
+def count_vertices(geometry: dict | None) -> int:
+  return sum(len(ring) for ring in iter_rings(geometry))
+
+
+def simplify_levels(features: list[dict], levels: dict[str, float]) -> tuple[dict[str, list[dict]], SimplifyReport]:
+  """Simplify every feature at each tolerance in ``levels`` in one pass.
+
+  Junction detection, the expensive topology step, runs once and is shared
+  by all levels.
+  """
+  report = SimplifyReport()
+  junctions = find_junctions(ring for feature in features for ring in iter_rings(feature.get("geometry")))
+  report.junctions = len(junctions)
+  outputs: dict[str, list[dict]] = {name: [] for name in levels}
+  report.vertices = dict.fromkeys(levels, 0)
+
+  for feature in features:
+    geometry = feature.get("geometry")
+    report.source_vertices += count_vertices(geometry)
+    for name, simplified in simplify_geometry(geometry, junctions, levels).items():
+      report.vertices[name] += count_vertices(simplified)
+      outputs[name].append({**feature, "geometry": simplified})
+  return outputs, report
@@ -0,0 +1,300 @@
+"""Columnar binary snapshots: the pipeline's interchange format.
+
+A snapshot is one file holding typed NumPy columns (attributes) and, for
+municipality snapshots, boundaries packed per level of detail as flat
+coordinate buffers with offset arrays (the GeoArrow polygon layout):
+
+  geometry.<level>.coords           float64 (points, 2)
+  geometry.<level>.ring_offsets     int64   rings + 1     -> coords
+  geometry.<level>.polygon_offsets  int64   polygons + 1  -> rings
+  geometry.<level>.feature_offsets  int64   rows + 1      -> polygons
+  geometry.<level>.types            uint8   0 none, 1 Polygon, 2 MultiPolygon
+
+Layout: an 8-byte magic, a little-endian uint64 header length, a JSON header
+describing every buffer (dtype, shape, offset) and the buffers themselves,
+each 64-byte aligned. Opening a snapshot maps the file and wraps every
+buffer with ``np.frombuffer``, so nothing is parsed or copied until a
+column is used; a geometry is only decoded when it is asked for.
+
+Nullable columns carry a boolean ``<name>.valid`` companion (missing values
+in the data buffer are 0 / NaN / "").
+"""
+
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import struct
+from pathlib import Path
+from typing import Iterable, Iterator, Sequence
+
+import numpy as np
+
+MAGIC = b"RENTSNP1"
+ALIGNMENT = 64
+VALID_SUFFIX = ".valid"
+GEOMETRY_PREFIX = "geometry."
+GEOMETRY_TYPES = {"Polygon": 1, "MultiPolygon": 2}
+
+MUNICIPALITY_COLUMNS = ("code", "name", "prefecture_code", "rent_avg", "population", "area_km2")
+
+
+def _aligned(size: int) -> int:
+  return -(-size // ALIGNMENT) * ALIGNMENT
+
+
+def column_arrays(name: str, values: Sequence[object]) -> dict[str, np.ndarray]:
+  """Typed array for ``values`` (plus a validity mask when some are None)."""
+  valid = np.array([value is not None for value in values], dtype=bool)
+  present = [value for value in values if value is not None]
+  if present and all(isinstance(value, bool) for value in present):
+    data = np.array([bool(value) for value in values], dtype=bool)
+  elif present and all(isinstance(value, int) and not isinstance(value, bool) for value in present):
+    data = np.array([0 if value is None else value for value in values], dtype="<i8")
+  elif all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in present):
+    # Also taken by all-missing columns.
+    data = np.array([np.nan if value is None else float(value) for value in values], dtype="<f8")
+  else:
+    data = np.array(["" if value is None else str(value) for value in values], dtype=str)
+    data = data.astype(data.dtype.newbyteorder("<"))
+  arrays = {name: data}
+  if not valid.all():
+    arrays[name + VALID_SUFFIX] = valid
+  return arrays
+
+
+def pack_geometries(geometries: Sequence[dict | None]) -> dict[str, np.ndarray]:
+  """Flatten Polygon / MultiPolygon geometries into coordinate and offset buffers."""
+  coords: list[list[float]] = []
+  ring_offsets, polygon_offsets, feature_offsets, types = [0], [0], [0], []
+  for geometry in geometries:
+    kind = GEOMETRY_TYPES.get((geometry or {}).get("type"), 0)
+    polygons = [] if not kind else [geometry["coordinates"]] if kind == 1 else geometry["coordinates"]
+    for polygon in polygons:
+      for ring in polygon:
+        coords.extend(point[:2] for point in ring)
+        ring_offsets.append(len(coords))
+      polygon_offsets.append(len(ring_offsets) - 1)
+    feature_offsets.append(len(polygon_offsets) - 1)
+    types.append(kind)
+  return {
+    "coords": np.asarray(coords, dtype="<f8").reshape(-1, 2),
+    "ring_offsets": np.asarray(ring_offsets, dtype="<i8"),
+    "polygon_offsets": np.asarray(polygon_offsets, dtype="<i8"),
+    "feature_offsets": np.asarray(feature_offsets, dtype="<i8"),
+    "types": np.asarray(types, dtype=np.uint8),
+  }
+
+
+def write_snapshot(
+  path: Path,
+  columns: dict[str, Sequence[object]],
+  geometries: dict[str, Sequence[dict | None]] | None = None,
+  metadata: dict | None = None,
+  packed: dict[str, dict[str, np.ndarray]] | None = None,
+) -> int:
+  """Write ``columns`` (and per-level ``geometries``) to ``path``; returns the file size.
+
+  ``packed`` adds levels whose buffers are already laid out by the caller
+  (see ``geometry_store.py``).
+  """
+  lengths = {len(values) for values in columns.values()}
+  lengths |= {len(values) for values in (geometries or {}).values()}
+  if len(lengths) > 1:
+    raise ValueError(f"columns have different lengths: {sorted(lengths)}")
+  arrays: dict[str, np.ndarray] = {}
+  for name, values in columns.items():
+    arrays.update(column_arrays(name, values))
+  for level, level_geometries in (geometries or {}).items():
+    for key, array in pack_geometries(level_geometries).items():
+      arrays[f"{GEOMETRY_PREFIX}{level}.{key}"] = array
+  for level, level_arrays in (packed or {}).items():
+    for key, array in level_arrays.items():
+      arrays[f"{GEOMETRY_PREFIX}{level}.{key}"] = array
+
+  header = {
+    "rows": lengths.pop() if lengths else 0,
+    "columns": [name for name in columns],
+    "levels": [*(geometries or {}), *(packed or {})],
+    "metadata": metadata or {},
+    "buffers": {},
+  }
+  position = 0
+  for name, array in arrays.items():
+    array = np.ascontiguousarray(array)
+    arrays[name] = array
+    # Buffer offsets are relative to the (aligned) end of the header.
+    header["buffers"][name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": position}
+    position += _aligned(array.nbytes)
+  encoded = json.dumps(header, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+  start = _aligned(len(MAGIC) + 8 + len(encoded))
+
+  path.parent.mkdir(parents=True, exist_ok=True)
+  tmp = path.with_suffix(path.suffix + ".tmp")
+  with tmp.open("wb") as fp:
+    fp.write(MAGIC + struct.pack("<Q", len(encoded)) + encoded)
+    for name, array in arrays.items():
+      fp.seek(start + header["buffers"][name]["offset"])
+      fp.write(array.tobytes())
+    fp.truncate(start + position)
+  os.replace(tmp, path)
+  return start + position
+
+
+class Snapshot:
+  """Read-only, memory-mapped view of a snapshot file.
+
+  ``close()`` (or leaving the ``with`` block) unmaps the file. Arrays handed
+  out by ``array`` / ``column`` are views of the mapping: while one of them
+  is still referenced the file stays mapped, and it is unmapped when the
+  last one is released.
+  """
+
+  def __init__(self, path: Path) -> None:
+    self.path = Path(path)
+    with self.path.open("rb") as fp:
+      self._mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    if self._mmap[:len(MAGIC)] != MAGIC:
+      self._mmap.close()
+      raise ValueError(f"{self.path} is not a snapshot")
+    (size,) = struct.unpack_from("<Q", self._mmap, len(MAGIC))
+    header = json.loads(self._mmap[len(MAGIC) + 8:len(MAGIC) + 8 + size])
+    self.rows: int = header["rows"]
+    self.columns: list[str] = header["columns"]
+    self.levels: list[str] = header["levels"]
+    self.metadata: dict = header["metadata"]
+    self._start = _aligned(len(MAGIC) + 8 + size)
+    self._buffers: dict[str, dict] = header["buffers"]
+    self._arrays: dict[str, np.ndarray] = {}
+    self._index: dict[str, int] | None = None
+
+  def __enter__(self) -> "Snapshot":
+    return self
+
+  def __exit__(self, *exc: object) -> None:
+    self.close()
+
+  def close(self) -> None:
+    self._arrays.clear()
+    try:
+      self._mmap.close()
+    except BufferError:
+      # Views handed out are still alive; they keep the mapping (and its file
+      # descriptor) until the last of them is garbage collected.
+      pass
+
+  def array(self, name: str) -> np.ndarray:
+    """Zero-copy view of one buffer."""
+    if name not in self._arrays:
+      spec = self._buffers[name]
+      dtype = np.dtype(spec["dtype"])
+      count = int(np.prod(spec["shape"], dtype=np.int64))
+      self._arrays[name] = np.frombuffer(
+        self._mmap, dtype=dtype, count=count, offset=self._start + spec["offset"]
+      ).reshape(spec["shape"])
+    return self._arrays[name]
+
+  def column(self, name: str) -> np.ndarray:
+    return self.array(name)
+
+  def valid(self, name: str) -> np.ndarray:
+    if name + VALID_SUFFIX in self._buffers:
+      return self.array(name + VALID_SUFFIX)
+    return np.ones(self.rows, dtype=bool)
+
+  def values(self, name: str) -> list:
+    """Column as Python values, ``None`` where missing."""
+    values = self.column(name).tolist()
+    if name + VALID_SUFFIX not in self._buffers:
+      return values
+    return [value if ok else None for value, ok in zip(values, self.valid(name).tolist())]
+
+  def records(self, columns: Iterable[str] | None = None) -> list[dict]:
+    names = list(columns or self.columns)
+    values = [self.values(name) for name in names]
+    return [dict(zip(names, row)) for row in zip(*values)]
+
+  def index(self, code: str) -> int | None:
+    """Row of municipality ``code`` (requires a ``code`` column)."""
+    if self._index is None:
+      self._index = {code: row for row, code in enumerate(self.column("code").tolist())}
+    return self._index.get(code)
+
+  @property
+  def finest_level(self) -> str | None:
+    """Level with the most vertices (the one written to the main GeoJSON)."""
+    if not self.levels:
+      return None
+    return max(self.levels, key=lambda level: self._buffers[f"{GEOMETRY_PREFIX}{level}.coords"]["shape"][0])
+
+  def geometry(self, row: int, level: str | None = None) -> dict | None:
+    """Decode the GeoJSON geometry of ``row`` at ``level`` (default: finest)."""
+    prefix = f"{GEOMETRY_PREFIX}{level or self.finest_level}."
+    kind = int(self.array(prefix + "types")[row])
+    if not kind:
+      return None
+    first, last = self.array(prefix + "feature_offsets")[row:row + 2].tolist()
+    polygons = self.array(prefix + "polygon_offsets")[first:last + 1].tolist()
+    rings = self.array(prefix + "ring_offsets")[polygons[0]:polygons[-1] + 1].tolist()
+    points = self.array(prefix + "coords")[rings[0]:rings[-1]].tolist()
+    return _assemble(kind, polygons, rings, points, polygons[0], rings[0])
+
+  def features(self, level: str | None = None) -> Iterator[dict]:
+    """GeoJSON Features with every attribute column as properties.
+
+    Geometries are decoded one feature at a time from the mapped buffers,
+    so only the feature being yielded exists as Python objects.
+    """
+    level = level or self.finest_level
+    for row, record in enumerate(self.records()):
+      yield {"type": "Feature", "properties": record, "geometry": self.geometry(row, level)}
+
+  def feature_collection(self, level: str | None = None) -> dict:
+    return {"type": "FeatureCollection", "features": list(self.features(level))}
+
+
+def _assemble(kind: int, polygons: list[int], rings: list[int], points: list, base_ring: int, base_point: int) -> dict:
+  """GeoJSON geometry from offset lists; ``base_*`` is where ``rings`` / ``points`` start."""
+  coordinates = [
+    [points[rings[ring - base_ring] - base_point:rings[ring - base_ring + 1] - base_point] for ring in range(start, end)]
+    for start, end in zip(polygons, polygons[1:])
+  ]
+  if kind == GEOMETRY_TYPES["Polygon"]:
+    return {"type": "Polygon", "coordinates": coordinates[0]}
+  return {"type": "MultiPolygon", "coordinates": coordinates}
+
+
+def is_snapshot(path: Path) -> bool:
+  try:
+    with Path(path).open("rb") as fp:
+      return fp.read(len(MAGIC)) == MAGIC
+  except OSError:
+    return False
+
+
+def write_municipalities(path: Path, levels: dict[str, list[dict]]) -> int:
+  """Snapshot of municipality attributes plus every simplification level.
+
+  ``levels`` maps level name -> features in the same order for every level
+  (as produced by ``simplify.simplify_levels``).
+  """
+  first = next(iter(levels.values()))
+  props = [feature.get("properties", {}) for feature in first]
+  columns = {name: [p.get(name) for p in props] for name in MUNICIPALITY_COLUMNS}
+  geometries = {name: [feature.get("geometry") for feature in features] for name, features in levels.items()}
+  return write_snapshot(path, columns, geometries)
+
+
+def write_rent(path: Path, codes: Sequence[str], rents: Sequence[float | None], **columns: Sequence[object]) -> int:
+  """Snapshot of rent values keyed by ``municipality_code``."""
+  return write_snapshot(path, {"municipality_code": list(codes), "rent_avg": list(rents), **columns})
+
+
+def load_rent(path: Path) -> dict[str, float]:
+  """``municipality_code -> rent_avg`` from a rent snapshot, skipping missing values."""
+  with Snapshot(path) as snapshot:
+    codes = snapshot.column("municipality_code")
+    rents = snapshot.column("rent_avg")
+    keep = snapshot.valid("rent_avg") & ~np.isnan(rents)
+    return dict(zip(codes[keep].tolist(), rents[keep].tolist()))
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""Point-in-polygon lookup of municipality codes over an STR-packed R-tree.
+
+Every polygon part (a MultiPolygon contributes one per part) is an R-tree
+entry keyed by its exterior bounding box. The tree is bulk-loaded with
+Sort-Tile-Recursive packing and stored as flat NumPy arrays, so a batch of
+points walks it level by level with vectorized bbox tests; the surviving
+(point, part) candidates are then resolved exactly by even-odd ray casting
+over the part's edges (which also handles holes). The arrays are saved to
+a single ``.npz`` file that loads without rebuilding anything.
+
+  python3 scripts/spatial_index.py build
+  python3 scripts/spatial_index.py locate --csv listings.csv --output listings_with_code.csv
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import math
+from pathlib import Path
+
+import numpy as np
+
+from json_stream import iter_array_items, iter_file_chunks
+from simplify import iter_polygons
+
+NODE_CAPACITY = 16
+# Upper bound on point-by-edge cells evaluated at once during ray casting.
+RAY_CAST_CELLS = 1 << 22
+QUERY_CHUNK = 1 << 18
+DEFAULT_INDEX_PATH = "data/municipalities.index.npz"
+
+
+def str_order(bboxes: np.ndarray, capacity: int = NODE_CAPACITY) -> np.ndarray:
+  """Sort-Tile-Recursive order: vertical slices by x center, then y center within each."""
+  n = len(bboxes)
+  if n <= capacity:
+    return np.arange(n)
+  cx = (bboxes[:, 0] + bboxes[:, 2]) / 2
+  cy = (bboxes[:, 1] + bboxes[:, 3]) / 2
+  slices = math.ceil(math.sqrt(math.ceil(n / capacity)))
+  per_slice = slices * capacity
+  by_x = np.argsort(cx, kind="stable")
+  order = [
+    chunk[np.argsort(cy[chunk], kind="stable")]
+    for chunk in (by_x[i:i + per_slice] for i in range(0, n, per_slice))
+  ]
+  return np.concatenate(order)
+
+
+def group_bounds(bboxes: np.ndarray, capacity: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+  """Pack consecutive runs of ``capacity`` boxes into parent nodes."""
+  starts = np.arange(0, len(bboxes), capacity)
+  counts = np.minimum(capacity, len(bboxes) - starts)
+  parents = np.column_stack((
+    np.minimum.reduceat(bboxes[:, 0], starts),
+    np.minimum.reduceat(bboxes[:, 1], starts),
+    np.maximum.reduceat(bboxes[:, 2], starts),
+    np.maximum.reduceat(bboxes[:, 3], starts),
+  ))
+  return parents, starts, counts
+
+
+def _contains(bboxes: np.ndarray, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+  return (bboxes[:, 0] <= x) & (x <= bboxes[:, 2]) & (bboxes[:, 1] <= y) & (y <= bboxes[:, 3])
+
+
+def _expand(nodes: np.ndarray, starts: np.ndarray, counts: np.ndarray, points: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+  """Replace every (point, node) pair by the pairs for all children of the node."""
+  n = counts[nodes]
+  points = np.repeat(points, n)
+  offsets = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+  return points, np.repeat(starts[nodes], n) + offsets
+
+
+class SpatialIndex:
+  """STR R-tree over municipality polygon parts with exact point-in-polygon tests."""
+
+  def __init__(self, arrays: dict[str, np.ndarray]) -> None:
+    self.codes = arrays["codes"]
+    self.part_feature = arrays["part_feature"]
+    self.part_bbox = arrays["part_bbox"]
+    self.edge_start = arrays["edge_start"]
+    self.edges = arrays["edges"]
+    depth = int(arrays["depth"])
+    # levels[0] is the root level; children of level i live in level i + 1
+    # (the parts themselves below the last level).
+    self.levels = [
+      (arrays[f"level{i}_bbox"], arrays[f"level{i}_start"], arrays[f"level{i}_count"])
+      for i in range(depth)
+    ]
+
+  @classmethod
+  def build(cls, features: list[dict], capacity: int = NODE_CAPACITY) -> "SpatialIndex":
+    codes, part_feature, part_bbox, edge_start, edges = [], [], [], [0], []
+    for feature in features:
+      polygons = list(iter_polygons(feature.get("geometry")))
+      if not polygons:
+        continue
+      codes.append(str(feature.get("properties", {}).get("code", "")))
+      for polygon in polygons:
+        rings = [np.asarray(ring, dtype=np.float64) for ring in polygon if len(ring) >= 4]
+        if not rings:
+          continue
+        exterior = rings[0]
+        part_feature.append(len(codes) - 1)
+        part_bbox.append((*exterior.min(axis=0), *exterior.max(axis=0)))
+        for ring in rings:
+          edges.append(np.column_stack((ring[:-1], ring[1:])))
+        edge_start.append(edge_start[-1] + sum(len(ring) - 1 for ring in rings))
+
+    part_bbox = np.asarray(part_bbox, dtype=np.float64).reshape(-1, 4)
+    order = str_order(part_bbox, capacity)
+    edge_start = np.asarray(edge_start, dtype=np.int64)
+    all_edges = np.concatenate(edges) if edges else np.empty((0, 4))
+    # Store parts (and their edges) in STR order so leaves are contiguous.
+    spans = [all_edges[edge_start[i]:edge_start[i + 1]] for i in order]
+    arrays = {
+      "codes": np.asarray(codes, dtype=str),
+      "part_feature": np.asarray(part_feature, dtype=np.int32)[order],
+      "part_bbox": part_bbox[order],
+      "edge_start": np.concatenate(([0], np.cumsum([len(span) for span in spans]))).astype(np.int64),
+      "edges": np.concatenate(spans) if spans else all_edges,
+    }
+
+    levels = []
+    bboxes = arrays["part_bbox"]
+    while True:
+      parents, starts, counts = group_bounds(bboxes, capacity)
+      levels.append((parents, starts, counts))
+      if len(parents) <= capacity:
+        break
+      # STR-pack the next level too; children keep their explicit ranges.
+      order = str_order(parents, capacity)
+      bboxes, levels[-1] = parents[order], (parents[order], starts[order], counts[order])
+    levels.reverse()
+    arrays["depth"] = np.asarray(len(levels))
+    for i, (bbox, start, count) in enumerate(levels):
+      arrays[f"level{i}_bbox"], arrays[f"level{i}_start"], arrays[f"level{i}_count"] = bbox, start, count
+    return cls(arrays)
+
+  @classmethod
+  def load(cls, path: Path) -> "SpatialIndex":
+    with np.load(path) as data:
+      return cls({key: data[key] for key in data.files})
+
+  def save(self, path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    arrays = {
+      "codes": self.codes,
+      "part_feature": self.part_feature,
+      "part_bbox": self.part_bbox,
+      "edge_start": self.edge_start,
+      "edges": self.edges,
+      "depth": np.asarray(len(self.levels)),
+    }
+    for i, (bbox, start, count) in enumerate(self.levels):
+      arrays[f"level{i}_bbox"], arrays[f"level{i}_start"], arrays[f"level{i}_count"] = bbox, start, count
+    with path.open("wb") as fp:
+      np.savez(fp, **arrays)
+
+  def candidates(self, lon: np.ndarray, lat: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """(point index, part index) pairs whose part bbox contains the point."""
+    root_bbox = self.levels[0][0]
+    points = np.repeat(np.arange(len(lon)), len(root_bbox))
+    nodes = np.tile(np.arange(len(root_bbox)), len(lon))
+    for bbox, starts, counts in self.levels:
+      keep = _contains(bbox[nodes], lon[points], lat[points])
+      points, nodes = _expand(nodes[keep], starts, counts, points[keep])
+    keep = _contains(self.part_bbox[nodes], lon[points], lat[points])
+    return points[keep], nodes[keep]
+
+  def lookup_indices(self, lon: np.ndarray, lat: np.ndarray) -> np.ndarray:
+    """Index into ``codes`` of the municipality containing each point, or -1."""
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    result = np.full(len(lon), -1, dtype=np.int32)
+    for offset in range(0, len(lon), QUERY_CHUNK):
+      chunk = slice(offset, offset + QUERY_CHUNK)
+      self._lookup_chunk(lon[chunk], lat[chunk], result[chunk])
+    return result
+
+  def _lookup_chunk(self, lon: np.ndarray, lat: np.ndarray, out: np.ndarray) -> None:
+    points, parts = self.candidates(lon, lat)
+    if not len(parts):
+      return
+    order = np.argsort(parts, kind="stable")
+    points, parts = points[order], parts[order]
+    heads = np.concatenate(([0], np.flatnonzero(np.diff(parts)) + 1))
+    for head, group_points in zip(heads, np.split(points, heads[1:])):
+      part = parts[head]
+      edges = self.edges[self.edge_start[part]:self.edge_start[part + 1]]
+      step = max(1, RAY_CAST_CELLS // max(1, len(edges)))
+      for i in range(0, len(group_points), step):
+        batch = group_points[i:i + step]
+        inside = ray_cast(edges, lon[batch], lat[batch])
+        out[batch[inside]] = self.part_feature[part]
+
+  def lookup(self, lon: np.ndarray, lat: np.ndarray) -> np.ndarray:
+    """Municipality code containing each point (``""`` outside every polygon)."""
+    # Index -1 (not found) picks the trailing "".
+    return np.append(self.codes, "")[self.lookup_indices(lon, lat)]
+
+  def locate(self, lon: float, lat: float) -> str | None:
+    return self.lookup(np.array([lon]), np.array([lat]))[0] or None
+
+
+def ray_cast(edges: np.ndarray, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+  """Even-odd test of points against every edge ``(x1, y1, x2, y2)`` of one polygon."""
+  x1, y1, x2, y2 = (edges[:, i][None, :] for i in range(4))
+  px, py = x[:, None], y[:, None]
+  straddles = (y1 > py) != (y2 > py)
+  with np.errstate(divide="ignore", invalid="ignore"):
+    crossing_x = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+  crosses = straddles & (px < crossing_x)
+  return (np.count_nonzero(crosses, axis=1) & 1).astype(bool)
+
+
+def load_features(path: Path) -> list[dict]:
+  return list(iter_array_items(iter_file_chunks(path), "features"))
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser()
+  sub = parser.add_subparsers(dest="command", required=True)
+  build = sub.add_parser("build", help="GeoJSON から索引を作成して保存")
+  build.add_argument("--input", default="data/municipalities.geojson")
+  build.add_argument("--index", default=DEFAULT_INDEX_PATH)
+  locate = sub.add_parser("locate", help="CSV の緯度経度に municipality_code を付与")
+  locate.add_argument("--index", default=DEFAULT_INDEX_PATH)
+  locate.add_argument("--csv", required=True)
+  locate.add_argument("--output", required=True)
+  locate.add_argument("--lat-column", default="lat")
+  locate.add_argument("--lon-column", default="lon")
+  args = parser.parse_args()
+
+  if args.command == "build":
+    index = SpatialIndex.build(load_features(Path(args.input)))
+    index.save(Path(args.index))
+    print(f"saved: {args.index} ({len(index.codes):,} municipalities, {len(index.part_bbox):,} parts, {len(index.levels)} levels)")
+    return
+
+  index = SpatialIndex.load(Path(args.index))
+  with open(args.csv, encoding="utf-8", newline="") as fp:
+    reader = csv.DictReader(fp)
+    fieldnames = list(reader.fieldnames or [])
+    rows = list(reader)
+  lon = np.array([float(row[args.lon_column] or "nan") for row in rows])
+  lat = np.array([float(row[args.lat_column] or "nan") for row in rows])
+  codes = index.lookup(lon, lat)
+  with open(args.output, "w", encoding="utf-8", newline="") as fp:
+    writer = csv.DictWriter(fp, fieldnames=fieldnames + ["municipality_code"])
+    writer.writeheader()
+    for row, code in zip(rows, codes):
+      writer.writerow({**row, "municipality_code": code})
+  print(f"saved: {args.output} ({np.count_nonzero(codes != ''):,}/{len(rows):,} located)")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,122 @@
+"""Encode municipality boundaries as TopoJSON.
+
+Shared borders are stored once as arcs (cut at the same junctions used by
+``simplify.py``), coordinates are quantized to integers on a fixed grid and
+delta-encoded, and every polygon ring becomes a list of arc references. A
+negative reference ``~i`` means arc ``i`` traversed backwards, as in the
+TopoJSON specification, so any standard TopoJSON client can read the output.
+"""
+
+from __future__ import annotations
+
+from typing import Iterable
+
+from simplify import Point, cut_ring, find_junctions, iter_polygons, iter_rings
+
+DEFAULT_QUANTIZATION = 100_000
+
+
+def compute_bbox(features: Iterable[dict]) -> tuple[float, float, float, float]:
+  x0 = y0 = float("inf")
+  x1 = y1 = float("-inf")
+  for feature in features:
+    for ring in iter_rings(feature.get("geometry")):
+      for x, y in ring:
+        x0, y0, x1, y1 = min(x0, x), min(y0, y), max(x1, x), max(y1, y)
+  return x0, y0, x1, y1
+
+
+class _ArcTable:
+  def __init__(self, translate: tuple[float, float], scale: tuple[float, float]) -> None:
+    self.translate = translate
+    self.scale = scale
+    self.arcs: list[list[list[int]]] = []
+    self.index: dict[tuple[Point, ...], int] = {}
+
+  def quantize(self, arc: list[Point]) -> list[list[int]]:
+    (tx, ty), (kx, ky) = self.translate, self.scale
+    out: list[list[int]] = []
+    px = py = 0
+    for x, y in arc:
+      qx, qy = round((x - tx) / kx), round((y - ty) / ky)
+      if out and qx == px and qy == py:
+        continue
+      out.append([qx - px, qy - py])
+      px, py = qx, qy
+    if len(out) == 1:
+      out.append([0, 0])
+    return out
+
+  def reference(self, arc: list[Point]) -> int:
+    reverse = arc[::-1] < arc
+    key = tuple(arc[::-1] if reverse else arc)
+    i = self.index.get(key)
+    if i is None:
+      i = self.index[key] = len(self.arcs)
+      self.arcs.append(self.quantize(list(key)))
+    return ~i if reverse else i
+
+
+def encode_topology(
+  features: list[dict],
+  quantization: int = DEFAULT_QUANTIZATION,
+  object_name: str = "municipalities",
+) -> dict:
+  """Convert GeoJSON features into a quantized TopoJSON ``Topology``."""
+  junctions = find_junctions(ring for feature in features for ring in iter_rings(feature.get("geometry")))
+  x0, y0, x1, y1 = compute_bbox(features)
+  scale = ((x1 - x0) / (quantization - 1) or 1.0, (y1 - y0) / (quantization - 1) or 1.0)
+  table = _ArcTable((x0, y0), scale)
+
+  geometries = []
+  for feature in features:
+    geometry = feature.get("geometry")
+    polygons = [
+      [[table.reference(arc) for arc in cut_ring(ring, junctions)] for ring in polygon]
+      for polygon in iter_polygons(geometry)
+    ]
+    entry: dict = {"type": None, "properties": feature.get("properties", {})}
+    if geometry and geometry["type"] == "Polygon":
+      entry.update(type="Polygon", arcs=polygons[0])
+    elif geometry and geometry["type"] == "MultiPolygon":
+      entry.update(type="MultiPolygon", arcs=polygons)
+    geometries.append(entry)
+
+  return {
+    "type": "Topology",
+    "transform": {"scale": list(scale), "translate": [x0, y0]},
+    "bbox": [x0, y0, x1, y1],
+    "objects": {object_name: {"type": "GeometryCollection", "geometries": geometries}},
+    "arcs": table.arcs,
+  }
+
+
+def decode_topology(topology: dict, object_name: str = "municipalities") -> dict:
+  """Rebuild a GeoJSON FeatureCollection (mirrors the JS decoder in build.py)."""
+  (kx, ky), (tx, ty) = topology["transform"]["scale"], topology["transform"]["translate"]
+  arcs = []
+  for arc in topology["arcs"]:
+    x = y = 0
+    points = []
+    for dx, dy in arc:
+      x, y = x + dx, y + dy
+      points.append([x * kx + tx, y * ky + ty])
+    arcs.append(points)
+
+  def ring(refs: list[int]) -> list[list[float]]:
+    out: list[list[float]] = []
+    for ref in refs:
+      points = arcs[ref] if ref >= 0 else arcs[~ref][::-1]
+      out.extend(points if not out else points[1:])
+    return out
+
+  features = []
+  for geometry in topology["objects"][object_name]["geometries"]:
+    if geometry["type"] == "Polygon":
+      shape = {"type": "Polygon", "coordinates": [ring(r) for r in geometry["arcs"]]}
+    elif geometry["type"] == "MultiPolygon":
+      shape = {"type": "MultiPolygon", "coordinates": [[ring(r) for r in p] for p in geometry["arcs"]]}
+    else:
+      shape = None
+    features.append({"type": "Feature", "properties": geometry.get("properties", {}), "geometry": shape})
+  return {"type": "FeatureCollection", "features": features}
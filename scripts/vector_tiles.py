@@ -0,0 +1,372 @@
+"""Mapbox Vector Tile (MVT) encoding and MBTiles storage for municipality polygons.
+
+Polygons are projected to Web Mercator, clipped to each tile (plus a small
+buffer so strokes do not show seams), quantized to the tile extent and
+written as protobuf ``Tile`` messages (spec 2.1) without any protobuf
+dependency. Tiles are stored gzip-compressed in an MBTiles (SQLite) file,
+rows addressed in the TMS scheme as the MBTiles spec requires.
+"""
+
+from __future__ import annotations
+
+import gzip
+import json
+import math
+import sqlite3
+import struct
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+
+DEFAULT_EXTENT = 4096
+DEFAULT_BUFFER = 64
+LAYER_NAME = "municipalities"
+MAX_LATITUDE = 85.0511287798
+
+GEOM_POLYGON = 3
+CMD_MOVE_TO = 1
+CMD_LINE_TO = 2
+CMD_CLOSE_PATH = 7
+
+
+# --- Web Mercator ---------------------------------------------------------
+
+def project(points: np.ndarray, zoom: int) -> np.ndarray:
+  """Project ``(n, 2)`` lon/lat to fractional tile coordinates at ``zoom``."""
+  n = 2.0**zoom
+  lon = points[:, 0]
+  lat = np.radians(np.clip(points[:, 1], -MAX_LATITUDE, MAX_LATITUDE))
+  x = (lon + 180.0) / 360.0 * n
+  y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / math.pi) / 2.0 * n
+  return np.column_stack((x, y))
+
+
+def tile_lon(x: float, zoom: int) -> float:
+  return x / 2.0**zoom * 360.0 - 180.0
+
+
+def tile_range(bbox: tuple[float, float, float, float], zoom: int) -> tuple[int, int, int, int]:
+  """Inclusive ``x0, y0, x1, y1`` tile indices covering a lon/lat bbox."""
+  west, south, east, north = bbox
+  (x0, y0), (x1, y1) = project(np.array([[west, north], [east, south]], dtype=np.float64), zoom)
+  last = 2**zoom - 1
+  clamp = lambda v: min(max(int(math.floor(v)), 0), last)
+  return clamp(x0), clamp(y0), clamp(x1), clamp(y1)
+
+
+def zoom_tolerance(zoom: int) -> float:
+  """Simplification tolerance in degrees: about one 256px screen pixel at ``zoom``."""
+  return 360.0 / (2**zoom * 256)
+
+
+# --- Clipping and quantization --------------------------------------------
+
+def _clip_edge(points: list[tuple[float, float]], axis: int, limit: float, keep_below: bool) -> list[tuple[float, float]]:
+  out: list[tuple[float, float]] = []
+  if not points:
+    return out
+  inside = (lambda p: p[axis] <= limit) if keep_below else (lambda p: p[axis] >= limit)
+  prev = points[-1]
+  prev_in = inside(prev)
+  for point in points:
+    point_in = inside(point)
+    if point_in != prev_in:
+      t = (limit - prev[axis]) / (point[axis] - prev[axis])
+      other = 1 - axis
+      crossing = [0.0, 0.0]
+      crossing[axis] = limit
+      crossing[other] = prev[other] + t * (point[other] - prev[other])
+      out.append((crossing[0], crossing[1]))
+    if point_in:
+      out.append(point)
+    prev, prev_in = point, point_in
+  return out
+
+
+def clip_ring(points: list[tuple[float, float]], lo: float, hi: float) -> list[tuple[float, float]]:
+  """Sutherland-Hodgman clip of an open ring to the square ``[lo, hi]``."""
+  for axis in (0, 1):
+    points = _clip_edge(points, axis, lo, keep_below=False)
+    points = _clip_edge(points, axis, hi, keep_below=True)
+  return points
+
+
+def ring_area(ring: list[tuple[int, int]]) -> int:
+  """Twice the signed area; positive means clockwise on screen (y down)."""
+  return sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]))
+
+
+def tile_rings(
+  rings: list[np.ndarray],
+  tx: int,
+  ty: int,
+  extent: int = DEFAULT_EXTENT,
+  buffer: int = DEFAULT_BUFFER,
+) -> list[list[tuple[int, int]]]:
+  """Clip and quantize projected rings (exterior first) of one polygon to tile ``tx, ty``.
+
+  Returns an empty list when the exterior ring does not reach the tile.
+  The exterior is wound clockwise and holes counter-clockwise, as MVT
+  requires.
+  """
+  lo, hi = -buffer, extent + buffer
+  out = []
+  for index, ring in enumerate(rings):
+    local = (ring - (tx, ty)) * extent
+    x0, y0 = local.min(axis=0)
+    x1, y1 = local.max(axis=0)
+    if x1 < lo or y1 < lo or x0 > hi or y0 > hi:
+      if index == 0:
+        return []
+      continue
+    points = [tuple(p) for p in local[:-1].tolist()]
+    if x0 < lo or y0 < lo or x1 > hi or y1 > hi:
+      points = clip_ring(points, lo, hi)
+    quantized: list[tuple[int, int]] = []
+    for x, y in points:
+      q = (int(round(x)), int(round(y)))
+      if not quantized or q != quantized[-1]:
+        quantized.append(q)
+    while len(quantized) > 1 and quantized[0] == quantized[-1]:
+      quantized.pop()
+    area = ring_area(quantized) if len(quantized) >= 3 else 0
+    if area == 0:
+      if index == 0:
+        return []
+      continue
+    if (area > 0) != (index == 0):
+      quantized.reverse()
+    out.append(quantized)
+  return out
+
+
+# --- Protobuf encoding ----------------------------------------------------
+
+def _varint(value: int) -> bytes:
+  out = bytearray()
+  while True:
+    byte = value & 0x7F
+    value >>= 7
+    if value:
+      out.append(byte | 0x80)
+    else:
+      out.append(byte)
+      return bytes(out)
+
+
+def _zigzag(value: int) -> int:
+  return (value << 1) ^ (value >> 63)
+
+
+def _field(number: int, wire_type: int) -> bytes:
+  return _varint((number << 3) | wire_type)
+
+
+def _bytes_field(number: int, payload: bytes) -> bytes:
+  return _field(number, 2) + _varint(len(payload)) + payload
+
+
+def _packed(number: int, values: list[int]) -> bytes:
+  return _bytes_field(number, b"".join(_varint(v) for v in values))
+
+
+def encode_geometry(polygons: list[list[list[tuple[int, int]]]]) -> list[int]:
+  """MVT command stream for polygons given as lists of rings."""
+  commands: list[int] = []
+  cx = cy = 0
+  for polygon in polygons:
+    for ring in polygon:
+      x, y = ring[0]
+      commands += [(1 << 3) | CMD_MOVE_TO, _zigzag(x - cx), _zigzag(y - cy)]
+      cx, cy = x, y
+      commands.append(((len(ring) - 1) << 3) | CMD_LINE_TO)
+      for x, y in ring[1:]:
+        commands += [_zigzag(x - cx), _zigzag(y - cy)]
+        cx, cy = x, y
+      commands.append((1 << 3) | CMD_CLOSE_PATH)
+  return commands
+
+
+def _encode_value(value: object) -> bytes:
+  if isinstance(value, bool):
+    return _field(7, 0) + _varint(int(value))
+  if isinstance(value, int):
+    return _field(6, 0) + _varint(_zigzag(value)) if value < 0 else _field(5, 0) + _varint(value)
+  if isinstance(value, float):
+    return _field(3, 1) + struct.pack("<d", value)
+  return _bytes_field(1, str(value).encode("utf-8"))
+
+
+class LayerBuilder:
+  """Accumulates features of one MVT layer, sharing the key/value tables."""
+
+  def __init__(self, name: str = LAYER_NAME, extent: int = DEFAULT_EXTENT) -> None:
+    self.name = name
+    self.extent = extent
+    self.keys: dict[str, int] = {}
+    self.values: dict[tuple[type, object], int] = {}
+    self.features: list[bytes] = []
+
+  def add(self, feature_id: int | None, properties: dict, polygons: list[list[list[tuple[int, int]]]]) -> None:
+    tags: list[int] = []
+    for key, value in properties.items():
+      if value is None or isinstance(value, (dict, list)):
+        continue
+      tags.append(self.keys.setdefault(key, len(self.keys)))
+      tags.append(self.values.setdefault((type(value), value), len(self.values)))
+    message = b""
+    if feature_id is not None:
+      message += _field(1, 0) + _varint(feature_id)
+    message += _packed(2, tags) + _field(3, 0) + _varint(GEOM_POLYGON) + _packed(4, encode_geometry(polygons))
+    self.features.append(message)
+
+  def encode(self) -> bytes:
+    message = _field(15, 0) + _varint(2) + _bytes_field(1, self.name.encode("utf-8"))
+    message += b"".join(_bytes_field(2, feature) for feature in self.features)
+    message += b"".join(_bytes_field(3, key.encode("utf-8")) for key in self.keys)
+    message += b"".join(_bytes_field(4, _encode_value(value)) for _, value in self.values)
+    message += _field(5, 0) + _varint(self.extent)
+    return _bytes_field(3, message)
+
+
+def _read_varint(data: bytes, pos: int) -> tuple[int, int]:
+  value = shift = 0
+  while True:
+    byte = data[pos]
+    pos += 1
+    value |= (byte & 0x7F) << shift
+    shift += 7
+    if not byte & 0x80:
+      return value, pos
+
+
+def _iter_fields(data: bytes) -> Iterator[tuple[int, object]]:
+  pos = 0
+  while pos < len(data):
+    key, pos = _read_varint(data, pos)
+    number, wire_type = key >> 3, key & 7
+    if wire_type == 0:
+      value, pos = _read_varint(data, pos)
+    elif wire_type == 1:
+      value, pos = data[pos:pos + 8], pos + 8
+    elif wire_type == 2:
+      length, pos = _read_varint(data, pos)
+      value, pos = data[pos:pos + length], pos + length
+    else:
+      raise ValueError(f"unsupported wire type {wire_type}")
+    yield number, value
+
+
+def decode_tile(data: bytes) -> dict[str, list[dict]]:
+  """Decode a (possibly gzipped) tile into ``{layer: [{id, properties, rings}]}`` for inspection."""
+  if data[:2] == b"\x1f\x8b":
+    data = gzip.decompress(data)
+  layers: dict[str, list[dict]] = {}
+  for number, layer in _iter_fields(data):
+    if number != 3:
+      continue
+    name, keys, values, raw_features = "", [], [], []
+    for field_number, value in _iter_fields(layer):
+      if field_number == 1:
+        name = value.decode("utf-8")
+      elif field_number == 2:
+        raw_features.append(value)
+      elif field_number == 3:
+        keys.append(value.decode("utf-8"))
+      elif field_number == 4:
+        for kind, raw in _iter_fields(value):
+          values.append(
+            raw.decode("utf-8") if kind == 1 else
+            struct.unpack("<d", raw)[0] if kind == 3 else
+            (raw >> 1) ^ -(raw & 1) if kind == 6 else
+            bool(raw) if kind == 7 else raw
+          )
+    features = []
+    for raw in raw_features:
+      feature: dict = {"id": None, "properties": {}, "rings": []}
+      for field_number, value in _iter_fields(raw):
+        if field_number == 1:
+          feature["id"] = value
+        elif field_number in (2, 4):
+          ints, pos = [], 0
+          while pos < len(value):
+            v, pos = _read_varint(value, pos)
+            ints.append(v)
+          if field_number == 2:
+            feature["properties"] = {keys[k]: values[v] for k, v in zip(ints[::2], ints[1::2])}
+          else:
+            feature["rings"] = _decode_commands(ints)
+      features.append(feature)
+    layers[name] = features
+  return layers
+
+
+def _decode_commands(ints: list[int]) -> list[list[tuple[int, int]]]:
+  rings: list[list[tuple[int, int]]] = []
+  x = y = i = 0
+  unzig = lambda v: (v >> 1) ^ -(v & 1)
+  while i < len(ints):
+    command, count = ints[i] & 7, ints[i] >> 3
+    i += 1
+    if command == CMD_CLOSE_PATH:
+      continue
+    for _ in range(count):
+      x, y = x + unzig(ints[i]), y + unzig(ints[i + 1])
+      i += 2
+      if command == CMD_MOVE_TO:
+        rings.append([])
+      rings[-1].append((x, y))
+  return rings
+
+
+# --- MBTiles --------------------------------------------------------------
+
+class MBTilesWriter:
+  """Write tiles (XYZ addressing) into a fresh MBTiles file."""
+
+  def __init__(self, path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.unlink(missing_ok=True)
+    self.path = path
+    self.db = sqlite3.connect(path)
+    self.db.executescript(
+      """
+      pragma journal_mode = off;
+      pragma synchronous = off;
+      create table metadata (name text, value text);
+      create table tiles (zoom_level integer, tile_column integer, tile_row integer, tile_data blob);
+      """
+    )
+
+  def write(self, zoom: int, x: int, y: int, data: bytes) -> None:
+    self.write_many([(zoom, x, y, data)])
+
+  def write_many(self, tiles: list[tuple[int, int, int, bytes]]) -> None:
+    self.db.executemany(
+      "insert into tiles values (?, ?, ?, ?)",
+      [(z, x, (1 << z) - 1 - y, data) for z, x, y, data in tiles],
+    )
+
+  def set_metadata(self, metadata: dict[str, object]) -> None:
+    self.db.executemany(
+      "insert into metadata values (?, ?)",
+      [(key, value if isinstance(value, str) else json.dumps(value)) for key, value in metadata.items()],
+    )
+
+  def close(self) -> None:
+    self.db.execute("create unique index tile_index on tiles (zoom_level, tile_column, tile_row)")
+    self.db.commit()
+    self.db.close()
+
+
+def read_tile(db: sqlite3.Connection, zoom: int, x: int, y: int) -> bytes | None:
+  row = db.execute(
+    "select tile_data from tiles where zoom_level = ? and tile_column = ? and tile_row = ?",
+    (zoom, x, (1 << zoom) - 1 - y),
+  ).fetchone()
+  return row[0] if row else None
+
+
+def read_metadata(db: sqlite3.Connection) -> dict[str, str]:
+  return dict(db.execute("select name, value from metadata"))
@@ -0,0 +1,28 @@
+-- Move municipalities.geojson into municipality_geometries (see schema.sql).
+-- The existing geometry becomes the 'city' level; re-run
+-- `scripts/import_to_supabase.py` to add the coarser levels. Until then the
+-- map (lib/data.ts getMunicipalityFeatures) draws the 'city' level instead
+-- of the 'prefecture' one it asks for.
+begin;
+
+create table if not exists municipality_geometries (
+  code char(5) references municipalities(code) on delete cascade,
+  lod varchar(16) not null,
+  geojson jsonb not null,
+  updated_at timestamptz not null default now(),
+  primary key (code, lod)
+);
+
+insert into municipality_geometries (code, lod, geojson, updated_at)
+select code, 'city', geojson, updated_at
+from municipalities
+where geojson is not null
+on conflict (code, lod) do nothing;
+
+-- geom_hash now covers every level, so the next incremental import rewrites
+-- each municipality's geometry once.
+update municipalities set geom_hash = null;
+
+alter table municipalities drop column geojson;
+
+commit;
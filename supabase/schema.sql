@@ -10,10 +10,58 @@ create table if not exists municipalities (
   rent_avg numeric,
   population integer,
   area_km2 numeric,
+  attr_hash text,
+  geom_hash text,
+  updated_at timestamptz not null default now()
+);
+
+-- Content hashes written by `import_to_supabase.py --incremental db`
+alter table municipalities add column if not exists attr_hash text;
+alter table municipalities add column if not exists geom_hash text;
+
+-- Boundaries, one row per level of detail (scripts/simplify.py DEFAULT_LEVELS:
+-- 'nation' / 'prefecture' / 'city'), kept out of municipalities so attribute
+-- reads and updates never touch the large jsonb. Existing databases that still
+-- have municipalities.geojson: run supabase/migrations/split_geometry.sql.
+create table if not exists municipality_geometries (
+  code char(5) references municipalities(code) on delete cascade,
+  lod varchar(16) not null,
   geojson jsonb not null,
+  updated_at timestamptz not null default now(),
+  primary key (code, lod)
+);
+
+-- Rent summaries precomputed by `import_to_supabase.py` (scripts/rent_stats.py).
+-- scope is 'national' or a prefecture code; histogram = {"edges": [...], "counts": [...]}
+-- with the national bin edges shared by every scope.
+create table if not exists rent_stats (
+  scope varchar(8) primary key,
+  count integer not null,
+  mean numeric,
+  median numeric,
+  min numeric,
+  max numeric,
+  percentiles jsonb not null default '{}'::jsonb,
+  histogram jsonb not null,
+  -- national scope only (scripts/classify.py): {"method", "breaks", "palette", "legend"}
+  classification jsonb,
   updated_at timestamptz not null default now()
 );
 
+create table if not exists municipality_rent_ranks (
+  code char(5) primary key references municipalities(code) on delete cascade,
+  rank integer not null,
+  prefecture_rank integer not null,
+  percentile numeric not null,
+  -- index into the national classification palette
+  rent_class smallint,
+  updated_at timestamptz not null default now()
+);
+
+-- Color classes written by `import_to_supabase.py` (scripts/classify.py)
+alter table rent_stats add column if not exists classification jsonb;
+alter table municipality_rent_ranks add column if not exists rent_class smallint;
+
 create table if not exists profiles (
   id uuid primary key references auth.users(id) on delete cascade,
   username varchar(50),
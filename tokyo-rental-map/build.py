@@ -3,12 +3,163 @@
 Build script to generate the Tokyo Rental Map HTML application.
 Embeds GeoJSON data and rental information into a single self-contained HTML file.
 """
+import argparse
+import base64
+import csv
+import importlib.util
+import inspect
 import json
 import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+
+from build_engine import (FragmentCache, content_fingerprint, file_fingerprint, fingerprint,
+                          render_fragments, watch)
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 GEOJSON_PATH = os.path.join(SCRIPT_DIR, "data", "tokyo_municipalities.geojson")
 OUTPUT_PATH = os.path.join(SCRIPT_DIR, "index.html")
+CACHE_DIR = os.path.join(SCRIPT_DIR, ".build-cache")
+NATIONWIDE_OUTPUT_DIR = os.path.join(SCRIPT_DIR, "dist")
+RENT_CSV_PATH = os.path.join(SCRIPT_DIR, os.pardir, "data", "rent_avg.csv")
+RANKING_SIZE = 10
+# Initial map view (center, zoom) of the nationwide shell page.
+NATIONWIDE_VIEW = ((36.5, 138.0), 6)
+# Shared pipeline modules (TopoJSON encoder, ...) live in the repo's scripts/ directory.
+PIPELINE_DIR = os.path.join(SCRIPT_DIR, os.pardir, "scripts")
+# Pipeline modules behind the geometry fragment and behind the data/stats
+# fragments; their files are part of the fragment keys and watched by --watch.
+GEOMETRY_SOURCES = ("topojson_codec.py", "simplify.py", "snapshot.py", "geometry_store.py", "json_stream.py")
+STATS_SOURCES = ("rent_stats.py", "classify.py")
+# Leading bytes of a pipeline snapshot (scripts/snapshot.py MAGIC), checked
+# here so that GeoJSON input does not import snapshot (and NumPy).
+SNAPSHOT_MAGIC = b"RENTSNP1"
+
+GEOMETRY_FORMATS = ("geojson", "topojson", "compact")
+# Leaflet renderers; with several, the first is written to --output and the
+# others next to it as <name>.<renderer>.html.
+RENDERERS = ("svg", "canvas")
+TOPOLOGY_OBJECT = "municipalities"
+# Fixed-point scale of the compact format: 1e-6 degrees is about 0.1 m.
+COMPACT_SCALE = 1_000_000
+# Rent class breaks; mirrors scripts/classify.py METHODS so that parsing the
+# arguments does not import classify (and NumPy).
+CLASSIFICATION_METHODS = ("quantile", "jenks", "equal")
+DEFAULT_CLASSIFICATION = "quantile"
+# Leaflet path styles; the page receives them resolved per color class.
+LAYER_STYLE = {"weight": 1.5, "opacity": 1, "color": "rgba(200, 200, 255, 0.4)", "fillOpacity": 0.65}
+HIGHLIGHT_STYLE = {"weight": 3, "color": "#fff", "fillOpacity": 0.85}
+NO_DATA_COLOR = "#333"
+
+# Inverse of scripts/topojson_codec.py: rebuilds the FeatureCollection from the
+# quantized, delta-encoded shared arcs.
+TOPOJSON_DECODER_JS = """function decodeTopology(topology, name) {
+  const [kx, ky] = topology.transform.scale;
+  const [tx, ty] = topology.transform.translate;
+  const arcs = topology.arcs.map(arc => {
+    let x = 0, y = 0;
+    return arc.map(([dx, dy]) => [(x += dx) * kx + tx, (y += dy) * ky + ty]);
+  });
+  const ring = refs => {
+    const out = [];
+    refs.forEach(ref => {
+      const points = ref >= 0 ? arcs[ref] : arcs[~ref].slice().reverse();
+      for (let i = out.length ? 1 : 0; i < points.length; i++) out.push(points[i]);
+    });
+    return out;
+  };
+  const geometry = g =>
+    g.type === 'Polygon' ? { type: 'Polygon', coordinates: g.arcs.map(ring) } :
+    g.type === 'MultiPolygon' ? { type: 'MultiPolygon', coordinates: g.arcs.map(p => p.map(ring)) } :
+    null;
+  return {
+    type: 'FeatureCollection',
+    features: topology.objects[name].geometries.map(g => ({
+      type: 'Feature', properties: g.properties, geometry: geometry(g)
+    }))
+  };
+}
+"""
+
+# Inverse of encode_compact(): one base64 Int32Array holding, per feature, the
+# polygon count, then per polygon the ring count, then per ring the point
+# count followed by fixed-point deltas.
+COMPACT_DECODER_JS = """function decodeCompactGeometry(packed) {
+  const raw = atob(packed.data);
+  const bytes = new Uint8Array(raw.length);
+  for (let i = 0; i < raw.length; i++) bytes[i] = raw.charCodeAt(i);
+  const ints = new Int32Array(bytes.buffer);
+  const scale = packed.scale;
+  let p = 0;
+  const ring = () => {
+    const n = ints[p++], out = new Array(n);
+    let x = 0, y = 0;
+    for (let i = 0; i < n; i++) {
+      x += ints[p++];
+      y += ints[p++];
+      out[i] = [x / scale, y / scale];
+    }
+    return out;
+  };
+  const polygon = () => {
+    const n = ints[p++], out = new Array(n);
+    for (let i = 0; i < n; i++) out[i] = ring();
+    return out;
+  };
+  const features = packed.properties.map((properties, f) => {
+    const n = ints[p++], polygons = new Array(n);
+    for (let i = 0; i < n; i++) polygons[i] = polygon();
+    const type = packed.types[f];
+    const geometry =
+      type === 'P' ? { type: 'Polygon', coordinates: polygons[0] } :
+      type === 'M' ? { type: 'MultiPolygon', coordinates: polygons } :
+      null;
+    return { type: 'Feature', properties, geometry };
+  });
+  return { type: 'FeatureCollection', features };
+}
+"""
+
+# Nationwide shell page: fetches the chunks of every prefecture whose bbox
+# intersects the viewport (once) and merges them into the map. Ranks and
+# stats are national and precomputed, so they do not change as chunks load.
+CHUNK_LOADER_JS = """
+const loadedChunks = {};
+
+function loadVisibleChunks() {
+  const view = map.getBounds();
+  Object.entries(chunkManifest.prefectures).forEach(([pref, chunk]) => {
+    if (loadedChunks[pref]) return;
+    const [x0, y0, x1, y1] = chunk.bbox;
+    if (!view.intersects(L.latLngBounds([y0, x0], [y1, x1]))) return;
+    loadedChunks[pref] = Promise.all([
+      fetch(chunk.geometry.path).then(r => r.json()),
+      fetch(chunk.data.path).then(r => r.json())
+    ]).then(([geometry, data]) => {
+      const collection = decodeChunk(geometry);
+      Object.assign(municipalityData, data);
+      tokyoGeoJSON.features.push(...collection.features);
+      geojsonLayer.addData(collection);
+      cullTooltips();
+    }).catch(err => {
+      delete loadedChunks[pref];
+      console.error(`chunk ${pref} failed to load`, err);
+    });
+  });
+}
+
+map.on('moveend', loadVisibleChunks);
+loadVisibleChunks();
+"""
 
 # Tokyo municipality data: rent, population, description, etc.
 # Rent: average monthly rent for 1K/1DK apartment in万円 (ten-thousands of yen)
@@ -494,22 +645,308 @@ MUNICIPALITY_DATA = {
 }
 
 
-def build_html(geojson_data):
+def pipeline_sources(names):
+    """Paths of the pipeline modules ``names`` in ../scripts."""
+    return [os.path.join(PIPELINE_DIR, name) for name in names]
+
+
+def pipeline_module(name):
+    """Import a module from the data pipeline in ../scripts."""
+    if PIPELINE_DIR not in sys.path:
+        sys.path.insert(0, PIPELINE_DIR)
+    try:
+        return __import__(name)
+    except ModuleNotFoundError as exc:
+        if exc.name != "numpy":
+            raise
+        raise SystemExit(f"scripts/{name}.py requires NumPy (pip install numpy)") from exc
+
+
+def has_numpy():
+    """Whether NumPy is installed; without it boundaries are embedded without the geometry store."""
+    return importlib.util.find_spec("numpy") is not None
+
+
+def is_snapshot(path):
+    """Whether ``path`` is a pipeline snapshot (checked without importing NumPy)."""
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC
+    except OSError:
+        return False
+
+
+def encode_compact(geojson_data, scale=COMPACT_SCALE):
+    """Pack boundaries into fixed-point, per-ring delta-encoded int32s.
+
+    Returns the payload read by ``decodeCompactGeometry`` in the page: the
+    coordinate stream as base64, plus geometry types and properties as JSON.
+    """
+    ints = array('i')
+    types = []
+    properties = []
+    for feature in geojson_data["features"]:
+        geometry = feature.get("geometry")
+        properties.append(feature.get("properties", {}))
+        if not geometry or geometry["type"] not in ("Polygon", "MultiPolygon"):
+            types.append("-")
+            ints.append(0)
+            continue
+        polygons = [geometry["coordinates"]] if geometry["type"] == "Polygon" else geometry["coordinates"]
+        types.append(geometry["type"][0])
+        ints.append(len(polygons))
+        for polygon in polygons:
+            ints.append(len(polygon))
+            for ring in polygon:
+                ints.append(len(ring))
+                px = py = 0
+                for point in ring:
+                    qx, qy = round(point[0] * scale), round(point[1] * scale)
+                    ints.append(qx - px)
+                    ints.append(qy - py)
+                    px, py = qx, qy
+    if sys.byteorder == "big":
+        ints.byteswap()
+    return {
+        "scale": scale,
+        "types": "".join(types),
+        "properties": properties,
+        "data": base64.b64encode(ints.tobytes()).decode("ascii"),
+    }
+
+
+def load_collection(path):
+    """Read a GeoJSON FeatureCollection, TopoJSON Topology or pipeline snapshot."""
+    if is_snapshot(path):
+        with pipeline_module("snapshot").Snapshot(Path(path)) as snap:
+            return snap.feature_collection()
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def is_topology(path):
+    """Whether ``path`` is a TopoJSON Topology (its ``type`` is written first)."""
+    if is_snapshot(path):
+        return False
+    with open(path, 'rb') as f:
+        head = f.read(4096)
+    return re.search(rb'"type"\s*:\s*"Topology"', head) is not None
+
+
+def geometry_store_path(geojson_path, cache_dir):
+    """Build (when stale) the mmap'd geometry store of ``geojson_path`` in ``cache_dir``.
+
+    GeoJSON is streamed into the store and snapshots are copied level by
+    level, so the input is never loaded as a whole; TopoJSON is decoded
+    first. ``scripts/geometry_store.py`` rebuilds only when the input file
+    changes, so later builds just map the file.
+    """
+    geometry_store = pipeline_module("geometry_store")
+    path = Path(geojson_path)
+    if is_topology(path):
+        def decoded_features():
+            topology = load_collection(path)
+            return pipeline_module("topojson_codec").decode_topology(topology, TOPOLOGY_OBJECT)["features"]
+        sources = {"full": (decoded_features, [path])}
+    else:
+        sources = geometry_store.feature_sources(path)
+    store_path = Path(cache_dir) / "stores" / (fingerprint(os.path.abspath(path)) + geometry_store.STORE_SUFFIX)
+    store_path.parent.mkdir(parents=True, exist_ok=True)
+    geometry_store.ensure_store(store_path, sources, COMPACT_SCALE)
+    return store_path
+
+
+def store_payload_text(store, rows, geometry_format="geojson"):
+    """JSON text of ``geometry_payload`` for ``rows`` of a geometry store.
+
+    GeoJSON and the compact format are written straight from the mapped
+    int32 coordinates (the same text ``json.dumps`` gives for the decoded
+    features); TopoJSON needs the decoded features to find shared arcs.
+    """
+    rows = list(rows)
+    if geometry_format == "topojson":
+        collection = {"type": "FeatureCollection", "features": [store.feature(row) for row in rows]}
+        return json.dumps(geometry_payload(collection, geometry_format), ensure_ascii=False, separators=(',', ':'))
+    if geometry_format == "compact":
+        packed = [store.compact_ints(row) for row in rows]
+        data = b"".join(ints.tobytes() for _, ints in packed)
+        return ('{"scale":' + str(store.scale) + ',"types":' + json.dumps("".join(kind for kind, _ in packed)) +
+                ',"properties":[' + ",".join(store.properties_json(row) for row in rows) + ']' +
+                ',"data":"' + base64.b64encode(data).decode("ascii") + '"}')
+    return '{"type":"FeatureCollection","features":[' + ",".join(store.features_json(rows)) + ']}'
+
+
+def geometry_payload(geojson_data, geometry_format="geojson"):
+    """Convert ``geojson_data`` to the JSON object shipped for ``geometry_format``.
+
+    ``geojson_data`` may be a FeatureCollection or an already encoded
+    TopoJSON Topology.
+    """
+    is_topology = geojson_data.get("type") == "Topology"
+    if geometry_format == "topojson":
+        if is_topology:
+            return geojson_data
+        return pipeline_module("topojson_codec").encode_topology(geojson_data["features"], object_name=TOPOLOGY_OBJECT)
+    if is_topology:
+        geojson_data = pipeline_module("topojson_codec").decode_topology(geojson_data, TOPOLOGY_OBJECT)
+    if geometry_format == "compact":
+        return encode_compact(geojson_data)
+    return geojson_data
+
+
+def geometry_script(geojson_data, geometry_format="geojson"):
+    """Return the JS statement that defines ``tokyoGeoJSON``."""
+    payload_str = json.dumps(geometry_payload(geojson_data, geometry_format),
+                             ensure_ascii=False, separators=(',', ':'))
+    return geometry_statement(payload_str, geometry_format)
+
+
+def geometry_statement(payload_str, geometry_format="geojson"):
+    """Wrap serialized geometry in the statement (and decoder) defining ``tokyoGeoJSON``."""
+    if geometry_format == "topojson":
+        return (TOPOJSON_DECODER_JS +
+                f"const tokyoGeoJSON = decodeTopology({payload_str}, '{TOPOLOGY_OBJECT}');")
+    if geometry_format == "compact":
+        return COMPACT_DECODER_JS + f"const tokyoGeoJSON = decodeCompactGeometry({payload_str});"
+    return f"const tokyoGeoJSON = {payload_str};"
+
+
+def rent_summary(municipality_data, classification=DEFAULT_CLASSIFICATION):
+    """Rankings, stats and color classes computed once at build time.
+
+    Uses ``scripts/rent_stats.py`` and ``scripts/classify.py``. Returns
+    ``(summary, extras)``: the small ``rentStats`` block embedded in the page
+    (count, mean, median, min, max, the top of the ranking, the color
+    ``scheme`` with its legend, the per-class ``styles`` and the rent ``bar``
+    gradient) and each municipality's national ``rank`` and color ``class``
+    (an index into ``scheme.palette``).
+    """
+    codes = list(municipality_data)
+    rents = [municipality_data[code].get("rent") for code in codes]
+    stats = pipeline_module("rent_stats").compute_stats(codes, [code[:2] for code in codes], rents)
+    classes = pipeline_module("classify").classify(codes, rents, classification)
+    ranks = {code: values["rank"] for code, values in stats.ranks.items()}
+    top = sorted(ranks, key=lambda code: (ranks[code], code))[:RANKING_SIZE]
+    national = stats.national
+    summary = {
+        "count": national["count"],
+        "mean": national["mean"],
+        "median": national["median"],
+        "min": national["min"],
+        "max": national["max"],
+        "top": [{"code": code, "name": municipality_data[code]["name"],
+                 "rent": municipality_data[code]["rent"], "rank": ranks[code]} for code in top],
+        "scheme": classes.scheme(),
+    }
+    summary["styles"] = layer_styles(summary["scheme"])
+    summary["bar"] = rent_bar_gradient(summary["scheme"], national["min"], national["max"])
+    extras = {code: {"rank": rank, "class": classes.classes[code]} for code, rank in ranks.items()}
+    return summary, extras
+
+
+def layer_styles(scheme):
+    """Leaflet styles for every color class, so the page never composes a style.
+
+    ``base[class]`` and ``selected[class]`` are complete styles; ``highlight``
+    only overrides the outline and is applied on hover.
+    """
+    base = [{**LAYER_STYLE, "fillColor": color} for color in scheme["palette"]]
+    return {
+        "base": base,
+        "selected": [{**style, **HIGHLIGHT_STYLE} for style in base],
+        "noData": {**LAYER_STYLE, "fillColor": NO_DATA_COLOR},
+        "highlight": HIGHLIGHT_STYLE,
+    }
+
+
+def rent_bar_gradient(scheme, low, high):
+    """CSS gradient of the detail rent bar: every color class over its share of ``low``-``high``.
+
+    The bar spans the national minimum to maximum, so a municipality's fill
+    ends in the class color it has on the map.
+    """
+    if not scheme["legend"] or low is None or high is None or high <= low:
+        return scheme["palette"][-1] if scheme["palette"] else NO_DATA_COLOR
+    stops = []
+    for item in scheme["legend"]:
+        start = (item["min"] - low) / (high - low) * 100
+        end = (item["max"] - low) / (high - low) * 100
+        stops += [f"{item['color']} {start:.2f}%", f"{item['color']} {end:.2f}%"]
+    return f"linear-gradient(90deg, {', '.join(stops)})"
+
+
+def ranked_data(municipality_data, extras):
+    """Attach each municipality's precomputed ``rank`` and color ``class`` to its entry."""
+    return {code: {**entry, **extras[code]} if code in extras else entry
+            for code, entry in municipality_data.items()}
+
+
+def data_fragments(municipality_data, classification=DEFAULT_CLASSIFICATION):
+    """Serialized ``municipalityData`` (with ranks and classes) and ``rentStats``."""
+    summary, extras = rent_summary(municipality_data, classification)
+    return (json.dumps(ranked_data(municipality_data, extras), ensure_ascii=False, indent=2),
+            json.dumps(summary, ensure_ascii=False, separators=(',', ':')))
+
+
+def build_fragments(geojson_data, geometry_format="geojson", classification=DEFAULT_CLASSIFICATION,
+                    renderer="svg"):
+    """Render every page fragment: template parts and embedded payloads."""
+    data, stats = data_fragments(MUNICIPALITY_DATA, classification)
+    return {
+        "css": render_css(),
+        "markup": render_markup(),
+        "app": render_app_js(renderer=renderer),
+        "geometry": geometry_script(geojson_data, geometry_format),
+        "data": data,
+        "stats": stats,
+    }
+
+
+def build_html(geojson_data, geometry_format="geojson", classification=DEFAULT_CLASSIFICATION, renderer="svg"):
     """Build the complete HTML application."""
+    return render_html(build_fragments(geojson_data, geometry_format, classification, renderer))
+
+
+def render_html(fragments, region="東京都"):
+    """Assemble the page around pre-serialized fragments.
 
-    geojson_str = json.dumps(geojson_data, ensure_ascii=False, separators=(',', ':'))
-    data_str = json.dumps(MUNICIPALITY_DATA, ensure_ascii=False, indent=2)
+    ``fragments`` holds the ``css``, ``markup`` and ``app`` template parts and
+    the ``geometry`` / ``data`` / ``stats`` payloads (see ``build_fragments``).
+    """
+    css = fragments["css"]
+    markup = fragments["markup"]
+    geometry_js = fragments["geometry"]
+    data_str = fragments["data"]
+    stats_str = fragments["stats"]
+    app_js = fragments["app"]
 
-    html = f'''<!DOCTYPE html>
+    return f'''<!DOCTYPE html>
 <html lang="ja">
 <head>
 <meta charset="UTF-8">
 <meta name="viewport" content="width=device-width, initial-scale=1.0">
-<title>東京都 市区町村別 平均賃貸マップ</title>
+<title>{region} 市区町村別 平均賃貸マップ</title>
 <link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css" />
 <script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
 <style>
-  * {{ margin: 0; padding: 0; box-sizing: border-box; }}
+{css}
+</style>
+</head>
+<body>
+{markup}
+<script>
+{geometry_js}
+const municipalityData = {data_str};
+const rentStats = {stats_str};
+{app_js}
+</script>
+</body>
+</html>'''
+
+
+def render_css():
+    """Page stylesheet (contents of the <style> element)."""
+    return f'''  * {{ margin: 0; padding: 0; box-sizing: border-box; }}
 
   body {{
     font-family: 'Helvetica Neue', Arial, 'Hiragino Kaku Gothic ProN', 'Hiragino Sans', Meiryo, sans-serif;
@@ -968,15 +1405,16 @@ def build_html(geojson_data):
     font-size: 11px;
     color: #888;
     white-space: nowrap;
-  }}
-</style>
-</head>
-<body>
+  }}'''
+
 
+def render_markup(region="東京都", heading="TOKYO"):
+    """Static body markup: header, map container, sidebar and mobile panel."""
+    return f'''
 <div id="header">
   <div style="display:flex;align-items:center;">
-    <h1><span>TOKYO</span> RENTAL MAP</h1>
-    <span class="subtitle">東京都 市区町村別 平均賃貸マップ（1K/1DK）</span>
+    <h1><span>{heading}</span> RENTAL MAP</h1>
+    <span class="subtitle">{region} 市区町村別 平均賃貸マップ（1K/1DK）</span>
   </div>
   <div style="font-size:11px;color:#666;">Data: 2024 | Source: 国土数値情報</div>
 </div>
@@ -1029,8 +1467,8 @@ def build_html(geojson_data):
           <div class="rent-bar-fill" id="rent-bar-fill"></div>
         </div>
         <div class="rent-bar-labels">
-          <span>3.5万</span>
-          <span>13.5万</span>
+          <span id="rent-bar-min">--</span>
+          <span id="rent-bar-max">--</span>
         </div>
       </div>
     </div>
@@ -1076,120 +1514,69 @@ def build_html(geojson_data):
   <div class="mobile-handle"></div>
   <div id="mobile-content"></div>
 </div>
-
-<script>
-const tokyoGeoJSON = {geojson_str};
-const municipalityData = {data_str};
-
-// Calculate rankings
-const rentEntries = Object.entries(municipalityData)
-  .map(([code, d]) => ({{ code, name: d.name, rent: d.rent }}))
-  .sort((a, b) => b.rent - a.rent);
-
-const rankMap = {{}};
-rentEntries.forEach((entry, i) => {{
-  rankMap[entry.code] = i + 1;
-}});
-
-// Calculate stats
-const rents = Object.values(municipalityData).map(d => d.rent);
-const avgRent = (rents.reduce((a, b) => a + b, 0) / rents.length).toFixed(1);
-const maxRent = Math.max(...rents).toFixed(1);
-const minRent = Math.min(...rents).toFixed(1);
-
-document.getElementById('stat-avg').textContent = avgRent;
-document.getElementById('stat-max').textContent = maxRent;
-document.getElementById('stat-min').textContent = minRent;
-
-// Color scale
-function getRentColor(rent) {{
-  if (rent >= 12.0) return '#ff4757';
-  if (rent >= 10.0) return '#ff6b81';
-  if (rent >= 8.5) return '#ffa502';
-  if (rent >= 7.0) return '#ffd43b';
-  if (rent >= 6.0) return '#7bed9f';
-  if (rent >= 5.0) return '#2ed573';
-  if (rent >= 4.0) return '#1e90ff';
-  return '#5352ed';
+'''
+
+
+def render_app_js(center=(35.68, 139.55), zoom=11, renderer="svg"):
+    """Client application: rankings, legend, map layer and detail panel.
+
+    Rankings and stats come precomputed from the build (``rentStats`` and
+    each entry's ``rank``); nothing is sorted or reduced in the browser.
+    ``renderer`` is ``svg`` (one DOM path per municipality) or ``canvas``
+    (Leaflet's ``preferCanvas``: every polygon drawn on one canvas).
+    """
+    return f'''
+const MAP_RENDERER = '{renderer}';
+
+// Stats (precomputed by build.py)
+if (rentStats.count) {{
+  document.getElementById('stat-areas').textContent = rentStats.count;
+  document.getElementById('stat-avg').textContent = rentStats.mean.toFixed(1);
+  document.getElementById('stat-max').textContent = rentStats.max.toFixed(1);
+  document.getElementById('stat-min').textContent = rentStats.min.toFixed(1);
+  document.getElementById('rent-bar-min').textContent = rentStats.min.toFixed(1) + '万';
+  document.getElementById('rent-bar-max').textContent = rentStats.max.toFixed(1) + '万';
 }}
 
-function getRentGradient(rent) {{
-  const ratio = (rent - 3.5) / (13.5 - 3.5);
-  const clamped = Math.max(0, Math.min(1, ratio));
-
-  const colors = [
-    {{ pos: 0.0, r: 83, g: 82, b: 237 }},
-    {{ pos: 0.15, r: 30, g: 144, b: 255 }},
-    {{ pos: 0.3, r: 46, g: 213, b: 115 }},
-    {{ pos: 0.5, r: 123, g: 237, b: 159 }},
-    {{ pos: 0.65, r: 255, g: 212, b: 59 }},
-    {{ pos: 0.8, r: 255, g: 165, b: 2 }},
-    {{ pos: 0.9, r: 255, g: 107, b: 129 }},
-    {{ pos: 1.0, r: 255, g: 71, b: 87 }}
-  ];
-
-  let lower = colors[0], upper = colors[colors.length - 1];
-  for (let i = 0; i < colors.length - 1; i++) {{
-    if (clamped >= colors[i].pos && clamped <= colors[i + 1].pos) {{
-      lower = colors[i];
-      upper = colors[i + 1];
-      break;
-    }}
-  }}
-
-  const range = upper.pos - lower.pos;
-  const t = range === 0 ? 0 : (clamped - lower.pos) / range;
-  const r = Math.round(lower.r + (upper.r - lower.r) * t);
-  const g = Math.round(lower.g + (upper.g - lower.g) * t);
-  const b = Math.round(lower.b + (upper.b - lower.b) * t);
-
-  return `rgb(${{r}},${{g}},${{b}})`;
+// Color classes (precomputed by build.py with scripts/classify.py)
+function rentColor(data) {{
+  return data && data.class !== undefined ? rentStats.scheme.palette[data.class] : rentStats.styles.noData.fillColor;
 }}
 
-// Build legend
-const legendData = [
-  {{ label: '12.0万円以上', color: '#ff4757' }},
-  {{ label: '10.0 - 11.9万円', color: '#ff6b81' }},
-  {{ label: '8.5 - 9.9万円', color: '#ffa502' }},
-  {{ label: '7.0 - 8.4万円', color: '#ffd43b' }},
-  {{ label: '6.0 - 6.9万円', color: '#7bed9f' }},
-  {{ label: '5.0 - 5.9万円', color: '#2ed573' }},
-  {{ label: '4.0 - 4.9万円', color: '#1e90ff' }},
-  {{ label: '3.9万円以下', color: '#5352ed' }}
-];
-
+// Build legend, highest class first
 const legendEl = document.getElementById('legend');
-legendData.forEach(item => {{
+rentStats.scheme.legend.slice().reverse().forEach(item => {{
   const div = document.createElement('div');
   div.className = 'legend-item';
-  div.innerHTML = `<div class="legend-color" style="background:${{item.color}}"></div>${{item.label}}`;
+  div.innerHTML = `<div class="legend-color" style="background:${{item.color}}"></div>` +
+    `${{item.min.toFixed(1)}} - ${{item.max.toFixed(1)}}万円`;
   legendEl.appendChild(div);
 }});
 
 // Build ranking list
 const rankingList = document.getElementById('ranking-list');
-rentEntries.slice(0, 10).forEach((entry, i) => {{
+rentStats.top.forEach((entry, i) => {{
   const div = document.createElement('div');
   div.className = 'ranking-item';
   const numClass = i === 0 ? 'gold' : i === 1 ? 'silver' : i === 2 ? 'bronze' : '';
   div.innerHTML = `
-    <div class="ranking-num ${{numClass}}">${{i + 1}}</div>
+    <div class="ranking-num ${{numClass}}">${{entry.rank}}</div>
     <div class="ranking-name">${{entry.name}}</div>
     <div class="ranking-rent">${{entry.rent}}万円</div>
   `;
   div.addEventListener('click', () => {{
-    const feat = tokyoGeoJSON.features.find(f => f.properties.code === entry.code);
-    if (feat) showDetail(entry.code);
+    if (layersByCode[entry.code]) showDetail(entry.code);
   }});
   rankingList.appendChild(div);
 }});
 
 // Initialize map
 const map = L.map('map', {{
-  center: [35.68, 139.55],
-  zoom: 11,
+  center: [{center[0]}, {center[1]}],
+  zoom: {zoom},
   zoomControl: true,
-  attributionControl: true
+  attributionControl: true,
+  preferCanvas: MAP_RENDERER === 'canvas'
 }});
 
 L.tileLayer('https://{{s}}.basemaps.cartocdn.com/dark_all/{{z}}/{{x}}/{{y}}{{r}}.png', {{
@@ -1203,53 +1590,65 @@ document.querySelector('.leaflet-tile-pane').style.filter = 'none';
 
 let selectedCode = null;
 let geojsonLayer = null;
+// code -> layer, filled as features are added (chunks included).
+const layersByCode = {{}};
 
-function getStyle(feature) {{
-  const code = feature.properties.code;
+// Styles are precomputed per color class (rentStats.styles); this only picks one.
+function styleFor(code) {{
   const data = municipalityData[code];
-  const rent = data ? data.rent : 0;
-  const isSelected = code === selectedCode;
-
-  return {{
-    fillColor: data ? getRentGradient(rent) : '#333',
-    weight: isSelected ? 3 : 1.5,
-    opacity: 1,
-    color: isSelected ? '#fff' : 'rgba(200, 200, 255, 0.4)',
-    fillOpacity: isSelected ? 0.85 : 0.65,
-    dashArray: isSelected ? '' : ''
-  }};
+  if (!data || data.class === undefined) return rentStats.styles.noData;
+  return (code === selectedCode ? rentStats.styles.selected : rentStats.styles.base)[data.class];
+}}
+
+function getStyle(feature) {{
+  return styleFor(feature.properties.code);
+}}
+
+// Restyle only the layers whose selection changed instead of every polygon.
+function selectCode(code) {{
+  const previous = selectedCode;
+  selectedCode = code;
+  if (previous !== null && previous !== code && layersByCode[previous]) {{
+    layersByCode[previous].setStyle(styleFor(previous));
+  }}
+  if (code !== null && layersByCode[code]) {{
+    layersByCode[code].setStyle(styleFor(code));
+  }}
 }}
 
 function showDetail(code) {{
   const data = municipalityData[code];
   if (!data) return;
 
-  const rank = rankMap[code];
+  const rank = data.rank;
   const rankEl = document.getElementById('detail-rank');
-  rankEl.textContent = `RANK #${{rank}} / ${{rentEntries.length}}`;
+  rankEl.textContent = `RANK #${{rank}} / ${{rentStats.count}}`;
   rankEl.className = 'detail-rank' + (rank <= 3 ? ' top3' : rank <= 10 ? ' top10' : '');
 
   document.getElementById('detail-name').textContent = data.name;
   document.getElementById('detail-rent').innerHTML = `${{data.rent}}<small> 万円/月</small>`;
-  document.getElementById('detail-description').textContent = data.description;
+  document.getElementById('detail-description').textContent = data.description || '';
 
-  // Rent bar
-  const ratio = ((data.rent - 3.5) / (13.5 - 3.5)) * 100;
+  // Rent bar: national min to max; the class gradient is sized to the whole
+  // track so the fill ends in this municipality's map color.
+  const span = rentStats.max - rentStats.min;
+  const ratio = Math.min(100, Math.max(0, span > 0 ? ((data.rent - rentStats.min) / span) * 100 : 100));
   const barFill = document.getElementById('rent-bar-fill');
   barFill.style.width = ratio + '%';
-  barFill.style.background = `linear-gradient(90deg, #5352ed, ${{getRentGradient(data.rent)}})`;
+  barFill.style.background = rentStats.bar;
+  barFill.style.backgroundSize = ratio > 0 ? `${{10000 / ratio}}% 100%` : '';
 
   // Info grid
   const infoGrid = document.getElementById('detail-info-grid');
-  const density = (data.population / data.area_km2).toFixed(0);
+  const density = data.population && data.area_km2 ? (data.population / data.area_km2).toFixed(0) : 0;
   infoGrid.innerHTML = `
     <div class="detail-info-card">
       <div class="detail-info-label">人口</div>
-      <div class="detail-info-value">${{data.population.toLocaleString()}}人</div>
+      <div class="detail-info-value">${{data.population ? data.population.toLocaleString() + '人' : '-'}}</div>
     </div>
     <div class="detail-info-card">
       <div class="detail-info-label">面積</div>
-      <div class="detail-info-value">${{data.area_km2}}km&sup2;</div>
+      <div class="detail-info-value">${{data.area_km2 ? data.area_km2 + 'km&sup2;' : '-'}}</div>
     </div>
     <div class="detail-info-card">
       <div class="detail-info-label">人口密度</div>
@@ -1257,7 +1656,7 @@ function showDetail(code) {{
     </div>
     <div class="detail-info-card">
       <div class="detail-info-label">家賃ランク</div>
-      <div class="detail-info-value">${{rank}}位 / ${{rentEntries.length}}</div>
+      <div class="detail-info-value">${{rank}}位 / ${{rentStats.count}}</div>
     </div>
   `;
 
@@ -1277,12 +1676,12 @@ function showDetail(code) {{
   document.getElementById('density-label').textContent = `${{Number(density).toLocaleString()}}人/km²`;
 
   // Stations
-  document.getElementById('detail-stations').textContent = data.stations;
+  document.getElementById('detail-stations').textContent = data.stations || '-';
 
   // Highlights
   const tagsEl = document.getElementById('detail-highlights');
   tagsEl.innerHTML = '';
-  data.highlights.split(', ').forEach(tag => {{
+  (data.highlights || '').split(', ').filter(Boolean).forEach(tag => {{
     const span = document.createElement('span');
     span.className = 'detail-tag';
     span.textContent = tag;
@@ -1295,50 +1694,29 @@ function showDetail(code) {{
   // Scroll to top of sidebar
   document.getElementById('sidebar').scrollTop = 0;
 
-  selectedCode = code;
-  if (geojsonLayer) geojsonLayer.setStyle(getStyle);
+  selectCode(code);
 }}
 
 function closeSidebar() {{
   document.getElementById('sidebar-default').style.display = 'block';
   document.getElementById('sidebar-detail').style.display = 'none';
-  selectedCode = null;
-  if (geojsonLayer) geojsonLayer.setStyle(getStyle);
+  selectCode(null);
 }}
 
 function onEachFeature(feature, layer) {{
   const code = feature.properties.code;
-  const data = municipalityData[code];
-
-  if (data) {{
-    const rank = rankMap[code];
-    layer.bindTooltip(
-      `<div style="font-weight:700;font-size:13px;">${{data.name}}</div>` +
-      `<div style="color:#6c8cff;font-size:15px;font-weight:800;">${{data.rent}}万円<span style="font-size:11px;color:#888;">/月</span></div>` +
-      `<div style="font-size:11px;color:#999;">ランキング: ${{rank}}位</div>`,
-      {{
-        sticky: true,
-        direction: 'top',
-        className: 'custom-tooltip',
-        offset: [0, -10]
-      }}
-    );
-  }}
+  layersByCode[code] = layer;
 
   layer.on({{
     mouseover: function(e) {{
       if (code !== selectedCode) {{
-        this.setStyle({{
-          weight: 3,
-          color: '#fff',
-          fillOpacity: 0.85
-        }});
+        this.setStyle(rentStats.styles.highlight);
         this.bringToFront();
       }}
     }},
     mouseout: function(e) {{
       if (code !== selectedCode) {{
-        geojsonLayer.resetStyle(this);
+        this.setStyle(styleFor(code));
       }}
     }},
     click: function(e) {{
@@ -1352,6 +1730,33 @@ geojsonLayer = L.geoJSON(tokyoGeoJSON, {{
   onEachFeature: onEachFeature
 }}).addTo(map);
 
+// Tooltips are bound only to the layers in view and rebound as the map moves.
+const TOOLTIP_OPTIONS = {{
+  sticky: true,
+  direction: 'top',
+  className: 'custom-tooltip',
+  offset: [0, -10]
+}};
+
+function tooltipHtml(data) {{
+  return `<div style="font-weight:700;font-size:13px;">${{data.name}}</div>` +
+    `<div style="color:#6c8cff;font-size:15px;font-weight:800;">${{data.rent}}万円<span style="font-size:11px;color:#888;">/月</span></div>` +
+    `<div style="font-size:11px;color:#999;">ランキング: ${{data.rank}}位</div>`;
+}}
+
+function cullTooltips() {{
+  const view = map.getBounds().pad(0.2);
+  Object.entries(layersByCode).forEach(([code, layer]) => {{
+    const data = municipalityData[code];
+    const visible = data && view.intersects(layer.getBounds());
+    if (visible && !layer.getTooltip()) layer.bindTooltip(tooltipHtml(data), TOOLTIP_OPTIONS);
+    else if (!visible && layer.getTooltip()) layer.unbindTooltip();
+  }});
+}}
+
+map.on('moveend', cullTooltips);
+cullTooltips();
+
 // Add custom tooltip styles
 const tooltipStyle = document.createElement('style');
 tooltipStyle.textContent = `
@@ -1373,28 +1778,465 @@ tooltipStyle.textContent = `
   }}
 `;
 document.head.appendChild(tooltipStyle);
-</script>
-</body>
-</html>'''
-    return html
 
+// Restyle benchmark: open the page with ?bench and read the console. Times a
+// click restyling every polygon against restyling only the previous and the
+// new selection.
+function benchmarkRestyle(clicks = 100) {{
+  const codes = Object.keys(layersByCode).filter(code => municipalityData[code]);
+  if (!codes.length) return null;
+  const measure = restyle => {{
+    const samples = [];
+    for (let i = 0; i < clicks; i++) {{
+      const code = codes[(i * 7919) % codes.length];
+      const started = performance.now();
+      restyle(code);
+      samples.push(performance.now() - started);
+    }}
+    samples.sort((a, b) => a - b);
+    return {{
+      mean: samples.reduce((sum, ms) => sum + ms, 0) / samples.length,
+      p95: samples[Math.min(samples.length - 1, Math.floor(samples.length * 0.95))]
+    }};
+  }};
+  const previous = selectedCode;
+  const every = measure(code => {{
+    selectedCode = code;
+    geojsonLayer.setStyle(getStyle);
+  }});
+  const dirty = measure(selectCode);
+  selectedCode = null;
+  geojsonLayer.setStyle(getStyle);
+  selectCode(previous);
+  console.log(`${{document.title}} [${{MAP_RENDERER}}]: restyle per click over ${{codes.length}} layers: ` +
+    `every layer ${{every.mean.toFixed(3)}} ms (p95 ${{every.p95.toFixed(3)}}), ` +
+    `changed layers only ${{dirty.mean.toFixed(3)}} ms (p95 ${{dirty.p95.toFixed(3)}})`);
+  return {{ layers: codes.length, clicks, every, dirty }};
+}}
+
+// Frame times while panning, JS heap (Chromium only) and DOM size, to compare
+// the svg and canvas builds of the same page.
+function benchmarkFrames(steps = 60) {{
+  return new Promise(resolve => {{
+    const frames = [];
+    let last = null;
+    let step = 0;
+    const tick = now => {{
+      if (last !== null) frames.push(now - last);
+      last = now;
+      if (step++ < steps) {{
+        map.panBy([step % 2 ? 40 : -40, 0], {{ animate: false }});
+        requestAnimationFrame(tick);
+        return;
+      }}
+      frames.sort((a, b) => a - b);
+      const result = {{
+        renderer: MAP_RENDERER,
+        frameMean: frames.reduce((sum, ms) => sum + ms, 0) / frames.length,
+        frameP95: frames[Math.min(frames.length - 1, Math.floor(frames.length * 0.95))],
+        heapMB: performance.memory ? performance.memory.usedJSHeapSize / 1048576 : null,
+        domNodes: document.getElementsByTagName('*').length
+      }};
+      console.log(`${{document.title}} [${{MAP_RENDERER}}]: frame ${{result.frameMean.toFixed(1)}} ms ` +
+        `(p95 ${{result.frameP95.toFixed(1)}}) while panning, heap ` +
+        `${{result.heapMB === null ? 'n/a' : result.heapMB.toFixed(1) + ' MB'}}, ${{result.domNodes}} DOM nodes`);
+      resolve(result);
+    }};
+    requestAnimationFrame(tick);
+  }});
+}}
+
+if (new URLSearchParams(location.search).has('bench')) {{
+  // The nationwide page first waits for the chunks in view.
+  window.addEventListener('load', () => setTimeout(() => {{
+    const pending = typeof loadedChunks === 'undefined' ? [] : Object.values(loadedChunks);
+    Promise.all(pending).then(() => {{
+      benchmarkRestyle();
+      return benchmarkFrames();
+    }});
+  }}, 0));
+}}'''
+
+
+def feature_count(geojson_data):
+    if geojson_data.get("type") == "Topology":
+        return len(geojson_data["objects"][TOPOLOGY_OBJECT]["geometries"])
+    return len(geojson_data["features"])
+
+
+def utf8_size(text):
+    return len(text.encode("utf-8"))
+
+
+def compare_parse_times(geojson_data, runs=20):
+    """Time evaluating each geometry format's script with Node.js.
+
+    Returns ``{format: (bytes, milliseconds per evaluation)}``, or ``None``
+    when ``node`` is not installed.
+    """
+    node = shutil.which("node")
+    if not node:
+        return None
+    harness = """
+const fs = require('fs');
+const src = fs.readFileSync(process.argv[2], 'utf8');
+const runs = Number(process.argv[3]);
+const evaluate = () => new Function(src + '\\nreturn tokyoGeoJSON;')();
+evaluate();
+const t0 = performance.now();
+for (let i = 0; i < runs; i++) evaluate();
+console.log((performance.now() - t0) / runs);
+"""
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        harness_path = os.path.join(tmp, "harness.js")
+        with open(harness_path, "w", encoding="utf-8") as f:
+            f.write(harness)
+        for geometry_format in GEOMETRY_FORMATS:
+            script = geometry_script(geojson_data, geometry_format)
+            script_path = os.path.join(tmp, f"{geometry_format}.js")
+            with open(script_path, "w", encoding="utf-8") as f:
+                f.write(script)
+            out = subprocess.run([node, harness_path, script_path, str(runs)],
+                                 check=True, capture_output=True, text=True).stdout
+            results[geometry_format] = (utf8_size(script), float(out))
+    return results
+
+
+def fragment_specs(geojson_path, geometry_format="geojson", cache_dir=CACHE_DIR,
+                   classification=DEFAULT_CLASSIFICATION, renderers=("svg",)):
+    """Map every page fragment to ``(fingerprint, builder)`` for the incremental build.
+
+    The application script is one fragment per renderer (``app.<renderer>``).
+    """
+    geometry_key = fingerprint(
+        file_fingerprint(geojson_path), geometry_format, COMPACT_SCALE,
+        TOPOJSON_DECODER_JS, COMPACT_DECODER_JS,
+        inspect.getsource(geometry_payload), inspect.getsource(geometry_statement),
+        inspect.getsource(encode_compact), inspect.getsource(store_payload_text),
+        *(file_fingerprint(path) for path in pipeline_sources(GEOMETRY_SOURCES) if os.path.exists(path)))
+
+    def build_geometry():
+        # The store needs NumPy; both paths write the same text.
+        if (geometry_format == "topojson" and is_topology(geojson_path)) or not has_numpy():
+            return geometry_script(load_collection(geojson_path), geometry_format)
+        geometry_store = pipeline_module("geometry_store")
+        with geometry_store.GeometryStore(geometry_store_path(geojson_path, cache_dir)) as store:
+            return geometry_statement(store_payload_text(store, range(len(store)), geometry_format),
+                                      geometry_format)
+
+    data_key = fingerprint(repr(MUNICIPALITY_DATA), classification, inspect.getsource(rent_summary),
+                           inspect.getsource(ranked_data), inspect.getsource(data_fragments),
+                           inspect.getsource(layer_styles), inspect.getsource(rent_bar_gradient), repr((LAYER_STYLE, HIGHLIGHT_STYLE, NO_DATA_COLOR)),
+                           *(file_fingerprint(path) for path in pipeline_sources(STATS_SOURCES)
+                             if os.path.exists(path)))
+    # "data" and "stats" share one rent_summary run, whichever builder asks first.
+    data_lock = threading.Lock()
+    data_parts = []
+
+    def data_part(index):
+        with data_lock:
+            if not data_parts:
+                data_parts.extend(data_fragments(MUNICIPALITY_DATA, classification))
+        return data_parts[index]
+
+    return {
+        "css": (fingerprint(inspect.getsource(render_css)), render_css),
+        "markup": (fingerprint(inspect.getsource(render_markup)), render_markup),
+        "geometry": (geometry_key, build_geometry),
+        "data": (fingerprint("data", data_key), partial(data_part, 0)),
+        "stats": (fingerprint("stats", data_key), partial(data_part, 1)),
+        **{f"app.{renderer}": (fingerprint(inspect.getsource(render_app_js), renderer),
+                                partial(render_app_js, renderer=renderer))
+           for renderer in renderers},
+    }
+
+
+def renderer_outputs(output, renderers):
+    """``{renderer: path}``: the first renderer writes ``output``, the others sit next to it."""
+    stem, ext = os.path.splitext(output)
+    return {renderer: output if i == 0 else f"{stem}.{renderer}{ext}" for i, renderer in enumerate(renderers)}
+
+
+def run_build(args):
+    """Build ``args.output``, re-rendering only the fragments whose inputs changed."""
+    started = time.perf_counter()
+    cache = FragmentCache(args.cache_dir)
+    specs = fragment_specs(args.geojson, args.geometry_format, args.cache_dir, args.classification, args.renderers)
+    fingerprint_seconds = time.perf_counter() - started
+
+    fragments, stages = render_fragments(specs, cache, jobs=args.jobs)
+
+    assemble_started = time.perf_counter()
+    outputs = renderer_outputs(args.output, args.renderers)
+    shared = sorted(name for name in specs if not name.startswith("app."))
+    written = []
+    for renderer, output in outputs.items():
+        app = f"app.{renderer}"
+        page_key = fingerprint(os.path.abspath(output), inspect.getsource(render_html),
+                               *(specs[name][0] for name in [*shared, app]))
+        # The marker holds the digest of the page as written, so a page replaced
+        # since (a checkout, a build from another revision) is written again.
+        marker = cache.load(f"page.{renderer}", page_key)
+        if marker is not None and marker == content_fingerprint(output):
+            continue
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(render_html({**{name: fragments[name] for name in shared}, "app": fragments[app]}))
+        cache.store(f"page.{renderer}", page_key, content_fingerprint(output))
+        written.append(output)
+    assemble_seconds = time.perf_counter() - assemble_started
+
+    geometry_size = utf8_size(fragments["geometry"])
+    data_size = utf8_size(fragments["data"])
+    stats_size = utf8_size(fragments["stats"])
+    elapsed = time.perf_counter() - started
+    for renderer, output in outputs.items():
+        total = os.path.getsize(output)
+        print(f"{'Generated' if output in written else 'Up to date'} {output} ({renderer}) in {elapsed * 1000:.1f} ms")
+        print(f"  Municipality data entries: {len(MUNICIPALITY_DATA)}")
+        print(f"  File size: {total:,} bytes")
+        print(f"    geometry ({args.geometry_format}): {geometry_size:,} bytes")
+        print(f"    data: {data_size:,} bytes")
+        print(f"    stats: {stats_size:,} bytes")
+        print(f"    markup/css/js: {total - geometry_size - data_size - stats_size:,} bytes")
+    print("  Stages:")
+    print(f"    {'fingerprint':<11} {'':<7} {fingerprint_seconds * 1000:8.1f} ms")
+    for name, (status, seconds) in stages.items():
+        print(f"    {name:<11} {status:<7} {seconds * 1000:8.1f} ms")
+    print(f"    {'assemble':<11} {'written' if written else 'skipped':<7} {assemble_seconds * 1000:8.1f} ms")
+
+
+def prefecture_code(feature):
+    props = feature.get("properties", {})
+    return str(props.get("prefecture_code") or props.get("code", ""))[:2]
+
+
+def load_rent_map(path):
+    """Read ``municipality_code, rent_avg`` (yen) from fetch_rent_data.py as 万円.
+
+    ``path`` is the CSV or its columnar snapshot.
+    """
+    if is_snapshot(path):
+        rents = pipeline_module("snapshot").load_rent(Path(path))
+    else:
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            rents = {row["municipality_code"]: float(row["rent_avg"]) for row in csv.DictReader(f)}
+    return {code: round(rent / 10000, 1) for code, rent in rents.items()}
+
+
+def municipality_entry(feature, rent_map):
+    """Sidebar data for one municipality; curated Tokyo entries take precedence."""
+    props = feature.get("properties", {})
+    code = props.get("code")
+    if code in MUNICIPALITY_DATA:
+        return MUNICIPALITY_DATA[code]
+    if code not in rent_map:
+        return None
+    return {
+        "name": props.get("name", code),
+        "rent": rent_map[code],
+        "population": props.get("population"),
+        "area_km2": props.get("area_km2"),
+    }
 
-def main():
-    # Load GeoJSON
-    with open(GEOJSON_PATH, 'r', encoding='utf-8') as f:
-        geojson_data = json.load(f)
 
-    # Build HTML
-    html_content = build_html(geojson_data)
+def write_text(path, text):
+    """Write ``text`` and return its size in bytes."""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    return utf8_size(text)
+
+
+def write_json(path, value):
+    """Write compact JSON and return its size in bytes."""
+    return write_text(path, json.dumps(value, ensure_ascii=False, separators=(',', ':')))
+
+
+def build_prefecture_chunk(job):
+    """Write the geometry and data chunks of one prefecture (runs in a worker process).
+
+    Workers map the geometry store themselves and only receive row numbers.
+    """
+    pref, store_path, rows, data, geometry_format, output_dir = job
+    geometry_path = f"chunks/{pref}.geometry.json"
+    data_path = f"chunks/{pref}.data.json"
+    with pipeline_module("geometry_store").GeometryStore(store_path) as store:
+        geometry_bytes = write_text(os.path.join(output_dir, geometry_path),
+                                    store_payload_text(store, rows, geometry_format))
+        bbox = store.bbox(rows)
+    data_bytes = write_json(os.path.join(output_dir, data_path), data)
+    return pref, {
+        "bbox": bbox,
+        "features": len(rows),
+        "municipalities": len(data),
+        "geometry": {"path": geometry_path, "bytes": geometry_bytes},
+        "data": {"path": data_path, "bytes": data_bytes},
+    }
+
+
+def chunk_loader_script(geometry_format, manifest):
+    """JS defining the (initially empty) map collection and ``decodeChunk`` for the shell page."""
+    decoders = {
+        "geojson": ("", "chunk"),
+        "topojson": (TOPOJSON_DECODER_JS, f"decodeTopology(chunk, '{TOPOLOGY_OBJECT}')"),
+        "compact": (COMPACT_DECODER_JS, "decodeCompactGeometry(chunk)"),
+    }
+    prelude, expression = decoders[geometry_format]
+    manifest_str = json.dumps(manifest, ensure_ascii=False, separators=(',', ':'))
+    return (prelude +
+            f"function decodeChunk(chunk) {{ return {expression}; }}\n"
+            f"const chunkManifest = {manifest_str};\n"
+            "const tokyoGeoJSON = { type: 'FeatureCollection', features: [] };")
+
+
+def run_nationwide(args):
+    """Build a shell page plus per-prefecture geometry/data chunks loaded on demand."""
+    started = time.perf_counter()
+    rent_map = load_rent_map(args.rent) if os.path.exists(args.rent) else {}
+
+    store_path = geometry_store_path(args.geojson, args.cache_dir)
+    groups = {}
+    prefecture_data = {}
+    with pipeline_module("geometry_store").GeometryStore(store_path) as store:
+        # Only properties are read here; geometry stays in the mapped file.
+        for row in range(len(store)):
+            feature = {"properties": store.properties(row)}
+            pref = prefecture_code(feature)
+            groups.setdefault(pref, []).append(row)
+            entry = municipality_entry(feature, rent_map)
+            if entry is not None:
+                prefecture_data.setdefault(pref, {})[feature["properties"]["code"]] = entry
+    # Ranks, stats and color classes are national, so they are computed over every chunk at once.
+    summary, extras = rent_summary({code: entry for data in prefecture_data.values() for code, entry in data.items()},
+                                   args.classification)
+    jobs = [(pref, store_path, rows, ranked_data(prefecture_data.get(pref, {}), extras),
+             args.geometry_format, args.output_dir)
+            for pref, rows in sorted(groups.items())]
+
+    os.makedirs(os.path.join(args.output_dir, "chunks"), exist_ok=True)
+    with ProcessPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        prefectures = dict(pool.map(build_prefecture_chunk, jobs))
+
+    manifest = {"geometry_format": args.geometry_format, "prefectures": prefectures}
+    shell_fragments = {
+        "css": render_css(),
+        "markup": render_markup(region="全国", heading="JAPAN"),
+        "geometry": chunk_loader_script(args.geometry_format, manifest),
+        "data": "{}",
+        "stats": json.dumps(summary, ensure_ascii=False, separators=(',', ':')),
+    }
+    # One shell per renderer; they share the chunks.
+    shells = {}
+    for renderer, shell_path in renderer_outputs(os.path.join(args.output_dir, "index.html"), args.renderers).items():
+        shell = render_html({**shell_fragments, "app": render_app_js(*NATIONWIDE_VIEW, renderer=renderer) + CHUNK_LOADER_JS},
+                            region="全国")
+        with open(shell_path, 'w', encoding='utf-8') as f:
+            f.write(shell)
+        shells[renderer] = {"path": os.path.basename(shell_path), "bytes": utf8_size(shell)}
+
+    geometry_total = sum(chunk["geometry"]["bytes"] for chunk in prefectures.values())
+    data_total = sum(chunk["data"]["bytes"] for chunk in prefectures.values())
+    manifest["shell"] = shells[args.renderers[0]]
+    manifest["shells"] = shells
+    manifest["totals"] = {"geometry": geometry_total, "data": data_total,
+                          "features": sum(chunk["features"] for chunk in prefectures.values())}
+    with open(os.path.join(args.output_dir, "manifest.json"), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    print(f"Generated {', '.join(shell['path'] for shell in shells.values())} in {args.output_dir} + "
+          f"{len(prefectures)} prefecture chunks in {time.perf_counter() - started:.2f} s")
+    for renderer, shell in shells.items():
+        print(f"  Shell ({renderer}): {shell['bytes']:,} bytes")
+    for pref, chunk in prefectures.items():
+        print(f"    {pref}: {chunk['features']:>4} features  geometry {chunk['geometry']['bytes']:>11,} bytes"
+              f"  data {chunk['data']['bytes']:>9,} bytes")
+    print(f"  Chunks total: geometry {geometry_total:,} bytes, data {data_total:,} bytes")
+
+
+def load_build_module():
+    """Import a fresh copy of this file so --watch picks up template and data edits."""
+    spec = importlib.util.spec_from_file_location("_tokyo_rental_map_build", os.path.abspath(__file__))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def watch_build(args):
+    # This script, the build engine and every pipeline module the fragment
+    # keys fingerprint; an edit to any of them reloads the code before rebuilding.
+    sources = [os.path.abspath(path) for path in [
+        __file__, os.path.join(SCRIPT_DIR, "build_engine.py"),
+        *pipeline_sources(GEOMETRY_SOURCES + STATS_SOURCES)]]
+    state = {"module": sys.modules[__name__]}
+
+    def rebuild(changed):
+        try:
+            if any(path in sources for path in changed):
+                # Imported modules would keep running the old code under the new keys.
+                for path in sources[1:]:
+                    sys.modules.pop(Path(path).stem, None)
+                state["module"] = load_build_module()
+            state["module"].run_build(args)
+        except Exception as exc:  # keep watching after a broken edit
+            print(f"Build failed: {exc!r}")
+
+    watch([os.path.abspath(args.geojson), *sources], rebuild)
 
-    # Write output
-    with open(OUTPUT_PATH, 'w', encoding='utf-8') as f:
-        f.write(html_content)
 
-    print(f"Generated {OUTPUT_PATH}")
-    print(f"  GeoJSON features: {len(geojson_data['features'])}")
-    print(f"  Municipality data entries: {len(MUNICIPALITY_DATA)}")
-    print(f"  File size: {os.path.getsize(OUTPUT_PATH):,} bytes")
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--geojson", default=GEOJSON_PATH,
+                        help="input GeoJSON FeatureCollection, TopoJSON Topology or "
+                             "snapshot (.snap) from scripts/fetch_geojson.py")
+    parser.add_argument("--output", default=OUTPUT_PATH)
+    parser.add_argument("--geometry-format", choices=GEOMETRY_FORMATS, default="geojson",
+                        help="how boundaries are embedded (topojson: shared arcs, "
+                             "compact: base64 fixed-point deltas; both decoded in the browser)")
+    parser.add_argument("--classification", choices=CLASSIFICATION_METHODS,
+                        default=DEFAULT_CLASSIFICATION,
+                        help="how rent class breaks are chosen (scripts/classify.py)")
+    parser.add_argument("--renderer", default="svg",
+                        help="Leaflet renderer: svg, canvas or both (comma separated; the first writes "
+                             "--output, the others <name>.<renderer>.html next to it)")
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help="fragment cache for incremental builds")
+    parser.add_argument("--jobs", type=int, default=4,
+                        help="fragments rendered concurrently (--nationwide: worker processes)")
+    parser.add_argument("--nationwide", action="store_true",
+                        help="write a shell page plus per-prefecture chunks to --output-dir")
+    parser.add_argument("--output-dir", default=NATIONWIDE_OUTPUT_DIR)
+    parser.add_argument("--rent", default=RENT_CSV_PATH,
+                        help="rent CSV or snapshot from scripts/fetch_rent_data.py (--nationwide)")
+    parser.add_argument("--watch", action="store_true",
+                        help="rebuild whenever the GeoJSON or the code behind the page changes")
+    parser.add_argument("--compare-parse", action="store_true",
+                        help="time decoding every geometry format with Node.js")
+    args = parser.parse_args()
+    # Repeated names are dropped (keeping the first), so the first renderer always writes --output.
+    args.renderers = list(RENDERERS) if args.renderer == "both" else list(dict.fromkeys(
+        renderer.strip() for renderer in args.renderer.split(",") if renderer.strip()))
+    unknown = [renderer for renderer in args.renderers if renderer not in RENDERERS]
+    if unknown or not args.renderers:
+        parser.error(f"--renderer: choose from {', '.join(RENDERERS)} or both")
+
+    if args.nationwide:
+        run_nationwide(args)
+        return
+    if args.watch:
+        watch_build(args)
+        return
+
+    run_build(args)
+
+    if args.compare_parse:
+        geojson_data = load_collection(args.geojson)
+        print(f"  GeoJSON features: {feature_count(geojson_data)}")
+        results = compare_parse_times(geojson_data)
+        if results is None:
+            print("  Parse comparison skipped: node not found")
+        else:
+            print("  Geometry parse time (node):")
+            for geometry_format, (size, ms) in results.items():
+                print(f"    {geometry_format:>8}: {size:>9,} bytes  {ms:7.2f} ms")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,127 @@
+"""
+Incremental build support for build.py.
+
+Every page fragment (geometry blob, data blob, CSS, markup, app JS) is keyed
+by a fingerprint of its inputs and cached on disk, so a rebuild only
+re-serializes the fragments whose inputs changed. Missing fragments are
+rendered concurrently.
+"""
+import glob
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+WATCH_INTERVAL = 0.2
+
+
+def fingerprint(*parts):
+    """Stable short hash of ``parts`` (bytes or anything with a str())."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:20]
+
+
+def file_fingerprint(path):
+    """Identify a (possibly very large) input file by path, size and mtime without reading it."""
+    stat = os.stat(path)
+    return fingerprint(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+def content_fingerprint(path):
+    """Hash of a file's bytes, or None when it does not exist."""
+    try:
+        with open(path, "rb") as f:
+            return fingerprint(f.read())
+    except FileNotFoundError:
+        return None
+
+
+class FragmentCache:
+    """Serialized fragments on disk, one file per fragment name and fingerprint."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, name, key):
+        return os.path.join(self.root, f"{name}-{key}.txt")
+
+    def load(self, name, key):
+        try:
+            with open(self.path(name, key), "r", encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def store(self, name, key, text):
+        os.makedirs(self.root, exist_ok=True)
+        path = self.path(name, key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+        # Only the latest version of each fragment is kept.
+        for stale in glob.glob(os.path.join(self.root, f"{name}-*.txt")):
+            if stale != path:
+                os.remove(stale)
+
+
+def render_fragments(specs, cache, jobs=4):
+    """Return ``(fragments, stages)`` for ``specs`` = {name: (fingerprint, builder)}.
+
+    ``stages`` maps each fragment name to ``(status, seconds)`` where status is
+    ``"cached"`` or ``"built"``.
+    """
+    fragments = {}
+    stages = {}
+    missing = []
+    for name, (key, builder) in specs.items():
+        started = time.perf_counter()
+        text = cache.load(name, key)
+        if text is None:
+            missing.append((name, key, builder))
+        else:
+            fragments[name] = text
+            stages[name] = ("cached", time.perf_counter() - started)
+
+    def run(item):
+        name, key, builder = item
+        started = time.perf_counter()
+        text = builder()
+        cache.store(name, key, text)
+        return name, text, time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        for name, text, seconds in pool.map(run, missing):
+            fragments[name] = text
+            stages[name] = ("built", seconds)
+    return fragments, stages
+
+
+def watch(paths, rebuild, interval=WATCH_INTERVAL):
+    """Call ``rebuild(changed_paths)`` once now and again whenever a file in ``paths`` changes."""
+
+    def stamps():
+        out = {}
+        for path in paths:
+            try:
+                out[path] = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                out[path] = None
+        return out
+
+    seen = stamps()
+    rebuild(list(paths))
+    print(f"Watching {len(paths)} files for changes (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(interval)
+            current = stamps()
+            changed = [path for path in paths if current[path] != seen[path]]
+            if changed:
+                seen = current
+                rebuild(changed)
+    except KeyboardInterrupt:
+        pass